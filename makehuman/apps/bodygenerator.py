@@ -0,0 +1,201 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+**Project Name:**      MakeHuman
+
+**Product Home Page:** http://www.makehuman.org/
+
+**Code Home Page:**    https://bitbucket.org/MakeHuman/makehuman/
+
+**Authors:**           Jonas Hauquier
+
+**Copyright(c):**      MakeHuman Team 2001-2017
+
+**Licensing:**         AGPL3
+
+    This file is part of MakeHuman (www.makehuman.org).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Abstract
+--------
+
+Headless body generation.
+
+The BodyGenerator loads the basemesh, skeleton and modifiers once, without
+starting the Qt application, the OpenGL canvas or any of the GUI plugins, and
+can then generate any number of bodies from (gender, height, bust, waist, hip)
+parameters within the same process. This performs the same steps as starting
+MakeHuman with these parameters, showing the Measure task and exporting with
+the OBJ exporter.
+"""
+
+import os
+
+from core import G
+import getpath
+import files3d
+import human
+import humanmodifier
+import skeleton
+import algos3d
+import targets
+import measure
+import log
+
+
+class HeadlessApplication(object):
+    """
+    Minimal stand-in for MHApplication, providing the few application
+    attributes and callbacks that the human, its modifiers and the progress
+    module expect to find in G.app.
+    """
+
+    def __init__(self):
+        self.selectedHuman = None
+        self.loadHandlers = {}
+        self.saveHandlers = []
+        self._settings = {'units': 'metric', 'targetCacheSize': 0}
+
+    def getSetting(self, setting_name):
+        return self._settings[setting_name]
+
+    def setSetting(self, setting_name, value):
+        self._settings[setting_name] = value
+
+    def progress(self, *args, **kwargs):
+        pass
+
+    def redraw(self):
+        pass
+
+    def processEvents(self):
+        pass
+
+
+class BodyGenerator(object):
+    """
+    Generates human bodies with the requested body sizes, reusing the same
+    loaded human, targets and modifiers for every body.
+    """
+
+    def __init__(self, units='metric', compileTargets=False, preloadTargets=False, threads=None, targetCacheSize=0):
+        """
+        With compileTargets, all macro targets are loaded and compiled into
+        one target basis up front (see Human.compileMacroTargets), which
+        speeds up generating large numbers of bodies at the cost of memory.
+        With preloadTargets, the macro and measure targets are loaded up front
+        by a pool of threads (see algos3d.preloadTargets), instead of while
+        generating the first body.
+        targetCacheSize limits the memory taken by the loaded targets to that
+        many megabytes (see algos3d.TargetCache), 0 for no limit. Preloaded
+        targets are pinned, so they are never evicted to stay within it.
+        """
+        if G.app is None:
+            G.app = HeadlessApplication()
+        elif not isinstance(G.app, HeadlessApplication):
+            raise RuntimeError('BodyGenerator cannot be used together with the MakeHuman GUI application')
+        G.app.setSetting('units', units)
+        G.app.setSetting('targetCacheSize', targetCacheSize)
+        self.units = units
+        algos3d.setTargetCacheSize(targetCacheSize)
+
+        log.message('Loading human')
+        mesh = files3d.loadMesh(getpath.getSysDataPath("3dobjs/base.obj"), maxFaces = 5)
+        self.human = human.Human(mesh)
+        G.app.selectedHuman = self.human
+
+        base_skel = skeleton.load(getpath.getSysDataPath('rigs/default.mhskel'), self.human.meshData)
+        self.human.setBaseSkeleton(base_skel)
+
+        log.message('Loading modifiers')
+        humanmodifier.loadModifiers(getpath.getSysDataPath('modifiers/modeling_modifiers.json'), self.human)
+        humanmodifier.loadModifiers(getpath.getSysDataPath('modifiers/measurement_modifiers.json'), self.human)
+        if preloadTargets:
+            log.message('Loading targets')
+            algos3d.preloadTargets(self.human.meshData, targets.getTargetPaths(targets.PRELOAD_GROUPS), threads)
+        if compileTargets:
+            self.human.compileMacroTargets()
+
+        self.ruler = measure.Ruler()
+
+    def generate(self, gender, height, bust, waist, hip):
+        """
+        Model the human to the specified gender (0 female, 1 male) and body
+        sizes (height, bust, waist and hip circumference in cm or inches,
+        depending on the units of this generator).
+        Returns the resulting vertex coordinates of the basemesh (a copy).
+        """
+        h = self.human
+        h.resetMeshValues()
+
+        h.setGender(gender, updateModifier=False)
+        h.custom_height = height
+        h.bust = bust
+        h.waist = waist
+        h.hip = hip
+
+        h.updateMacroModifiers()
+        h.applyAllTargets()
+
+        measure.fitBody(h, self.ruler, height, bust, waist, hip, self.units)
+
+        return h.meshData.coord.copy()
+
+    def getMeasures(self):
+        """
+        Height, bust, waist and hip measures of the current body.
+        """
+        h = self.human
+        return dict(height = h.getHeightCm(),
+                    bust = self.ruler.getMeasure(h, measure.getMeasureName('bust-circ'), self.units),
+                    waist = self.ruler.getMeasure(h, measure.getMeasureName('waist-circ'), self.units),
+                    hip = self.ruler.getMeasure(h, measure.getMeasureName('hips-circ'), self.units))
+
+    def exportObj(self, filepath, useNormals=False, feetOnGround=False, writeBinary=False):
+        """
+        Write the current body to an OBJ file, together with its .BodyInfo
+        file, like the OBJ exporter in the GUI does. With writeBinary, a
+        binary mesh file (.mhbin) is written as well.
+        """
+        import mh2obj
+        from export import ExportConfig
+
+        cfg = ExportConfig()
+        cfg.useNormals = useNormals
+        cfg.feetOnGround = feetOnGround
+        cfg.hiddenGeom = False
+        cfg.setHuman(self.human)
+
+        mh2obj.exportObj(filepath, cfg, notify=False, writeBinary=writeBinary)
+
+
+def generateBodies(requests, outputDir=None, units='metric', compileTargets=False, preloadTargets=False, targetCacheSize=0):
+    """
+    Generate a body for each (gender, height, bust, waist, hip) tuple in
+    requests. If an output folder is given, each body is exported as a
+    numbered OBJ file in that folder, otherwise the coordinates of the bodies
+    are returned as a list.
+    """
+    generator = BodyGenerator(units, compileTargets, preloadTargets, targetCacheSize=targetCacheSize)
+    result = []
+    for idx, (gender, height, bust, waist, hip) in enumerate(requests):
+        coord = generator.generate(gender, height, bust, waist, hip)
+        if outputDir:
+            generator.exportObj(os.path.join(outputDir, 'Body%04d.obj' % idx))
+        else:
+            result.append(coord)
+    return result
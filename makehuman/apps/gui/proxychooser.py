@@ -500,7 +500,9 @@ class ProxyChooserTaskView(gui3d.TaskView, filecache.MetadataCacher):
 
             self.showObjects() # Make sure objects are shown again after onHumanChanging events
             #log.debug("Human changed, adapting all proxies (event: %s)", event)
-            self.adaptAllProxies()
+            if event.change != 'targets':
+                # Proxies are fitted by the human on targets changes (see Human.updateProxyMeshes)
+                self.adaptAllProxies()
         if event.change in ['poseRefresh']:
             # Update subdivided proxies after posing
             for obj in self.getObjects():
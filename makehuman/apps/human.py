@@ -46,16 +46,26 @@ from getpath import getSysDataPath, canonicalPath
 import log
 import material
 import animation
+import humanmodifier
 
 from makehuman import getBasemeshVersion, getShortVersion, getVersionStr, getVersion
 
 
 class Human(guicommon.Object, animation.AnimatedMesh):
+
+    # Number of incremental target updates after which applyAllTargets
+    # rebuilds the mesh from scratch again
+    MAX_INCREMENTAL_UPDATES = 100
+
     def __init__(self, mesh, gender=1, height=160, bust=90, waist=70, hip=95):
         guicommon.Object.__init__(self, mesh)
 
         self.hasWarpTargets = False
 
+        # Values of the macro variables and modifier factors (see getFactorValues)
+        self._factorValues = np.zeros(humanmodifier.getFactorCount(), dtype=np.float64)
+        self._factorValues[0] = 1.0
+
         self.MIN_AGE = 1.0
         self.MAX_AGE = 90.0
         self.MID_AGE = 25.0
@@ -78,6 +88,11 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         self._resetProxies()
 
         self.targetsDetailStack = {}  # All details targets applied, with their values
+        self._macroTargetBasis = None  # Compiled macro targets (see compileMacroTargets)
+        self._macroTargetWeights = None  # Macro modifiers and their compiled targets (see updateMacroModifiers)
+        self._appliedTargets = None  # Weights (and target generations) applied to the mesh by applyAllTargets
+        self._incrementalUpdates = 0
+        self._updatedCoords = None  # Rest coordinates of the mesh at the last fullUpdate
         self.symmetryModeEnabled = False
 
         self.setDefaultValues()
@@ -864,16 +879,64 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         elif name in self.targetsDetailStack:
             del self.targetsDetailStack[name]
 
+    def setDetails(self, names, values):
+        """
+        Set the weights of multiple targets at once. Unlike setDetail, the
+        names must already be canonical paths.
+        """
+        for name, value in zip(names, values.tolist()):
+            if value:
+                self.targetsDetailStack[name] = value
+            elif name in self.targetsDetailStack:
+                del self.targetsDetailStack[name]
+
+    def getFactorValues(self):
+        """
+        Vector with the values of all factors that target weights depend on,
+        indexed by factor id (see humanmodifier.TargetWeights). The macro
+        variables (like maleVal) are stored in it by their setters, the other
+        factors are set by the modifiers before computing their weights.
+        """
+        count = humanmodifier.getFactorCount()
+        if len(self._factorValues) < count:
+            # Factors added by modifiers compiled since
+            values = np.zeros(count, dtype=np.float64)
+            values[:len(self._factorValues)] = self._factorValues
+            self._factorValues = values
+        return self._factorValues
+
     def getDetail(self, name):
         name = canonicalPath(name)
         return self.targetsDetailStack.get(name, 0.0)
 
     def updateMacroModifiers(self):
         """Update the targetsDetailStack for this human
-        determined by the macromodifier target combinations."""
-        for modifier in self.modifiers:
-            if modifier.isMacro():
-                modifier.setValue(modifier.getValue())
+        determined by the macromodifier target combinations.
+        The targets of all macro modifiers are compiled together, so that
+        their weights are computed at once, after all macro variables are set.
+        """
+        macroModifiers = [m for m in self.modifiers if m.isMacro()]
+        dependentModifiers = []
+        for modifier in macroModifiers:
+            getattr(self, modifier.setter)(modifier.clampValue(modifier.getValue()), updateModifier=False)
+            # Modifiers depending on the macro variables (see Modifier.propagateUpdate)
+            for dependentModifierGroup in self.getModifiersAffectedBy(modifier):
+                m = self.getModifiersByGroup(dependentModifierGroup)[0]
+                if not m.isMacro() and m not in dependentModifiers:
+                    dependentModifiers.append(m)
+
+        if self._macroTargetWeights is None or self._macroTargetWeights[0] != macroModifiers:
+            targets = [target for m in macroModifiers for target in m.targets]
+            self._macroTargetWeights = (macroModifiers, humanmodifier.TargetWeights(targets))
+        compiled = self._macroTargetWeights[1]
+
+        factorValues = self.getFactorValues()
+        for modifier in macroModifiers:
+            factorValues = modifier.getFactorValues(modifier.getValue())
+        self.setDetails(compiled.paths, compiled.evaluate(factorValues))
+
+        for m in dependentModifiers:
+            m.setValue(m.getValue(), skipDependencies = True)
 
     @property
     def modifiers(self):
@@ -1100,58 +1163,203 @@ class Human(guicommon.Object, animation.AnimatedMesh):
 
         # First call progress callback (which often processes events) before resetting mesh
         # so that mesh is not drawn in its reset state
-        algos3d.resetObj(self.meshData)  # Reset mesh is in rest pose
+        changes = self._getTargetChanges()
+        if changes is None:
+            # Rebuild the mesh from scratch
+            algos3d.resetObj(self.meshData)  # Reset mesh is in rest pose
+            self._appliedTargets = {}
+            self._incrementalUpdates = 0
+            changes = dict(self.targetsDetailStack)
+        else:
+            # Only apply the weight changes since the previous update
+            self._incrementalUpdates += 1
 
         # Apply targets to seedmesh coordinates
-        itprog = Progress(len(self.targetsDetailStack))
-        for (targetPath, morphFactor) in self.targetsDetailStack.iteritems():
+        if self._macroTargetBasis:
+            weights, details = self._macroTargetBasis.getWeights(changes)
+            self._macroTargetBasis.apply(self.meshData, weights)
+        else:
+            details = changes
+        itprog = Progress(len(details))
+        for (targetPath, morphFactor) in details.iteritems():
             algos3d.loadTranslationTarget(self.meshData, targetPath, morphFactor, None, 0, 0) # mj - size modification of the human
             itprog.step()
 
+        for targetPath in changes:
+            weight = self.getDetail(targetPath)
+            if weight:
+                generation = None if targetPath not in details else algos3d.getTargetGeneration(targetPath)
+                self._appliedTargets[targetPath] = (weight, generation)
+            else:
+                self._appliedTargets.pop(targetPath, None)
+
         progress(0.5, 1.0)
         self.fullUpdate(update)
 
         progress(1.0)
 
+    def _getTargetChanges(self):
+        """
+        The changes in target weights since the targets were last applied to
+        the mesh, as a dict of target path and weight difference.
+        Returns None when the mesh has to be rebuilt from scratch instead:
+        when the applied targets are not known, the human is posed, the
+        target data changed (eg. a reloaded custom target), there are more
+        changes than targets, or after MAX_INCREMENTAL_UPDATES incremental
+        updates (to bound the accumulation of rounding errors).
+        """
+        if self._appliedTargets is None or self.isPosed() or \
+           self._incrementalUpdates >= self.MAX_INCREMENTAL_UPDATES:
+            return None
+
+        changes = {}
+        for targetPath, weight in self.targetsDetailStack.iteritems():
+            if targetPath not in self._appliedTargets:
+                changes[targetPath] = weight
+        for targetPath, (weight, generation) in self._appliedTargets.iteritems():
+            if generation is not None and algos3d.getTargetGeneration(targetPath) != generation:
+                return None
+            delta = self.getDetail(targetPath) - weight
+            if delta:
+                changes[targetPath] = delta
+
+        if len(changes) > len(self.targetsDetailStack):
+            return None
+        return changes
+
+    def trackAppliedTarget(self, targetPath, morphFactor):
+        """
+        Register that a target was added to the mesh with the specified weight
+        outside of applyAllTargets (eg. by Modifier.updateValue), so that the
+        next applyAllTargets does not apply it again.
+        """
+        if self._appliedTargets is None:
+            return
+        if self.isPosed():
+            # Applied to the posed mesh, not to the rest coordinates
+            self._appliedTargets = None
+            return
+
+        targetPath = canonicalPath(targetPath)
+        weight, generation = self._appliedTargets.get(targetPath, (0.0, None))
+        current = algos3d.getTargetGeneration(targetPath)
+        if generation is not None and current != generation:
+            self._appliedTargets = None
+            return
+        weight += morphFactor
+        if weight:
+            self._appliedTargets[targetPath] = (weight, current)
+        else:
+            self._appliedTargets.pop(targetPath, None)
+
+    def compileMacroTargets(self):
+        """
+        Compile all targets controlled by the macro modifiers of this human
+        into one target basis, so that applyAllTargets applies all of them
+        with a single matrix product. Call this after loading the modifiers.
+        This is useful when generating many humans, as this basis takes more
+        memory than the individual targets (the macro targets affect most of
+        the basemesh).
+        The compiled targets are not reloaded when the target files change,
+        call compileMacroTargets again or removeCompiledMacroTargets.
+        """
+        targetPaths = []
+        for modifier in self.modifiers:
+            if modifier.isMacro():
+                targetPaths.extend(tpath for tpath, _ in modifier.targets)
+        self._macroTargetBasis = algos3d.TargetBasis(self.meshData, targetPaths)
+        self._appliedTargets = None
+        log.debug("Compiled %s macro targets on %s vertices (%s bytes)", len(self._macroTargetBasis), len(self._macroTargetBasis.verts), self._macroTargetBasis.nbytes)
+
+    def removeCompiledMacroTargets(self):
+        """
+        Apply the macro targets individually again.
+        """
+        self._macroTargetBasis = None
+        self._appliedTargets = None
+
+    def updateProxyMeshes(self, changedVertices=None):
+        """
+        Fit the body proxy and all proxy objects (clothes, hair, eyes, ...) to
+        the rest pose of the human. When a mask of changedVertices is given,
+        only the proxies that depend on them are fitted, and those that were
+        last fitted to the posed mesh or with the fast approximation.
+        """
+        if self.proxy and self.getProxyMesh():
+            # Subdivision is updated by fullUpdate
+            self._updateProxyMesh(self.proxy, self.getProxyMesh(), None, changedVertices)
+        for pxy in self.getProxies(includeHumanProxy=False):
+            self._updateProxyMesh(pxy, pxy.object.getSeedMesh(), pxy.object, changedVertices)
+
+    def _updateProxyMesh(self, pxy, mesh, obj, changedVertices):
+        if changedVertices is not None and pxy.fitted_to_rest and \
+           not pxy.dependsOnVertices(changedVertices):
+            return
+        pxy.update(mesh)
+        mesh.update()
+        if obj and obj.isSubdivided():
+            obj.getSubdivisionMesh()
+
+    def _getChangedVertices(self):
+        """
+        Mask of the vertices that moved since the last fullUpdate, or None if
+        everything needs to be updated.
+        """
+        if self._updatedCoords is None or len(self._updatedCoords) != len(self.meshData.coord):
+            return None
+        return np.any(self.meshData.coord != self._updatedCoords, axis=1)
+
     def fullUpdate(self, update=True):
         """
         Update all aspects that depend on the human base mesh geometry in proper
         order.
         When update=True, the updated mesh coordinates are uploaded to the OpenGL
         buffer.
+        Only the aspects that depend on vertices that moved since the last
+        fullUpdate are updated: the body proxy and skeleton joints are only
+        refitted if their reference vertices moved, and the subdivision mesh
+        is only rebuilt if any vertex moved. The changed vertices are passed
+        to the onChanged event as event.vertices (None if all changed).
         """
         progress = Progress()
+        changed = self._getChangedVertices()
 
         # Update seedmesh normals (required for new proxy fitting)
         # Normals are recalculated again later if a pose is applied
         # TODO optimization is possible: only execute this if new-style proxies are applied or if no pose is set
         # TODO alternative optimization: only execute if no pose is set, apply new-style proxies after pose is applied
-        self.meshData.calcNormals(1, 1)
+        # Only the normals around the vertices that moved since the last update are recalculated
+        self.meshData.updateNormals()
         progress(0.1)
 
         # Make sure self.getRestposeCoordinates is up-to-date directly (required for proxy fitting)
         self._updateOriginalMeshCoords(self.meshData.name, self.meshData.coord)
+        self._updatedCoords = self.meshData.coord.copy()
 
-        # Update (body) proxy
-        self.updateProxyMesh()
-        # Note that other proxy mesh updates are not calculated here but 
-        # propagated through the onChange event in the proxychooser gui app.
+        # Update body proxy and proxy objects
+        self.updateProxyMeshes(changed)
 
         #self.traceStack(all=True)
         #self.traceBuffer(all=True, vertsToList=0)
         progress(0.2)
 
         # Update skeleton joint positions (before human is posed)
+        jointsChanged = False
         if self.getBaseSkeleton():
-            log.debug("Updating skeleton joint positions")
-            self.getBaseSkeleton().updateJoints(self.meshData)
-            self.resetBakedAnimations()    # TODO decide whether we require calling this manually, or whether animatedMesh automatically tracks updates of skeleton and updates accordingly
+            if changed is None or changed[self.getBaseSkeleton().getJointVertices(self)].any():
+                log.debug("Updating skeleton joint positions")
+                self.getBaseSkeleton().updateJoints(self.meshData)
+                self.resetBakedAnimations()    # TODO decide whether we require calling this manually, or whether animatedMesh automatically tracks updates of skeleton and updates accordingly
+                jointsChanged = True
         progress(0.3)
 
         if self.skeleton:
-            self.skeleton.dirty = True
+            if jointsChanged or changed is None or changed[self.skeleton.getJointVertices(self)].any():
+                self.skeleton.dirty = True
 
-        self.callEvent('onChanged', events3d.HumanEvent(self, 'targets'))
+        event = events3d.HumanEvent(self, 'targets')
+        event.vertices = changed
+        self.callEvent('onChanged', event)
         # Proxy updates and most additional updates performed by plugins happen here
         progress(0.4)
 
@@ -1162,9 +1370,10 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         # Update subdivision mesh
         if self.isSubdivided():
             progress(0.5)
-            self.updateSubdivisionMesh()
-            progress(0.7)
-            self.mesh.calcNormals()
+            if changed is None or changed.any():
+                self.updateSubdivisionMesh()
+                progress(0.7)
+                self.mesh.calcNormals()
             progress(0.8)
             if update:
                 self.mesh.update()
@@ -1325,6 +1534,7 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         """
         self.callEvent('onChanging', events3d.HumanEvent(self, 'skeleton'))
         animation.AnimatedMesh.setBaseSkeleton(self, skel)
+        self._updatedCoords = None  # Fit the joints of the new skeleton at the next update
         self.updateVertexWeights(skel.getVertexWeights() if skel else None)
         self.callEvent('onChanged', events3d.HumanEvent(self, 'skeleton'))
         self.refreshPose()
@@ -1602,3 +1812,23 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         f.close()
         progress(1)
         self.callEvent('onChanged', event)
+
+
+def _macroVariableProperty(variable):
+    """
+    Property for the value of a macro variable (like maleVal), stored in the
+    factor values of the human (see Human.getFactorValues).
+    """
+    factorId = humanmodifier.getFactorId(variable)
+
+    def getter(self):
+        return float(self._factorValues[factorId])
+
+    def setter(self, value):
+        self._factorValues[factorId] = value
+
+    return property(getter, setter)
+
+for _variable in humanmodifier.getMacroVariables():
+    setattr(Human, _variable + 'Val', _macroVariableProperty(_variable))
+del _variable
@@ -43,9 +43,11 @@ import guicommon
 from core import G
 import events3d
 import operator
+from collections import OrderedDict
 import numpy as np
 import log
 import targets
+from getpath import canonicalPath
 
 
 # Gender
@@ -177,6 +179,8 @@ class Modifier(object):
         self._defaultValue = 0
 
         self.human = None
+        self._compiledTargets = None
+        self._modifierFactorIds = None
 
     def setHuman(self, human):
         self.human = human
@@ -194,11 +198,9 @@ class Modifier(object):
 
     def setValue(self, value, skipDependencies=False):
         value = self.clampValue(value)
-        factors = self.getFactors(value)
 
-        tWeights = getTargetWeights(self.targets, factors, value)
-        for tpath, tWeight in tWeights.items():
-            self.human.setDetail(tpath, tWeight)
+        compiled = self.getCompiledTargets()
+        self.human.setDetails(compiled.paths, compiled.evaluate(self.getFactorValues(value), value))
 
         if skipDependencies:
             return
@@ -235,6 +237,45 @@ class Modifier(object):
     def getFactors(self, value):
         raise NotImplementedError()
 
+    def getModifierFactorNames(self):
+        """
+        The names of the factors that depend on the value of this modifier,
+        rather than on the macro variables of the human.
+        """
+        return []
+
+    def getModifierFactorValues(self, value):
+        """
+        The values of the factors named by getModifierFactorNames, for the
+        specified modifier value.
+        """
+        return []
+
+    def getModifierFactorIds(self):
+        if self._modifierFactorIds is None:
+            self._modifierFactorIds = [getFactorId(factor) for factor in self.getModifierFactorNames()]
+        return self._modifierFactorIds
+
+    def getFactorValues(self, value):
+        """
+        The factor values of the human (see Human.getFactorValues), with the
+        factors of this modifier set for the specified value.
+        """
+        factorIds = self.getModifierFactorIds()
+        factorValues = self.human.getFactorValues()
+        for factorId, factorValue in zip(factorIds, self.getModifierFactorValues(value)):
+            factorValues[factorId] = factorValue
+        return factorValues
+
+    def getCompiledTargets(self):
+        """
+        The targets of this modifier, compiled for computing their weights
+        (see TargetWeights).
+        """
+        if self._compiledTargets is None or self._compiledTargets.targets is not self.targets:
+            self._compiledTargets = TargetWeights(self.targets)
+        return self._compiledTargets
+
     def getValue(self):
         return sum([self.human.getDetail(target[0]) for target in self.targets])
 
@@ -275,6 +316,7 @@ class Modifier(object):
             else:
                 animatedMesh = None
             algos3d.loadTranslationTarget(self.human.meshData, target[0], new - old, None, 0, 0, animatedMesh=animatedMesh)
+            self.human.trackAppliedTarget(target[0], new - old)
 
         if skipUpdate:
             # Used for dependency updates (avoid dependency loops and double updates to human)
@@ -374,6 +416,12 @@ class SimpleModifier(Modifier):
 
         return factors
 
+    def getModifierFactorNames(self):
+        return ['dummy']
+
+    def getModifierFactorValues(self, value):
+        return [1.0]
+
     def clampValue(self, value):
         return max(0.0, min(1.0, value))
 
@@ -460,11 +508,9 @@ class ManagedTargetModifier(Modifier):
 
     def setValue(self, value, skipDependencies=False):
         value = self.clampValue(value)
-        factors = self.getFactors(value)
 
-        tWeights = getTargetWeights(self.targets, factors)
-        for tpath, tWeight in tWeights.items():
-            self.human.setDetail(tpath, tWeight)
+        compiled = self.getCompiledTargets()
+        self.human.setDetails(compiled.paths, compiled.evaluate(self.getFactorValues(value)))
 
         if skipDependencies:
             return
@@ -479,11 +525,17 @@ class ManagedTargetModifier(Modifier):
         else:
             return -sum([self.human.getDetail(target[0]) for target in self.l_targets])
 
-    _variables = targets._value_cat.keys()
-
     def getFactors(self, value):
-        return dict((name, getattr(self.human, name + 'Val'))
-                    for name in self._variables)
+        factors = getMacroFactors(self.human)
+        factors.update(self.getModifierFactors(value))
+        return factors
+
+    def getModifierFactors(self, value):
+        """
+        The factors that depend on the value of this modifier, rather than on
+        the macro variables of the human, as dict.
+        """
+        return dict(zip(self.getModifierFactorNames(), self.getModifierFactorValues(value)))
 
 class UniversalModifier(ManagedTargetModifier):
     """
@@ -533,16 +585,19 @@ class UniversalModifier(ManagedTargetModifier):
         else:
             return 0.0
 
-    def getFactors(self, value):
-        factors = super(UniversalModifier, self).getFactors(value)
+    def getModifierFactorNames(self):
+        return [factor for factor in [self.left, self.center, self.right] if factor is not None]
+
+    def getModifierFactorValues(self, value):
+        values = []
 
         if self.left is not None:
-            factors[self.left] = -min(value, 0.0)
+            values.append(-min(value, 0.0))
         if self.center is not None:
-            factors[self.center] = 1.0 - abs(value)
-        factors[self.right] = max(0.0, value)
+            values.append(1.0 - abs(value))
+        values.append(max(0.0, value))
 
-        return factors
+        return values
 
 class MacroModifier(ManagedTargetModifier):
     """
@@ -604,10 +659,11 @@ class MacroModifier(ManagedTargetModifier):
     def clampValue(self, value):
         return max(0.0, min(1.0, value))
 
-    def getFactors(self, value):
-        factors = super(MacroModifier, self).getFactors(value)
-        factors[self.groupName] = 1.0
-        return factors
+    def getModifierFactorNames(self):
+        return [self.groupName]
+
+    def getModifierFactorValues(self, value):
+        return [1.0]
 
     def buildLists(self):
         pass
@@ -641,6 +697,78 @@ class EthnicModifier(MacroModifier):
         self.human.blockEthnicUpdates = _tmp
         return oldVals
 
+# Ids of the factors that target weights depend on (the macro variables and the
+# factors of the modifiers), shared by all compiled targets (see TargetWeights)
+# and indexing the factor values of the humans (see Human.getFactorValues).
+# Id 0 refers to the constant 1.0.
+_factorIds = {}
+
+def getFactorId(factor):
+    """
+    The id of a factor, a new id is assigned to factors that have none yet.
+    """
+    factorId = _factorIds.get(factor)
+    if factorId is None:
+        factorId = _factorIds[factor] = len(_factorIds) + 1
+    return factorId
+
+def getFactorCount():
+    """
+    Length of a vector of factor values, the number of factor ids including
+    the constant.
+    """
+    return len(_factorIds) + 1
+
+class TargetWeights(object):
+    """
+    The targets of one or more modifiers, compiled into a matrix with the ids
+    of the factors each target weight depends on (see getFactorId). The
+    weights of all targets are computed with one vectorized product over the
+    factor values of the human, instead of multiplying the factor values looked
+    up per target (see getTargetWeights).
+    """
+
+    def __init__(self, targets):
+        """
+        targets is a list of (targetpath, factordependencies) tuples, as in
+        Modifier.targets. Targets that occur more than once are evaluated once.
+        """
+        self.targets = targets
+
+        tfactorsByPath = OrderedDict()
+        for (tpath, tfactors) in targets:
+            tfactorsByPath[canonicalPath(tpath)] = tfactors
+        self.paths = tfactorsByPath.keys()
+
+        # Unused entries refer to the constant 1.0
+        width = max([len(tfactors) for tfactors in tfactorsByPath.values()] or [1])
+        self.indices = np.zeros((len(self.paths), width), dtype=np.int32)
+        for tIdx, tfactors in enumerate(tfactorsByPath.values()):
+            self.indices[tIdx,:len(tfactors)] = [getFactorId(factor) for factor in tfactors]
+
+    def evaluate(self, factorValues, value = 1.0):
+        """
+        The weights of the targets (in the order of paths), for a vector of
+        factor values indexed by factor id (see Human.getFactorValues).
+        """
+        return value * factorValues[self.indices].prod(axis=1)
+
+def getMacroFactors(human):
+    """
+    The values of all macro variables of the human, as factors dict.
+    """
+    return dict((name, getattr(human, name + 'Val'))
+                for name in _macroVariables)
+
+_macroVariables = targets._value_cat.keys()
+
+def getMacroVariables():
+    """
+    The names of all macro variables (the human has their values as attributes
+    with the Val suffix, like maleVal).
+    """
+    return list(_macroVariables)
+
 def getTargetWeights(targets, factors, value = 1.0, ignoreNotfound = False):
     result = dict()
     if ignoreNotfound:
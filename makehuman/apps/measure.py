@@ -0,0 +1,366 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+**Project Name:**      MakeHuman
+
+**Product Home Page:** http://www.makehuman.org/
+
+**Code Home Page:**    https://bitbucket.org/MakeHuman/makehuman/
+
+**Authors:**           Marc Flerackers
+
+**Copyright(c):**      MakeHuman Team 2001-2017
+
+**Licensing:**         AGPL3
+
+    This file is part of MakeHuman (www.makehuman.org).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Abstract
+--------
+
+Body measurements on the human basemesh, and fitting of the measurement
+modifiers to a set of desired body sizes.
+This module has no GUI dependencies, it is used both by the Measure task in
+the Modelling tab and by the headless body generator.
+"""
+
+import math
+import numpy as np
+import algos3d
+import humanmodifier
+import log
+
+
+class Ruler:
+
+    """
+  This class contains ...
+  """
+
+    def __init__(self):
+
+        # these are tables of vertex indices for each body measurement of interest
+        # TODO define in data file?
+
+        self.Measures = {}
+        self.Measures['measure/measure-neck-circ-decr|incr'] = [7514,10358,7631,7496,7488,7489,7474,7475,7531,7537,7543,7549,7555,7561,7743,7722,856,1030,1051,850,844,838,832,826,820,756,755,770,769,777,929,3690,804,800,808,801,799,803,7513,7515,7521,7514]
+        self.Measures['measure/measure-neck-height-decr|incr'] = [853,854,855,856,857,858,1496,1491]
+
+
+        self.Measures['measure/measure-upperarm-circ-decr|incr']=[8383,8393,8392,8391,8390,8394,8395,8399,10455,10516,8396,8397,8398,8388,8387,8386,10431,8385,8384,8389]
+        self.Measures['measure/measure-upperarm-length-decr|incr'] = [8274,10037]
+
+        self.Measures['measure/measure-lowerarm-length-decr|incr'] = [10040,10548]
+        self.Measures['measure/measure-wrist-circ-decr|incr']=[10208,10211,10212,10216,10471,10533,10213,10214,10215,10205,10204,10203,10437,10202,10201,10206,10200,10210,10209,10208]
+
+        self.Measures['measure/measure-frontchest-dist-decr|incr']=[1437,8125]
+        self.Measures['measure/measure-bust-circ-decr|incr']=[8439,8455,8462,8446,8478,8494,8557,8510,8526,8542,10720,10601,10603,10602,10612,10611,10610,10613,10604,10605,10606,3942,3941,3940,3950,3947,3948,3949,3938,3939,3937,4065,1870,1854,1838,1885,1822,1806,1774,1790,1783,1767,1799,8471]
+        self.Measures['measure/measure-underbust-circ-decr|incr'] = [10750,10744,10724,10725,10748,10722,10640,10642,10641,10651,10650,10649,10652,10643,10644,10645,10646,10647,10648,3988,3987,3986,3985,3984,3983,3982,3992,3989,3990,3991,3980,3981,3979,4067,4098,4073,4072,4094,4100,4082,4088, 4088]
+        self.Measures['measure/measure-waist-circ-decr|incr'] = [4121,10760,10757,10777,10776,10779,10780,10778,10781,10771,10773,10772,10775,10774,10814,10834,10816,10817,10818,10819,10820,10821,4181,4180,4179,4178,4177,4176,4175,4196,4173,4131,4132,4129,4130,4128,4138,4135,4137,4136,4133,4134,4108,4113,4118,4121]
+        self.Measures['measure/measure-napetowaist-dist-decr|incr']=[1491,4181]
+        self.Measures['measure/measure-waisttohip-dist-decr|incr']=[4121,4341]
+        self.Measures['measure/measure-shoulder-dist-decr|incr'] = [7478,8274]
+
+        self.Measures['measure/measure-hips-circ-decr|incr'] = [4341,10968,10969,10971,10970,10967,10928,10927,10925,10926,10923,10924,10868,10875,10861,10862,4228,4227,4226,4242,4234,4294,4293,4296,4295,4297,4298,4342,4345,4346,4344,4343,4361,4341]
+
+        self.Measures['measure/measure-upperleg-height-decr|incr'] = [10970,11230]
+        self.Measures['measure/measure-thigh-circ-decr|incr'] = [11071,11080,11081,11086,11076,11077,11074,11075,11072,11073,11069,11070,11087,11085,11084,12994,11083,11082,11079,11071]
+
+        self.Measures['measure/measure-lowerleg-height-decr|incr'] = [11225,12820]
+        self.Measures['measure/measure-calf-circ-decr|incr'] = [11339,11336,11353,11351,11350,13008,11349,11348,11345,11337,11344,11346,11347,11352,11342,11343,11340,11341,11338,11339]
+
+        self.Measures['measure/measure-ankle-circ-decr|incr'] = [11460,11464,11458,11459,11419,11418,12958,12965,12960,12963,12961,12962,12964,12927,13028,12957,11463,11461,11457,11460]
+        self.Measures['measure/measure-knee-circ-decr|incr'] = [11223,11230,11232,11233,11238,11228,11229,11226,11227,11224,11225,11221,11222,11239,11237,11236,13002,11235,11234,11223]
+
+
+        self._validate()
+        self.compile()
+
+    def _validate(self):
+        """
+        Verify currectness of ruler specification
+        """
+        names = []
+        for n,v in self.Measures.items():
+            if len(v) % 2 != 0:
+                names.append(n)
+        if len(names) > 0:
+            raise RuntimeError("One or more measurement rulers contain an uneven number of vertex indices. It's required that they are pairs indicating the begin and end point of every line to draw. Rulers with uneven index count: %s" % ", ".join(names))
+
+    def compile(self):
+        """
+        Compile the vertex lists of all measurements into contiguous arrays of
+        (start, end) vertex index pairs of the line segments that are summed
+        for each measurement. Needs to be called again when Measures is
+        changed.
+        """
+        self._segments = {}
+        self._compiled = {}
+        for name, vertidx in self.Measures.items():
+            vertidx = np.asarray(vertidx, dtype=np.int32)
+            self._segments[name] = (vertidx[:-1], vertidx[1:])
+
+    def getSegments(self, measurementnames):
+        """
+        Start and end vertex indices of all line segments of the specified
+        measurements, and the offset of the first segment of each measurement
+        in these arrays.
+        """
+        measurementnames = tuple(measurementnames)
+        try:
+            return self._compiled[measurementnames]
+        except KeyError:
+            pass
+        starts = np.concatenate([self._segments[name][0] for name in measurementnames])
+        ends = np.concatenate([self._segments[name][1] for name in measurementnames])
+        counts = [len(self._segments[name][0]) for name in measurementnames]
+        offsets = np.zeros(len(counts), dtype=np.int32)
+        offsets[1:] = np.cumsum(counts)[:-1]
+        self._compiled[measurementnames] = (starts, ends, offsets)
+        return self._compiled[measurementnames]
+
+    def getMeasures(self, coord, measurementnames=None, mode='metric'):
+        """
+        Evaluate several measurements in one pass.
+        coord is either a (nverts, 3) array of vertex coordinates, or a
+        (N, nverts, 3) stack of coordinates of N bodies with the same topology.
+        Returns an array with the measurements in the order of
+        measurementnames (all measurements, sorted by name, if None), with an
+        extra leading axis of length N for a stack of bodies.
+        """
+        if measurementnames is None:
+            measurementnames = sorted(self.Measures.keys())
+        starts, ends, offsets = self.getSegments(measurementnames)
+
+        coord = np.asarray(coord)
+        segments = coord[..., ends, :] - coord[..., starts, :]
+        lengths = np.sqrt(np.sum(segments * segments, axis=-1))
+        measure = np.add.reduceat(lengths, offsets, axis=-1, dtype=np.float64)
+
+        if mode == 'metric':
+            return 10.0 * measure
+        else:
+            return 10.0 * measure * 0.393700787 # mj - conversion to cm
+
+    def getMeasure(self, human, measurementname, mode):
+        return float(self.getMeasures(human.meshData.coord, [measurementname], mode)[0])
+
+
+def getMeasureName(feature):
+    """
+    Name of the measurement (and measure modifier) for a feature, eg.
+    'hips-circ' maps to 'measure/measure-hips-circ-decr|incr'.
+    """
+    return "measure/measure-" + feature + "-decr|incr"
+
+def fitMeasure(human, ruler, feature, goal, units='metric'):
+    """
+    Find the value of the measure modifier for the specified feature (eg.
+    'hips-circ') for which the measured length on the human comes closest to
+    goal (in cm or inches depending on units), using a bisection search on the
+    slider value. The targets are applied to the mesh of the human
+    incrementally, the modifier value that was found is returned.
+    """
+    measurement = getMeasureName(feature)
+
+    modif = 0.0 # curr position of the slider
+    modifier = humanmodifier.UniversalModifier('measure', "measure-"+feature, 'decr', 'incr')
+    # Not attached to the human, that would conflict with the measure
+    # modifier loaded from the modifier definitions
+    modifier.human = human
+
+    l = ruler.getMeasure(human, measurement, units)
+    minValue = -1.0
+    maxValue = 1.0
+
+    tries = 10
+    while tries:
+        if math.fabs(l - goal) < 0.01:
+            break
+        if goal < l:
+            maxValue = modif
+            if l == minValue:
+                break
+            modif = minValue + (modif- minValue) / 2.0
+            modifier.updateValue(modif, 0)
+            l = ruler.getMeasure(human, measurement, units)
+        else: # l < goal
+            minValue = modif
+            if goal == maxValue:
+                break
+            modif = modif + (maxValue - modif) / 2.0
+            modifier.updateValue(modif, 0)
+            l = ruler.getMeasure(human, measurement, units)
+        tries -= 1
+
+    log.debug("Fitted %s: goal %s, final %s", feature, goal, l)
+    return modif
+
+class MeasureSolver(object):
+    """
+    Fits several measure modifiers at once.
+
+    The measure targets of all features are applied to a small working copy of
+    only the vertices used by the rulers of these features, so that the
+    measurements can be evaluated for any combination of modifier values
+    without touching the human mesh. Each measurement is a sum of polyline
+    segment lengths, and each measure modifier moves the vertices linearly
+    (with a different target for negative and positive values), which makes
+    the Jacobian of the measurements to the modifier values cheap to compute
+    from the target deltas. All modifier values are solved together with a few
+    Gauss-Newton iterations, so that fitting one measurement does not undo an
+    earlier fit of another one that is affected by the same targets.
+    Only the final values are applied to the human.
+    """
+
+    def __init__(self, human, ruler, features, units='metric'):
+        self.human = human
+        self.ruler = ruler
+        self.features = list(features)
+        self.measurements = [getMeasureName(feature) for feature in self.features]
+        self.scale = 10.0 if units == 'metric' else 10.0 * 0.393700787
+
+        self.modifiers = []
+        for feature in self.features:
+            modifier = humanmodifier.UniversalModifier('measure', "measure-"+feature, 'decr', 'incr')
+            modifier.human = human
+            self.modifiers.append(modifier)
+
+        # Working set of vertices, and ruler index lists into that set
+        allVerts = np.concatenate([self.ruler.Measures[m] for m in self.measurements])
+        self.verts = np.unique(allVerts)
+        lookup = np.zeros(human.meshData.getVertexCount(), dtype=np.int32) - 1
+        lookup[self.verts] = np.arange(len(self.verts))
+        starts, ends, self.offsets = self.ruler.getSegments(self.measurements)
+        self.starts = lookup[starts]
+        self.ends = lookup[ends]
+
+        # Offset of the working vertices for a modifier value of -1 and 1
+        nVerts = len(self.verts)
+        self.decrDeltas = np.zeros((len(self.modifiers), nVerts, 3), dtype=np.float64)
+        self.incrDeltas = np.zeros((len(self.modifiers), nVerts, 3), dtype=np.float64)
+        for mIdx, modifier in enumerate(self.modifiers):
+            self._addDeltas(self.decrDeltas[mIdx], modifier.l_targets, modifier.getFactors(-1.0), lookup)
+            self._addDeltas(self.incrDeltas[mIdx], modifier.r_targets, modifier.getFactors(1.0), lookup)
+
+        # Current state of the human
+        self.startValues = np.asarray([modifier.getValue() for modifier in self.modifiers], dtype=np.float64)
+        self.base = human.meshData.coord[self.verts].astype(np.float64) - self._offsets(self.startValues)
+        self._upHint = np.ones(len(self.modifiers), dtype=np.float64)
+
+    def _addDeltas(self, deltas, targets, factors, lookup):
+        tWeights = humanmodifier.getTargetWeights(targets, factors)
+        for tpath, tWeight in tWeights.items():
+            if not tWeight:
+                continue
+            target = algos3d.getTarget(self.human.meshData, tpath)
+            if not len(target.verts):
+                continue
+            local = lookup[target.verts]
+            used = local >= 0
+            deltas[local[used]] += tWeight * target.data[used]
+
+    def _offsets(self, values):
+        """
+        Combined offset of all modifier targets on the working vertices for
+        the specified modifier values.
+        """
+        incr = np.maximum(values, 0.0)
+        decr = -np.minimum(values, 0.0)
+        return np.einsum('m,mvc->vc', incr, self.incrDeltas) + \
+               np.einsum('m,mvc->vc', decr, self.decrDeltas)
+
+    def evaluate(self, values):
+        """
+        Measurements (in the units of this solver) for the specified modifier
+        values, and their Jacobian to the modifier values.
+        """
+        coord = self.base + self._offsets(values)
+        # Direction in which each modifier moves the vertices, at these values
+        up = np.where(values > 0.0, 1.0, np.where(values < 0.0, 0.0, self._upHint))
+        slopes = up[:,None,None] * self.incrDeltas - (1.0 - up)[:,None,None] * self.decrDeltas
+
+        segments = coord[self.ends] - coord[self.starts]
+        lengths = np.sqrt(np.sum(segments ** 2, axis=-1))
+        measures = np.add.reduceat(lengths, self.offsets)
+        directions = segments / np.maximum(lengths, 1e-12)[:,None]
+        dSegments = slopes[:, self.ends] - slopes[:, self.starts]
+        jacobian = np.add.reduceat(np.einsum('sc,msc->ms', directions, dSegments), self.offsets, axis=1).T
+        return self.scale * measures, self.scale * jacobian
+
+    def solve(self, goals, tolerance=0.01, maxIterations=10):
+        """
+        Solve modifier values for which the measurements reach the specified
+        goals (one for each feature of this solver). Returns the values, the
+        human is not modified.
+        """
+        goals = np.asarray(goals, dtype=np.float64)
+        values = self.startValues.copy()
+
+        # Modifiers at 0 start on the side (decr or incr target) that moves
+        # their own measurement towards its goal
+        measures, _ = self.evaluate(values)
+        self._upHint = (goals > measures).astype(np.float64)
+
+        for _ in xrange(maxIterations):
+            measures, jacobian = self.evaluate(values)
+            residual = goals - measures
+            if np.max(np.abs(residual)) < tolerance:
+                break
+            step = np.linalg.lstsq(jacobian, residual, rcond=None)[0]
+            values = np.clip(values + step, -1.0, 1.0)
+
+        log.debug("Fitted %s: goals %s, final %s", ', '.join(self.features), goals, measures)
+        return values
+
+    def apply(self, values):
+        """
+        Set the solved values on the human, applying only the final targets.
+        """
+        for modifier, value in zip(self.modifiers, values):
+            modifier.updateValue(value, 0)
+
+def fitMeasures(human, ruler, goals, units='metric'):
+    """
+    Fit the measure modifiers for several features at once. goals maps each
+    feature (eg. 'hips-circ') to the desired measurement.
+    """
+    features = goals.keys()
+    solver = MeasureSolver(human, ruler, features, units)
+    values = solver.solve([goals[feature] for feature in features])
+    solver.apply(values)
+    return dict(zip(features, values))
+
+def fitBody(human, ruler, height, bust, waist, hip, units='metric'):
+    """
+    Fit the measure modifiers of the human to the desired body sizes.
+    The height difference is distributed evenly over the four vertical body
+    segments. All segment lengths and the hips, waist and bust circumference
+    are fitted together.
+    """
+    goals = {"hips-circ": hip,
+             "waist-circ": waist,
+             "bust-circ": bust}
+
+    heightDiff = height - human.getHeightCm()
+    if abs(heightDiff) > 0.2:
+        segments = ["napetowaist-dist", "waisttohip-dist", "upperleg-height", "lowerleg-height"]
+        for feature in segments:
+            goals[feature] = ruler.getMeasure(human, getMeasureName(feature), units) + heightDiff/4
+
+    return fitMeasures(human, ruler, goals, units)
@@ -40,14 +40,12 @@ import wavefront
 import os
 from progress import Progress
 import numpy as np
-import win32api, win32gui, win32con
-import psutil
 import json
 import bvh
 from core import G
 
 import skeleton
-import mh
+import getpath
 
 def exportJoints(human, filepath, filename, centering):
     #path = os.path.join(filepath, filename+"joints.txt")
@@ -57,7 +55,7 @@ def exportJoints(human, filepath, filename, centering):
         #G.app.prompt('Error', 'You did not select a skeleton from the library.', 'OK')
         #return
 
-        human.skeleton = skeleton.load(mh.getSysDataPath('rigs/default.mhskel'), human.meshData)
+        human.skeleton = skeleton.load(getpath.getSysDataPath('rigs/default.mhskel'), human.meshData)
         human.skeleton.dirty = True
 
     skel = human.getSkeleton()
@@ -72,15 +70,25 @@ def exportJoints(human, filepath, filename, centering):
     return joints
 
 
-def exportObj(filepath, config=None):
+def exportObj(filepath, config=None, notify=True, writeBinary=False):
+    """
+    Export the human to an OBJ file, together with its .BodyInfo file.
+    When no filepath is given, the body is written to Result/Body.obj.
+    When writeBinary is True, the body is also written to a binary mesh file
+    with the same name and the .mhbin extension (see binarymesh).
+    When notify is True, the delivery application is signalled and this
+    MakeHuman process is ended after exporting. Pass False when exporting
+    multiple bodies from the same process (eg. from the body generator).
+    """
     progress = Progress(0, None)
     human = config.human
     human.getSkeleton()
 
     # Set root dir
-    if not os.path.exists("Result"):
-        os.makedirs("Result")
-    filepath = "Result/Body.obj"
+    if not filepath:
+        filepath = "Result/Body.obj"
+    if os.path.dirname(filepath) and not os.path.exists(os.path.dirname(filepath)):
+        os.makedirs(os.path.dirname(filepath))
     config.setupTexFolder(filepath)
 
     filename = os.path.basename(filepath)
@@ -129,8 +137,6 @@ def exportObj(filepath, config=None):
 
     #win32api.RegisterWindowMessage('56789')
 
-    cpid = win32api.GetCurrentProcessId();
-
 
     path = os.path.join(root, pure_name+ ".BodyInfo")
 
@@ -208,12 +214,34 @@ def exportObj(filepath, config=None):
     bj.close()
     bv.close()
 
+    if writeBinary:
+        import binarymesh
+        landmarks = {}
+        for l in data[1:7]:
+            if l:
+                lname, value = l.strip().split('=')
+                landmarks[lname] = float(value)
+        binarymesh.writeBinaryMesh(os.path.splitext(filepath)[0] + ".mhbin", meshes, joints, landmarks, config, filterMaskedFaces=not config.hiddenGeom)
+
     os.remove(pure_name+"Landmarks")
     os.remove(pure_name+"Joints")
     os.remove(pure_name+"Indices")
 
 
     progress(1.0, None, "OBJ Export finished. Output file: %s" % filepath)
+
+    if notify:
+        notifyExportFinished()
+
+def notifyExportFinished():
+    """
+    Signal the delivery application that a new body was exported, and end
+    this MakeHuman process.
+    """
+    import win32api, win32gui, win32con
+
+    cpid = win32api.GetCurrentProcessId();
+
     r = win32api.SendMessage(win32con.HWND_BROADCAST, 56789, 0, 0)
 
     # Send Message to Avatar delivery
@@ -182,7 +182,8 @@ class WarpModifier (humanmodifier.UniversalModifier):
         #    return
 
         target = self.compileWarpTarget()
-        algos3d._targetBuffer[canonicalPath(self.fullName)] = target    # TODO remove direct use of the target buffer?
+        # Warp targets cannot be reloaded from file, so they are never evicted
+        algos3d._targetBuffer.add(canonicalPath(self.fullName), target, pinned=True)    # TODO remove direct use of the target buffer?
         self.human.hasWarpTargets = True
 
         if debug:
@@ -345,7 +346,7 @@ def resetWarpBuffer():
                 if debug:
                     log.debug("  DEL %s" % path)
                 human.setDetail(localPath(path), 0)
-                del algos3d._targetBuffer[path]
+                algos3d._targetBuffer.remove(path, unpin=True)
         human.applyAllTargets()
         human.hasWarpTargets = False
 
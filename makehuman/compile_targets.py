@@ -33,7 +33,17 @@
 Abstract
 --------
 
-TODO
+Compiles all .target files in the data folder into the compressed
+data/targets.npz archive. With the --mapped option, they are compiled into the
+uncompressed data/targets.mhtargets archive instead, which is memory mapped
+when loading targets (see algos3d.TargetArchive).
+
+The text files are parsed by a pool of worker processes (--jobs, by default
+one per CPU), and the archive members are written from memory.
+Rebuilds are incremental: a manifest next to the archive records the
+modification time, size and SHA-1 hash of every compiled target, and only new
+or changed targets are parsed again. Unchanged targets are copied from the
+existing archive. Use --full to recompile all targets.
 """
 
 import sys
@@ -42,10 +52,18 @@ import makehuman
 import algos3d
 import numpy as np
 import os
+import json
+import hashlib
 import zipfile
 import fnmatch
+import multiprocessing
+from cStringIO import StringIO
 from codecs import open
 
+MANIFEST_VERSION = 1
+
+_target = None  # Target used for parsing, one per (worker) process
+
 def getAllFiles(rootPath, filterStrArr):
     result = [ None ]*len(filterStrArr)
     for root, dirnames, filenames in os.walk(rootPath):
@@ -62,35 +80,228 @@ def getFiles(root, filenames, filterStr):
     return foundFiles
 
 
-if __name__ == '__main__':
-    obj = algos3d.Target(None, None)
-    allFiles = getAllFiles('data', ['*.target', '*.png'])
-    npzPath = 'data/targets.npz'
-    with zipfile.ZipFile(npzPath, mode='w', compression=zipfile.ZIP_DEFLATED) as zip:
-        npzdir = os.path.dirname(npzPath)
-        allTargets = allFiles[0]
+def getEntryName(path, archivePath):
+    """
+    Name of a target in the archive (and manifest): its path relative to the
+    archive folder, with forward slashes.
+    """
+    return os.path.relpath(path, os.path.dirname(archivePath)).replace('\\', '/')
+
+def getFileHash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def loadManifest(archivePath):
+    """
+    The manifest of the targets compiled in the archive, as a dict of
+    entry name: (mtime, size, hash). Empty if there is no archive or manifest.
+    """
+    manifestPath = archivePath + '.manifest'
+    if not os.path.isfile(archivePath) or not os.path.isfile(manifestPath):
+        return {}
+    try:
+        with open(manifestPath, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except ValueError:
+        print 'ignoring invalid manifest %s' % manifestPath
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return dict((name, tuple(stat)) for name, stat in manifest['targets'].items())
+
+def saveManifest(archivePath, targets):
+    with open(archivePath + '.manifest', 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'targets': targets}, f, indent=0, sort_keys=True)
+
+
+def getChangedTargets(allTargets, archivePath, manifest, compiledNames):
+    """
+    Compare the targets with the manifest of the existing archive. Returns the
+    targets that need to be compiled, and the new manifest.
+    Targets with unchanged modification time and size are not hashed.
+    """
+    changed = []
+    targets = {}
+    for path in allTargets:
+        name = getEntryName(path, archivePath)
+        st = os.stat(path)
+        stat = manifest.get(name)
+        if stat is None or name not in compiledNames:
+            stat = (st.st_mtime, st.st_size, getFileHash(path))
+            changed.append(path)
+        elif stat[:2] != (st.st_mtime, st.st_size):
+            fileHash = getFileHash(path)
+            if fileHash != stat[2]:
+                changed.append(path)
+            stat = (st.st_mtime, st.st_size, fileHash)
+        targets[name] = stat
+    return changed, targets
+
+
+def compileTarget(path):
+    """
+    Parse a text target (in a worker process). Returns its quantized vertex
+    indices and offsets (in 1e-3 units), and its license as dict (or None).
+    """
+    global _target
+    if _target is None:
+        _target = algos3d.Target(None, None)
+    obj = _target
+    obj._load_text(path)
+    index = np.ascontiguousarray(obj.verts, dtype=np.uint16)
+    vector = np.ascontiguousarray(np.round(obj.data * 1e3), dtype=np.int16)
+    license = obj._license.asDict() if hasattr(obj, '_license') else None
+    if hasattr(obj, '_license'):
+        del obj._license
+    return path, index, vector, license
+
+def compileTargets(allTargets, archivePath, jobs=None):
+    """
+    Compile the specified targets using a pool of jobs processes.
+    Returns a dict of entry name: (index, vector, license).
+    """
+    result = {}
+    if not allTargets:
+        return result
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(allTargets)))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        compiled = pool.imap_unordered(compileTarget, allTargets, chunksize=8)
+    else:
+        pool = None
+        compiled = (compileTarget(path) for path in allTargets)
+    try:
+        for (i, (path, index, vector, license)) in enumerate(compiled):
+            result[getEntryName(path, archivePath)] = (index, vector, license)
+            print "[%.0f%% done] converted target %s" % (100*(float(i)/float(len(allTargets))), path)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return result
+
+
+def readNpzArchive(npzPath, names):
+    """
+    Read the compiled targets with the specified entry names from an
+    existing npz archive.
+    """
+    result = {}
+    npzfile = np.load(npzPath, allow_pickle=True)   # licenses are object arrays
+    try:
+        for name in names:
+            bname = os.path.splitext(name)[0]
+            lname = '%s.license' % bname
+            license = None
+            if lname in npzfile:
+                license = algos3d.defaultTargetLicense().fromNumpyString(npzfile[lname]).asDict()
+            result[name] = (npzfile['%s.index' % bname], npzfile['%s.vector' % bname], license)
+    finally:
+        npzfile.close()
+    return result
 
+def listNpzArchive(npzPath):
+    if not os.path.isfile(npzPath):
+        return set()
+    with zipfile.ZipFile(npzPath) as zip:
+        members = set(zip.namelist())
+    return set(name[:-len('.index.npy')] + '.target' for name in members
+               if name.endswith('.index.npy') and name.replace('.index.', '.vector.') in members)
+
+def _writeArray(zip, name, array):
+    buf = StringIO()
+    np.save(buf, array)
+    zip.writestr(name, buf.getvalue())
+
+def writeNpzArchive(npzPath, allTargets, compiled):
+    with zipfile.ZipFile(npzPath, mode='w', compression=zipfile.ZIP_DEFLATED) as zip:
         # License for all official MH targets
-        lpath = 'data/targets/targets.license.npy'
-        np.save(lpath, makehuman.getAssetLicense().toNumpyString())
-        zip.write(lpath, os.path.relpath(lpath, npzdir))
-        os.remove(lpath)
-
-        for (i, path) in enumerate(allTargets):
-            try:
-                obj._load_text(path)
-                iname, vname, lname = obj._save_binary(path)
-                zip.write(iname, os.path.relpath(iname, npzdir))
-                zip.write(vname, os.path.relpath(vname, npzdir))
-                if lname:
-                    zip.write(lname, os.path.relpath(lname, npzdir))
-                    os.remove(lname)
-                os.remove(iname)
-                os.remove(vname)
-                print "[%.0f%% done] converted target %s" % (100*(float(i)/float(len(allTargets))), path)
-            except None, e:
-                raise e
-                print 'error converting target %s' % path
+        _writeArray(zip, 'targets/targets.license.npy', np.ascontiguousarray(makehuman.getAssetLicense().toNumpyString()))
+
+        for path in allTargets:
+            name = getEntryName(path, npzPath)
+            index, vector, license = compiled[name]
+            bname = os.path.splitext(name)[0]
+            _writeArray(zip, '%s.index.npy' % bname, index)
+            _writeArray(zip, '%s.vector.npy' % bname, vector)
+            if license is not None:
+                license = algos3d.defaultTargetLicense().fromDict(license)
+                _writeArray(zip, '%s.license.npy' % bname, np.ascontiguousarray(license.toNumpyString()))
+
+
+def readMappedArchive(archivePath, names):
+    """
+    Read the compiled targets with the specified entry names from an
+    existing target archive (copied, so that the archive can be overwritten).
+    """
+    archive = algos3d.TargetArchive(archivePath)
+    result = {}
+    for name in names:
+        index, vector = archive.getTarget(name)
+        result[name] = (np.array(index), np.array(vector), archive.getLicense(name))
+    return result
+
+def listMappedArchive(archivePath):
+    if not os.path.isfile(archivePath):
+        return set()
+    try:
+        return set(algos3d.TargetArchive(archivePath)._entries.keys())
+    except RuntimeError:
+        return set()
+
+def writeMappedArchive(archivePath, allTargets, compiled):
+    entries = [('targets/targets.license', np.zeros(0), np.zeros((0, 3)), makehuman.getAssetLicense().asDict())]
+    for path in allTargets:
+        name = getEntryName(path, archivePath)
+        index, vector, license = compiled[name]
+        entries.append( (name, index, vector * 1e-3, license) )
+    algos3d.writeTargetArchive(archivePath, entries)
+
+
+def compileArchive(allTargets, archivePath, mapped=False, jobs=None, full=False):
+    """
+    Compile the targets into the npz archive, or the memory mapped target
+    archive if mapped is True. Unless full is True, only the targets that
+    changed since the last compile are parsed.
+    """
+    if mapped:
+        listArchive, readArchive, writeArchive = listMappedArchive, readMappedArchive, writeMappedArchive
+    else:
+        listArchive, readArchive, writeArchive = listNpzArchive, readNpzArchive, writeNpzArchive
+
+    if full:
+        manifest, compiledNames = {}, set()
+    else:
+        manifest = loadManifest(archivePath)
+        compiledNames = listArchive(archivePath) if manifest else set()
+    changed, targets = getChangedTargets(allTargets, archivePath, manifest, compiledNames)
+    print "%d of %d targets changed" % (len(changed), len(allTargets))
+
+    changedNames = set(getEntryName(path, archivePath) for path in changed)
+    unchanged = [name for name in targets if name not in changedNames]
+    compiled = readArchive(archivePath, unchanged) if unchanged else {}
+    compiled.update(compileTargets(changed, archivePath, jobs))
+
+    writeArchive(archivePath, allTargets, compiled)
+    saveManifest(archivePath, targets)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Compile the targets in the data folder into one archive.")
+    parser.add_argument("--mapped", action="store_true", help="Compile into the memory mapped data/targets.mhtargets archive instead of data/targets.npz")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--full", action="store_true", help="Recompile all targets, also those that did not change")
+    args = parser.parse_args()
+
+    allFiles = getAllFiles('data', ['*.target', '*.png'])
+    if args.mapped:
+        compileArchive(allFiles[0], 'data/targets.mhtargets', True, args.jobs, args.full)
+    else:
+        compileArchive(allFiles[0], 'data/targets.npz', False, args.jobs, args.full)
 
     print "Writing images list"
     with open('data/images.list', 'w', encoding="utf-8") as f:
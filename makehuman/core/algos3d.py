@@ -57,11 +57,298 @@ algorithms will be coded. For example:
 __docformat__ = 'restructuredtext'
 
 import os
+import json
+import time
+import threading
+from collections import OrderedDict
 import numpy as np
 import log
 from getpath import getSysDataPath, canonicalPath
 
-_targetBuffer = {}
+
+class TargetCache(object):
+    """
+    Cache of loaded targets, by canonical target path.
+    When maxBytes is set, the least recently used targets are evicted when
+    the targets in the cache take more memory than that (see Target.nbytes).
+    Pinned targets are never evicted, they stay loaded until they are
+    explicitly removed. Pins are kept by path, so a pinned target that is
+    removed and loaded again (see refreshCachedTarget) stays pinned, unless
+    it is removed with unpin.
+    The generation of a path counts how often its target was removed or
+    replaced (see getGeneration), so that users of the target data can tell
+    whether it may have changed. Evicted targets keep their generation.
+    Supports the dict operations used on the former plain dict target buffer.
+    """
+
+    def __init__(self, maxBytes=None):
+        self.maxBytes = maxBytes
+        self._targets = OrderedDict()   # In least recently used order
+        self._sizes = {}
+        self._pinned = set()
+        self._generations = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, targetPath):
+        """
+        Get a target from the cache, counting the cache hit or miss and
+        marking it as most recently used. Returns None if it is not cached.
+        """
+        target = self._targets.pop(targetPath, None)
+        if target is None:
+            self.misses += 1
+            return None
+        self._targets[targetPath] = target
+        self.hits += 1
+        return target
+
+    def add(self, targetPath, target, pinned=False):
+        """
+        Add a target to the cache, evicting least recently used targets if
+        the cache exceeds its size.
+        """
+        if targetPath in self._targets:
+            self.remove(targetPath)
+        self._targets[targetPath] = target
+        self._sizes[targetPath] = target.nbytes
+        self.bytes += self._sizes[targetPath]
+        if pinned:
+            self._pinned.add(targetPath)
+        self._evict(keep=targetPath)
+
+    def remove(self, targetPath, unpin=False):
+        """
+        Remove a target from the cache. With unpin, its pin is dropped as
+        well, for targets that will not be loaded again.
+        """
+        self._discard(targetPath)
+        self._generations[targetPath] = self.getGeneration(targetPath) + 1
+        if unpin:
+            self._pinned.discard(targetPath)
+
+    def invalidate(self, targetPath):
+        """
+        Remove the target with this path if it is loaded, and change its
+        generation in any case, as its data changed (eg. the target file was
+        modified after the target was evicted).
+        """
+        if targetPath in self._targets:
+            self.remove(targetPath)
+        else:
+            self._generations[targetPath] = self.getGeneration(targetPath) + 1
+
+    def _discard(self, targetPath):
+        del self._targets[targetPath]
+        self.bytes -= self._sizes.pop(targetPath)
+
+    def getGeneration(self, targetPath):
+        """
+        The generation of the target data for this path. It changes whenever
+        the target is removed from or replaced in the cache, after which it
+        can be loaded with other data (see refreshCachedTarget), but not when
+        the target is evicted, as it is then loaded again from the same file.
+        """
+        return self._generations.get(targetPath, 0)
+
+    def pin(self, targetPath):
+        """
+        Prevent the target with this path from being evicted.
+        """
+        self._pinned.add(targetPath)
+
+    def unpin(self, targetPath):
+        self._pinned.discard(targetPath)
+        self._evict()
+
+    def isPinned(self, targetPath):
+        return targetPath in self._pinned
+
+    def setMaxBytes(self, maxBytes):
+        """
+        Change the size of the cache, None for no limit.
+        """
+        self.maxBytes = maxBytes
+        self._evict()
+
+    def _evict(self, keep=None):
+        if self.maxBytes is None or self.bytes <= self.maxBytes:
+            return
+        for targetPath in list(self._targets.keys()):
+            if self.bytes <= self.maxBytes:
+                break
+            if targetPath == keep or targetPath in self._pinned:
+                continue
+            self._discard(targetPath)
+            self.evictions += 1
+
+    def clear(self):
+        for targetPath in self._targets:
+            self._generations[targetPath] = self.getGeneration(targetPath) + 1
+        self._targets.clear()
+        self._sizes.clear()
+        self._pinned.clear()
+        self.bytes = 0
+
+    def getStats(self):
+        """
+        Counters of this cache, as a dict.
+        """
+        return dict(targets = len(self._targets),
+                    pinned = len(self._pinned.intersection(self._targets)),
+                    bytes = self.bytes,
+                    maxBytes = self.maxBytes,
+                    hits = self.hits,
+                    misses = self.misses,
+                    evictions = self.evictions)
+
+    def get(self, targetPath, default=None):
+        return self._targets.get(targetPath, default)
+
+    def __getitem__(self, targetPath):
+        return self._targets[targetPath]
+
+    def __setitem__(self, targetPath, target):
+        self.add(targetPath, target)
+
+    def __delitem__(self, targetPath):
+        self.remove(targetPath)
+
+    def __contains__(self, targetPath):
+        return targetPath in self._targets
+
+    def __len__(self):
+        return len(self._targets)
+
+    def __iter__(self):
+        return iter(self._targets.keys())
+
+    def keys(self):
+        return self._targets.keys()
+
+    def items(self):
+        return self._targets.items()
+
+
+_targetBuffer = TargetCache()
+
+# Per-thread state of the target preloader threads (see preloadTargets)
+_threadData = threading.local()
+
+
+class TargetArchive(object):
+    """
+    Uncompressed archive of quantized targets in one flat file, that is
+    memory mapped instead of read into memory. The vertex indices and offsets
+    of every target are returned as read-only views (uint16 and int16 in 1e-3
+    units) on the mapped file, so loading a target copies no data, and
+    processes using the same archive share its pages.
+
+    File layout (little endian):
+        magic           8 bytes, TargetArchive.MAGIC
+        version         uint32
+        count           uint32, number of entries
+        table           count * TargetArchive.tableDtype
+        names, licenses utf-8 strings referenced from the table
+        data            per entry: count uint16 vertex indices, padding to 4
+                        bytes, count*3 int16 offsets, padding to 4 bytes
+    Entry names are the target paths relative to the data folder, with
+    forward slashes. Licenses are stored as JSON.
+    """
+
+    MAGIC = 'MHTARGET'
+    VERSION = 1
+    tableDtype = np.dtype([('nameoffset', '<u8'), ('namelength', '<u4'),
+                           ('licenseoffset', '<u8'), ('licenselength', '<u4'),
+                           ('dataoffset', '<u8'), ('count', '<u4')])
+    _headerSize = 16
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        if self._map[:8].tostring() != self.MAGIC:
+            raise RuntimeError('Not a target archive: %s' % path)
+        version, count = self._map[8:16].view('<u4')
+        if version > self.VERSION:
+            raise RuntimeError('Unsupported target archive version %s: %s' % (version, path))
+        end = self._headerSize + count * self.tableDtype.itemsize
+        self._table = self._map[self._headerSize:end].view(self.tableDtype)
+        self._entries = dict((self._string(entry['nameoffset'], entry['namelength']), idx)
+                             for idx, entry in enumerate(self._table))
+
+    def _string(self, offset, length):
+        return self._map[offset:offset+length].tostring().decode('utf-8')
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def getTarget(self, name):
+        """
+        Vertex indices (uint16) and quantized offsets ((n, 3) int16, in 1e-3
+        units) of the target with the specified name, as views on the archive.
+        """
+        entry = self._table[self._entries[name]]
+        count = int(entry['count'])
+        start = int(entry['dataoffset'])
+        vstart = start + _align4(2 * count)
+        verts = self._map[start:start + 2*count].view('<u2')
+        vectors = self._map[vstart:vstart + 6*count].view('<i2').reshape((count, 3))
+        return verts, vectors
+
+    def getLicense(self, name):
+        """
+        The license (as dict) stored for the specified entry, or None.
+        """
+        entry = self._table[self._entries[name]]
+        if not entry['licenselength']:
+            return None
+        return json.loads(self._string(entry['licenseoffset'], entry['licenselength']))
+
+
+def _align4(n):
+    return (n + 3) & ~3
+
+
+def writeTargetArchive(path, entries):
+    """
+    Write a TargetArchive. entries is a list of (name, verts, data, license)
+    tuples, with data the target offsets (they are quantized to 1e-3 units)
+    and license a dict, or None.
+    """
+    entries = list(entries)
+    strings = []
+    stringsSize = 0
+    table = np.zeros(len(entries), dtype=TargetArchive.tableDtype)
+    stringsStart = TargetArchive._headerSize + table.nbytes
+    for idx, (name, verts, data, license) in enumerate(entries):
+        for field, text in [('name', name), ('license', json.dumps(license, sort_keys=True) if license else '')]:
+            text = text.encode('utf-8')
+            table[field + 'offset'][idx] = stringsStart + stringsSize
+            table[field + 'length'][idx] = len(text)
+            strings.append(text)
+            stringsSize += len(text)
+
+    dataOffset = _align4(stringsStart + stringsSize)
+    with open(path, 'wb') as f:
+        f.write(TargetArchive.MAGIC)
+        f.write(np.array([TargetArchive.VERSION, len(entries)], dtype='<u4').tostring())
+        f.write(table.tostring())   # offsets of the data are filled in below
+        f.write(''.join(strings))
+        f.write('\0' * (dataOffset - stringsStart - stringsSize))
+        for idx, (name, verts, data, license) in enumerate(entries):
+            verts = np.ascontiguousarray(verts, dtype='<u2')
+            vectors = np.ascontiguousarray(np.round(np.asarray(data) * 1e3), dtype='<i2')
+            table['dataoffset'][idx] = dataOffset
+            table['count'][idx] = len(verts)
+            for block in [verts.tostring(), vectors.tostring()]:
+                f.write(block)
+                f.write('\0' * (_align4(len(block)) - len(block)))
+                dataOffset += _align4(len(block))
+        f.seek(TargetArchive._headerSize)
+        f.write(table.tostring())
 
 
 class Target(object):
@@ -73,6 +360,10 @@ class Target(object):
     npzfile = None
     npztime = None
     npzdir = None
+    archive = None  # TargetArchive, False if there is none
+
+    quantized = None  # Offsets as int16 (in 1e-3 units), for targets loaded from an archive
+    _data = None
 
     def __init__(self, obj, name):
         """
@@ -110,6 +401,8 @@ class Target(object):
     def license(self):
         if hasattr(self, '_license'):
             return self._license
+        elif Target.archive and 'targets/targets.license' in Target.archive:
+            return defaultTargetLicense().fromDict(Target.archive.getLicense('targets/targets.license'))
         elif Target.npzfile is not None and 'targets/targets.license' in Target.npzfile:
             license = defaultTargetLicense()
             return license.fromNumpyString(Target.npzfile['targets/targets.license'])
@@ -119,26 +412,63 @@ class Target(object):
     def setLicense(self, license):
         self._license = license
 
+    @property
+    def nbytes(self):
+        """
+        Memory taken by the arrays of this target, not counting data that is
+        memory mapped from a target archive.
+        """
+        result = 0
+        for array in [self.verts, self._data, self.quantized, getattr(self, 'faces', None)]:
+            if isinstance(array, np.ndarray) and not isinstance(array, np.memmap):
+                result += array.nbytes
+        return result
+
+    @property
+    def data(self):
+        """
+        The offsets of the target vertices, as (n, 3) array.
+        For targets loaded from a target archive, these are dequantized on
+        every access: use getScaledData where possible.
+        """
+        if self._data is None and self.quantized is not None:
+            return self.quantized * 1e-3
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self.quantized = None
+
+    def getScaledData(self, srcVerts, scale):
+        """
+        Offsets of the specified target vertices, multiplied by scale.
+        """
+        if self._data is None and self.quantized is not None:
+            return self.quantized[srcVerts] * (np.asarray(scale) * 1e-3)[None,:]
+        return self._data[srcVerts] * np.asarray(scale)[None,:]
+
     def _load_text(self, name):
-        import makehuman
-        data = []
         license = defaultTargetLicense()
         with open(name, 'rU') as fd:
-            for line in fd:
-                line = line.strip()
-                if line.startswith('#'):
-                    license.updateFromComment(line)
-                    continue
-                translationData = line.split()
-                if len(translationData) != 4:
-                    continue
-                vertIndex = int(translationData[0])
-                translationVector = (float(translationData[1]), float(translationData[2]), float(translationData[3]))
-                data.append((vertIndex, translationVector))
-
-        raw = np.asarray(data, dtype=Target.dtype)
-        self.verts = raw['index']
-        self.data = raw['vector']
+            lines = [line.strip() for line in fd.read().split('\n')]
+
+        # Comments (with license info), skip empty and malformed lines. The
+        # field count is checked per line, as a short line followed by a long
+        # one would otherwise shift all values in between
+        body = []
+        for line in lines:
+            if line.startswith('#'):
+                license.updateFromComment(line)
+            elif len(line.split()) == 4:
+                body.append(line)
+
+        # Parse all vertex index and offset lines at once
+        values = np.fromstring('\n'.join(body), dtype=np.float64, sep=' ')
+        values = values.reshape((-1, 4))
+
+        self.verts = values[:,0].astype(np.uint32)
+        self.data = values[:,1:].astype(np.float32)
         if license.isCustomized():
             self.setLicense(license)
 
@@ -154,17 +484,19 @@ class Target(object):
         if os.path.isfile(name) and Target.npztime < os.path.getmtime(name):
             log.message('compiled file newer than archive: %s', name)
             raise RuntimeError('compiled file newer than archive: %s' % name)
-        if iname not in Target.npzfile:
+        # Preloader threads read from their own handle, NpzFile is not thread safe
+        npzfile = getattr(_threadData, 'npzfile', None) or Target.npzfile
+        if iname not in npzfile:
             log.message('compiled file missing: %s', iname)
             raise RuntimeError('compiled file missing: %s' % iname)
-        if vname not in Target.npzfile:
+        if vname not in npzfile:
             log.message('compiled file missing: %s', vname)
             raise RuntimeError('compiled file missing: %s' % vname)
-        self.verts = Target.npzfile[iname]
-        self.data = Target.npzfile[vname] * 1e-3
-        if lname in Target.npzfile:
+        self.verts = npzfile[iname]
+        self.data = npzfile[vname] * 1e-3
+        if lname in npzfile:
             import makehuman
-            self._license = defaultTargetLicense().fromNumpyString(Target.npzfile[lname])
+            self._license = defaultTargetLicense().fromNumpyString(npzfile[lname])
 
     def _load_binary_files(self, name):
         """
@@ -189,7 +521,38 @@ class Target(object):
         self.verts = np.load(iname)
         self.data = np.load(vname) * 1e-3
 
+    def _load_mapped_archive(self, name):
+        """
+        Load target from a memory mapped target archive (see TargetArchive)
+        """
+        if os.path.isfile(name) and Target.archive.mtime < os.path.getmtime(name):
+            log.message('compiled file newer than archive: %s', name)
+            raise RuntimeError('compiled file newer than archive: %s' % name)
+        name = os.path.relpath(name, os.path.dirname(Target.archive.path)).replace('\\', '/')
+        if name not in Target.archive:
+            log.message('compiled file missing: %s', name)
+            raise RuntimeError('compiled file missing: %s' % name)
+        self.verts, self.quantized = Target.archive.getTarget(name)
+        self._data = None
+        license = Target.archive.getLicense(name)
+        if license:
+            self._license = defaultTargetLicense().fromDict(license)
+
     def _load_binary(self, name):
+        if Target.archive is None:
+            archivePath = getSysDataPath('targets.mhtargets')
+            if os.path.isfile(archivePath):
+                try:
+                    Target.archive = TargetArchive(archivePath)
+                except StandardError as e:
+                    log.warning('unable to open target archive %s (%s)', archivePath, e)
+                    Target.archive = False
+            else:
+                Target.archive = False
+        if Target.archive:
+            self._load_mapped_archive(name)
+            return
+
         if Target.npzfile is None:
             try:
                 npzname = getSysDataPath('targets.npz')     # TODO duplicate path literal
@@ -261,7 +624,7 @@ class Target(object):
             if morphFactor:
                 # Adding the translation vector
 
-                scale = np.array(scale) * morphFactor
+                scale = np.array(scale, dtype=np.float64) * morphFactor
                 if animatedMesh is not None:
                     # Pose the direction in which the target is applied, for fast
                     # approximate modeling of a posed model
@@ -274,10 +637,10 @@ class Target(object):
                         animationTrack.bake(animatedMesh.getBaseSkeleton())
                     poseData = animatedMesh.getPoseState()
                     obj.coord[dstVerts] += animation.skinMesh( \
-                                  self.data[srcVerts] * scale[None,:], 
+                                  self.getScaledData(srcVerts, scale), 
                                   vertBoneMapping.compiled(4)[dstVerts], poseData )
                 else:
-                    obj.coord[dstVerts] += self.data[srcVerts] * scale[None,:]
+                    obj.coord[dstVerts] += self.getScaledData(srcVerts, scale)
                 obj.markCoords(dstVerts, coor=True)
 
             if calcNormals:
@@ -289,6 +652,84 @@ class Target(object):
 
         return False
 
+class TargetBasis(object):
+    """
+    A set of targets compiled into one matrix, so that any combination of
+    them can be applied with a single matrix product instead of one
+    scatter-add per target.
+    The matrix is dense on the support of the targets: it has one row per
+    target, and one column per coordinate of the vertices that are affected
+    by any of the targets (verts).
+    """
+
+    def __init__(self, obj, targetPaths):
+        self.targetPaths = []
+        for targetPath in targetPaths:
+            targetPath = canonicalPath(targetPath)
+            if targetPath not in self.targetPaths:
+                self.targetPaths.append(targetPath)
+        self.targetIndex = dict((targetPath, idx) for idx, targetPath in enumerate(self.targetPaths))
+
+        targets = [getTarget(obj, targetPath) for targetPath in self.targetPaths]
+        self.verts = np.unique(np.concatenate([np.asarray(t.verts, dtype=np.uint32) for t in targets] +
+                                              [np.zeros(0, dtype=np.uint32)]))
+
+        lookup = np.zeros(obj.getVertexCount(), dtype=np.uint32)
+        lookup[self.verts] = np.arange(len(self.verts), dtype=np.uint32)
+        self.matrix = np.zeros((len(targets), len(self.verts), 3), dtype=np.float32)
+        for idx, target in enumerate(targets):
+            if len(target.verts):
+                self.matrix[idx, lookup[target.verts]] = target.data
+        self.matrix = self.matrix.reshape((len(targets), -1))
+
+    def __contains__(self, targetPath):
+        return canonicalPath(targetPath) in self.targetIndex
+
+    def __len__(self):
+        return len(self.targetPaths)
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    def getWeights(self, details):
+        """
+        Split a dict of target paths and weights (such as the targetsDetailStack
+        of the human) into a weight vector for the targets in this basis, and a
+        dict with the remaining targets and weights.
+        """
+        weights = np.zeros(len(self.targetPaths), dtype=np.float32)
+        remaining = {}
+        for targetPath, weight in details.iteritems():
+            idx = self.targetIndex.get(targetPath)
+            if idx is None:
+                remaining[targetPath] = weight
+            else:
+                weights[idx] = weight
+        return weights, remaining
+
+    def getOffsets(self, weights):
+        """
+        Combined offsets of the targets, as a (len(verts), 3) array, for the
+        specified weight vector.
+        """
+        active = np.flatnonzero(weights)
+        if len(active) < len(weights) / 2:
+            offsets = np.dot(weights[active], self.matrix[active])
+        else:
+            offsets = np.dot(weights, self.matrix)
+        return offsets.reshape((-1, 3))
+
+    def apply(self, obj, weights):
+        """
+        Add the targets with the specified weight vector to the coordinates of
+        obj.
+        """
+        if not np.any(weights):
+            return
+        obj.coord[self.verts] += self.getOffsets(weights)
+        obj.markCoords(self.verts, coor=True)
+
 def getTarget(obj, targetPath):
     """
     This function retrieves a set of translation vectors from a morphing
@@ -322,15 +763,93 @@ def getTarget(obj, targetPath):
     """
     targetPath = canonicalPath(targetPath)
 
-    try:
-        return _targetBuffer[targetPath]
-    except KeyError:
-        pass
+    target = _targetBuffer.lookup(targetPath)
+    if target is not None:
+        return target
 
     target = Target(obj, targetPath)
-    _targetBuffer[targetPath] = target
+    _targetBuffer.add(targetPath, target)
     return target
 
+def pinTarget(obj, targetPath):
+    """
+    Load a target, and keep it loaded regardless of the target cache size.
+    """
+    target = getTarget(obj, targetPath)
+    _targetBuffer.pin(canonicalPath(targetPath))
+    return target
+
+def _preloadTarget(obj, targetPath):
+    if Target.npzfile and getattr(_threadData, 'npzfile', None) is None:
+        _threadData.npzfile = np.load(os.path.join(Target.npzdir, 'targets.npz'))
+    return targetPath, Target(obj, targetPath)
+
+def preloadTargets(obj, targetPaths, threads=None, pin=True, progressCallback=None):
+    """
+    Load the specified targets using a pool of threads (by default one per
+    CPU), so that reading and decompressing the target files overlaps.
+    Targets that are already loaded are not loaded again. With pin, the
+    targets are pinned in the target cache, so they are never evicted.
+    progressCallback, if specified, is called with the fraction of targets
+    that is loaded.
+    Returns the number of targets that were loaded.
+    """
+    from multiprocessing import cpu_count
+    from multiprocessing.pool import ThreadPool
+
+    startTime = time.time()
+    targetPaths = [canonicalPath(path) for path in targetPaths]
+    if pin:
+        for targetPath in targetPaths:
+            _targetBuffer.pin(targetPath)
+    todo = [path for path in OrderedDict.fromkeys(targetPaths) if path not in _targetBuffer]
+    if not todo:
+        return 0
+
+    # Load the first target in this thread, this opens the target archive
+    getTarget(obj, todo[0])
+    if threads is None:
+        threads = cpu_count()
+    threads = max(1, min(threads, len(todo) - 1))
+    pool = ThreadPool(threads) if len(todo) > 1 else None
+    try:
+        if pool is not None:
+            loaded = pool.imap_unordered(lambda path: _preloadTarget(obj, path), todo[1:])
+        else:
+            loaded = []
+        for (i, (targetPath, target)) in enumerate(loaded):
+            _targetBuffer.add(targetPath, target)
+            if progressCallback:
+                progressCallback(float(i+2) / len(todo))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    log.message('Preloaded %d targets in %.2f seconds (%d threads)', len(todo), time.time() - startTime, threads)
+    return len(todo)
+
+def getTargetCache():
+    """
+    The cache of loaded targets (a TargetCache).
+    """
+    return _targetBuffer
+
+def setTargetCacheSize(size):
+    """
+    Limit the memory taken by the loaded targets to size megabytes (see
+    TargetCache), 0 or None for no limit.
+    """
+    _targetBuffer.setMaxBytes(int(size * 1024 * 1024) if size else None)
+
+def getTargetGeneration(targetPath):
+    """
+    The generation of the target data for the specified path (see
+    TargetCache.getGeneration). It changes when the target is reloaded with
+    possibly other data, not when it is only evicted from the cache.
+    """
+    return _targetBuffer.getGeneration(canonicalPath(targetPath))
+
 def refreshCachedTarget(targetPath):
     """
     Invalidate the cache for the specified target, so that it will be reloaded
@@ -338,9 +857,7 @@ def refreshCachedTarget(targetPath):
     Generally this only has effect if the target was loaded from an ascii file,
     not from npz archive.
     """
-    targetPath = canonicalPath(targetPath)
-    if targetPath in _targetBuffer:
-        del _targetBuffer[targetPath]
+    _targetBuffer.invalidate(canonicalPath(targetPath))
 
 def loadTranslationTarget(obj, targetPath, morphFactor, faceGroupToUpdateName=None, update=1, calcNorm=1, scale=[1.0,1.0,1.0], animatedMesh=None):
     """
@@ -233,6 +233,7 @@ class MHApplication(gui3d.Application, mh.Application):
                 'invertMouseWheel': False,
                 'lowspeed': 1,
                 'preloadTargets': True,
+                'targetCacheSize': 0,
                 'cameraAutoZoom': False,
                 'language': 'english',
                 'highspeed': 5,
@@ -258,6 +259,7 @@ class MHApplication(gui3d.Application, mh.Application):
                 'sliderImages': True,
                 'guiTheme': 'makehuman',
                 'preloadTargets': False,
+                'targetCacheSize': 0,
                 'restoreWindowSize': True,
                 'windowGeometry': ''
             }
@@ -709,16 +711,18 @@ class MHApplication(gui3d.Application, mh.Application):
 
         self.backgroundGradient.setPosition([0, 0, -0.85*cam.farPlane])
 
-    def loadMacroTargets(self):
+    def loadMacroTargets(self, groups=None, threads=None):
         """
-        Preload all target files belonging to group macrodetails and its child
-        groups.
+        Preload all target files belonging to the specified target groups and
+        their child groups (by default targets.PRELOAD_GROUPS: macrodetails
+        and measure), using a pool of threads. They are pinned in the target
+        cache, so they are never evicted.
         """
         import targets
-        #import getpath
-        for target in targets.getTargets().findTargets('macrodetails'):
-            #log.debug('Preloading target %s', getpath.getRelativePath(target.path))
-            algos3d.getTarget(self.selectedHuman.meshData, target.path)
+        if groups is None:
+            groups = targets.PRELOAD_GROUPS
+        algos3d.preloadTargets(self.selectedHuman.meshData, targets.getTargetPaths(groups), threads,
+                               progressCallback=lambda fraction: self.progress(fraction, 'Loading targets'))
 
     def loadFinish(self):
         self.selectedHuman.updateMacroModifiers()
@@ -772,12 +776,16 @@ class MHApplication(gui3d.Application, mh.Application):
         # except:
             # self.setTheme("default")
 
+        # Memory budget (in MB) of the loaded targets, 0 for no limit
+        algos3d.setTargetCacheSize(self.getSetting('targetCacheSize'))
+
+        # Preload the targets before they are applied for the first time
+        # progress.step('Loading macro targets')
+        if self.getSetting('preloadTargets'):
+            self.loadMacroTargets()
+
         # progress.step('Applying targets')
         self.loadFinish()
-        
-        # progress.step('Loading macro targets')
-        # if self.getSetting('preloadTargets'):
-            # self.loadMacroTargets()
 
         # progress.step('Loading done')
 
@@ -360,11 +360,18 @@ class Object3D(object):
         self.markCoords(ix, norm=True)
         if ix is None:
             ix = np.s_[:]
-
-        vface = self.vface[ix]
-        norms = self.fnorm[vface]
-        norms *= np.arange(self.MAX_FACES)[None,:,None] < self.nfaces[ix][:,None,None]
-        norms = np.sum(norms, axis=1)
+            faces = self._getVertexFaces()
+        else:
+            faces = self.vface[ix][self._getVertexFaceMask()[ix]]
+        nfaces = self.nfaces[ix]
+
+        # Sum the normals of the faces of each vertex, in the same order as
+        # the slots of vface
+        norms = np.zeros((len(nfaces), 3), dtype=np.float32)
+        used = nfaces > 0
+        if len(faces):
+            starts = np.cumsum(nfaces, dtype=np.intp) - nfaces
+            norms[used] = np.add.reduceat(self.fnorm[faces], starts[used], axis=0)
         norms /= np.sqrt(np.sum(norms ** 2, axis=-1))[:,None]
         self.vnorm[ix] = norms
 
@@ -496,6 +503,10 @@ class Object3D(object):
         self.vface = []         # References the faces that a vertex belongs to (limited to MAX_FACES) (idx = vertex idx)
         self.nfaces = 0         # Polycount
 
+        self._vface_mask = None     # Cached mask of the valid slots in vface
+        self._vface_flat = None     # Cached valid entries of vface, in row order
+        self._dirty_normals = True  # Vertices moved since the last full normal update (True for all)
+
         self.ucoor = False      # Update flags for updating to OpenGL renderbuffers
         self.unorm = False
         self.utang = False
@@ -528,6 +539,8 @@ class Object3D(object):
         self.color = np.zeros((nverts, 4), dtype=np.uint8) + 255
         self.vface = np.zeros((nverts, self.MAX_FACES), dtype=np.uint32)
         self.nfaces = np.zeros(nverts, dtype=np.uint8)
+        self._vface_mask = self._vface_flat = None
+        self._dirty_normals = True
 
         self.orig_coord = self.coord.copy() # Keep a copy of the original coordinates
 
@@ -563,11 +576,16 @@ class Object3D(object):
         if coor:
             if indices is None:
                 self.ucoor = True
+                self._dirty_normals = True
             else:
                 if self.ucoor is False:
                     self.ucoor = np.zeros(nverts, dtype=bool)
                 if self.ucoor is not True:
                     self.ucoor[indices] = True
+                if self._dirty_normals is False:
+                    self._dirty_normals = np.zeros(nverts, dtype=bool)
+                if self._dirty_normals is not True:
+                    self._dirty_normals[indices] = True
 
         if norm:
             if indices is None:
@@ -638,6 +656,8 @@ class Object3D(object):
                 self.group[...] = groups
 
         self.has_uv = uvs is not None
+        self._vface_mask = self._vface_flat = None
+        self._dirty_normals = True
 
         if not skipUpdate:
             self._update_faces()
@@ -691,6 +711,7 @@ class Object3D(object):
         # Construct vface: arrange face indices for same v_idx in different columns
         # Every row in the vface matrix contains a variable number of valid columns
         # (the number of valid columns for each row is stored in the nfaces array)
+        self._vface_mask = self._vface_flat = None
         map_ = np.argsort(self.fvert.flat)
         vi = self.fvert.flat[map_]
         # Map v_idx entries to row numbers of fvert (face_idx)
@@ -1088,13 +1109,34 @@ class Object3D(object):
         vert_mask[verts] = True
         return vert_mask, face_mask
 
+    def _getVertexFaceMask(self):
+        """
+        Mask that filters out the unused slots in vface. It is computed once
+        per topology (it is reset when the faces are set).
+        """
+        if self._vface_mask is None or len(self._vface_mask) != len(self.nfaces):
+            self._vface_mask = np.arange(self.MAX_FACES)[None,:] < self.nfaces[:,None]
+            self._vface_flat = None
+        return self._vface_mask
+
+    def _getVertexFaces(self):
+        """
+        The faces connected to each vertex, as one flat array in vertex order
+        (the vertex-face adjacency in compressed row form, nfaces holding the
+        row lengths). Cached per topology like _getVertexFaceMask().
+        """
+        mask = self._getVertexFaceMask()
+        if self._vface_flat is None:
+            self._vface_flat = self.vface[mask]
+        return self._vface_flat
+
     def getFaceMaskForVertices(self, verts):
         """
         Get mask that selects all faces that are connected to the specified
         vertices.
         """
         mask = np.zeros(len(self.fvert), dtype = bool)
-        valid = np.arange(self.MAX_FACES)[None,:] < self.nfaces[verts][:,None]  # Mask that filters out unused slots for faces connected to a vert
+        valid = self._getVertexFaceMask()[verts]  # Mask that filters out unused slots for faces connected to a vert
         vface = self.vface[verts]
         faces = vface[valid]
         mask[faces] = True
@@ -1153,7 +1195,34 @@ class Object3D(object):
 
         if recalcFaceNormals or recalcVertexNormals and self.calculateTangents:
             self.calcVertexTangents(verticesToUpdate)
-                
+
+        if recalcFaceNormals and recalcVertexNormals and verticesToUpdate is None and facesToUpdate is None:
+            self._dirty_normals = False
+
+    def updateNormals(self):
+        """
+        Recalculate the face and vertex normals (and tangents) affected by the
+        vertices that moved since the normals were last calculated for the
+        whole mesh (as marked by markCoords() or changeCoords()). These are the
+        normals of the faces connected to the moved vertices, and of all
+        vertices of those faces. The tangents depend on all faces (see
+        calcVertexTangents), so they are always recalculated for the whole
+        mesh. Does a full calcNormals() if all vertices were marked.
+        """
+        dirty = self._dirty_normals
+        if dirty is True:
+            self.calcNormals()
+            return
+        if dirty is False or not dirty.any():
+            return
+        faceMask = self.getFaceMaskForVertices(dirty)
+        vertMask = np.zeros(len(self.coord), dtype=bool)
+        vertMask[self.fvert[faceMask]] = True
+        self.calcFaceNormals(np.flatnonzero(faceMask))
+        self.calcVertexNormals(np.flatnonzero(vertMask))
+        self.calcVertexTangents()
+        self._dirty_normals = False
+
     def calcBBox(self, ix=None, onlyVisible = True, fixedFaceMask = None):
         """
         Calculates the axis aligned bounding box of this object in the object's coordinate system. 
@@ -0,0 +1,79 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+**Project Name:**      MakeHuman
+
+**Product Home Page:** http://www.makehuman.org/
+
+**Code Home Page:**    https://bitbucket.org/MakeHuman/makehuman/
+
+**Authors:**           Jonas Hauquier
+
+**Copyright(c):**      MakeHuman Team 2001-2017
+
+**Licensing:**         AGPL3
+
+    This file is part of MakeHuman (www.makehuman.org).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Abstract
+--------
+
+Generate bodies in batch, without starting the MakeHuman GUI.
+
+Usage: generate_bodies.py <requests file> <output folder>
+
+The requests file contains one body per line, in the same
+"gender,height,bust,waist,hip" format as the MakeHuman command line.
+"""
+
+import sys
+sys.path = [".", "./lib", "./apps", "./shared", "./core"] + sys.path
+import os
+import time
+
+def readRequests(path):
+    requests = []
+    with open(path, 'rU') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            requests.append( tuple([float(v) for v in line.split(',')]) )
+    return requests
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print "Usage: %s <requests file> <output folder>" % sys.argv[0]
+        sys.exit(1)
+
+    import numpy
+    numpy.seterr(all = 'ignore')
+    import bodygenerator
+
+    requests = readRequests(sys.argv[1])
+    t = time.time()
+    generator = bodygenerator.BodyGenerator(preloadTargets = True)
+    print "Loaded human in %.2f seconds" % (time.time() - t)
+
+    for idx, request in enumerate(requests):
+        t = time.time()
+        generator.generate(*request)
+        generator.exportObj(os.path.join(sys.argv[2], 'Body%04d.obj' % idx))
+        print "[%.0f%% done] generated body %s in %.2f seconds" % (100*(float(idx+1)/float(len(requests))), request, time.time() - t)
+    print "All done."
@@ -38,12 +38,21 @@ TODO
 
 import os
 import zipfile
+import cPickle as pickle
+import getpath
 from getpath import getSysDataPath, canonicalPath
 import log
 
 # TODO share with algos3d
 TARGETS_NPZ_PATH = getSysDataPath('targets.npz')
 
+# Version of the target index cache file, increase when the index changes
+TARGETS_INDEX_VERSION = 1
+
+# Target groups that are preloaded at startup: the macro targets, and the
+# measure targets that are modified by the Measure task
+PRELOAD_GROUPS = ['macrodetails', 'measure']
+
 # Defines reserved value keywords and which category they map to
 # Used for specifying dependencies between targets using their filename
 # Maps macro variable to discrete variables controlled by that macro modifier
@@ -95,6 +104,20 @@ class Component(object):
     def __repr__(self):
         return repr((self.key, self.data, self.path))
 
+    def __getstate__(self):
+        """
+        State stored in the target index cache, without the category tables.
+        """
+        state = self.__dict__.copy()
+        del state['_categories']
+        del state['_value_cat']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._categories = list(_categories)
+        self._value_cat = dict(_value_cat)
+
     def isRoot(self):
         return self.parent == None
 
@@ -160,6 +183,9 @@ class TargetsCrawler(object):
     def real_path(self, path):
         raise NotImplementedError("Implement TargetsCrawler.real_path(path)")
 
+    def getDependencies(self):
+        raise NotImplementedError("Implement TargetsCrawler.getDependencies()")
+
     def buildIndex(self):
         """
         Build target index
@@ -231,6 +257,7 @@ class FilesTargetsCrawler(TargetsCrawler):
     """
     def __init__(self, dataPath):
         super(FilesTargetsCrawler, self).__init__(dataPath)
+        self.dirs = []
 
     def is_dir(self, path):
         return os.path.isdir(path)
@@ -239,11 +266,19 @@ class FilesTargetsCrawler(TargetsCrawler):
         return os.path.isfile(path)
 
     def list_dir(self, path):
+        self.dirs.append(path)
         return os.listdir(path)
 
     def real_path(self, path):
         return os.path.normpath( os.path.join(self.dataPath, path) )
 
+    def getDependencies(self):
+        """
+        Paths that invalidate the index when they are modified.
+        A folder is modified when files are added to or removed from it.
+        """
+        return self.dirs
+
 
 class ZippedTargetsCrawler(TargetsCrawler):
     """
@@ -282,6 +317,12 @@ class ZippedTargetsCrawler(TargetsCrawler):
     def real_path(self, path):
         return os.path.join(self.dataPath, path).replace('\\', '/')
 
+    def getDependencies(self):
+        """
+        Paths that invalidate the index when they are modified.
+        """
+        return [self.npzPath, os.path.join(self.dataPath, 'images.list')]
+
     def namei(self, path):
         if isinstance(path, basestring):
             if not path:
@@ -347,11 +388,21 @@ class ZippedTargetsCrawler(TargetsCrawler):
 
 
 class Targets(object):
-    def __init__(self, dataPath):
+    def __init__(self, dataPath, cachePath=None):
+        """
+        Index the targets in the data path. If a cache path is specified, the
+        index is loaded from that cache file if it is still valid, otherwise
+        it is built and stored in the cache file.
+        """
         self.targets = []       # List of target files
         self.groups = {}        # Target components, ordered per group
         self.images = {}        # Images list
+        self.dependencies = {}  # Modification times of the paths this index depends on
+        if cachePath and self.loadIndex(dataPath, cachePath):
+            return
         self.walk(dataPath)
+        if cachePath:
+            self.saveIndex(dataPath, cachePath)
 
     def debugGroups(self):
         """
@@ -418,11 +469,80 @@ class Targets(object):
         self.images = targetFinder.images
         self.index = targetFinder.index
 
+        # The npz archive is a dependency even when it does not exist, so
+        # that the index is rebuilt once it is compiled
+        self.dependencies = _getModificationTimes([os.path.join(dataPath, 'targets.npz')] +
+                                                  targetFinder.getDependencies())
+
+    def loadIndex(self, dataPath, cachePath):
+        """
+        Load the index from a cache file. Returns False if there is no valid
+        cache for this data path.
+        """
+        if not os.path.isfile(cachePath):
+            return False
+        try:
+            with open(cachePath, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception as e:
+            log.debug("Could not load target index cache %s (%s)", cachePath, e)
+            return False
+        if cache.get('version') != TARGETS_INDEX_VERSION or cache.get('dataPath') != dataPath:
+            return False
+        if _getModificationTimes(cache['dependencies'].keys()) != cache['dependencies']:
+            log.debug("Target index cache %s is out of date.", cachePath)
+            return False
+
+        self.targets = cache['targets']
+        self.groups = cache['groups']
+        self.images = cache['images']
+        self.index = cache['index']
+        self.dependencies = cache['dependencies']
+        log.debug("%s targets loaded from target index cache %s.", len(self.targets), cachePath)
+        return True
+
+    def saveIndex(self, dataPath, cachePath):
+        cache = {'version': TARGETS_INDEX_VERSION,
+                 'dataPath': dataPath,
+                 'dependencies': self.dependencies,
+                 'targets': self.targets,
+                 'groups': self.groups,
+                 'images': self.images,
+                 'index': self.index}
+        try:
+            cacheDir = os.path.dirname(cachePath)
+            if cacheDir and not os.path.isdir(cacheDir):
+                os.makedirs(cacheDir)
+            with open(cachePath, 'wb') as f:
+                pickle.dump(cache, f, protocol=2)
+        except (IOError, OSError) as e:
+            log.warning("Could not save target index cache %s (%s)", cachePath, e)
+
+
+def _getModificationTimes(paths):
+    """
+    Modification times of the specified paths, as a dict (None for paths
+    that do not exist).
+    """
+    result = {}
+    for path in paths:
+        try:
+            result[path] = os.path.getmtime(path)
+        except OSError:
+            result[path] = None
+    return result
+
 
 _targets = None
 
 def getTargets():
     global _targets
     if _targets is None:
-        _targets = Targets(getSysDataPath())
+        _targets = Targets(getSysDataPath(), getpath.getPath(os.path.join('cache', 'targets.index')))
     return _targets
+
+def getTargetPaths(groups):
+    """
+    Paths of all targets belonging to the specified (partial) target groups.
+    """
+    return [target.path for group in groups for target in getTargets().findTargets(group)]
@@ -42,7 +42,7 @@ import os
 import json
 
 import gui3d
-import bvh
+import animationcache
 import getpath
 import animation
 import log
@@ -112,8 +112,7 @@ class ExpressionTaskView(gui3d.TaskView, filecache.MetadataCacher):
 
     def _load_pose_units(self):
         from collections import OrderedDict
-        self.base_bvh = bvh.load(getpath.getSysDataPath('poseunits/face-poseunits.bvh'), allowTranslation="none")
-        self.base_anim = self.base_bvh.createAnimationTrack(self.human.getBaseSkeleton(), name="Expression-Face-PoseUnits")
+        self.base_bvh, self.base_anim = animationcache.loadBvh(getpath.getSysDataPath('poseunits/face-poseunits.bvh'), self.human.getBaseSkeleton(), allowTranslation="none", name="Expression-Face-PoseUnits")
 
         poseunit_json = json.load(open(getpath.getSysDataPath('poseunits/face-poseunits.json'),'rb'), object_pairs_hook=OrderedDict)
         self.poseunit_names = poseunit_json['framemapping']
@@ -41,8 +41,7 @@ import mh
 import gui
 import log
 import filechooser as fc
-import animation
-import bvh
+import animationcache
 import os
 from core import G
 import getpath
@@ -171,11 +170,10 @@ class PoseLibraryTaskView(gui3d.TaskView, filecache.MetadataCacher):
             self.human.setPosed(True)
 
     def loadMhp(self, filepath):
-        return animation.loadPoseFromMhpFile(filepath, self.human.getBaseSkeleton())
+        return animationcache.loadMhp(filepath, self.human.getBaseSkeleton())
 
     def loadBvh(self, filepath, convertFromZUp="auto"):
-        bvh_file = bvh.load(filepath, convertFromZUp)
-        anim = bvh_file.createAnimationTrack(self.human.getBaseSkeleton())
+        bvh_file, anim = animationcache.loadBvh(filepath, self.human.getBaseSkeleton(), convertFromZUp)
         if "root" in bvh_file.joints:
             posedata = anim.getAtFramePos(0, noBake=True)
             root_bone_idx = 0
@@ -184,6 +182,7 @@ class PoseLibraryTaskView(gui3d.TaskView, filecache.MetadataCacher):
             self.bvh_root_translation = np.asarray(3*[0.0], dtype=np.float32)
         self.bvh_bone_length = self.calculateBvhBoneLength(bvh_file)
         self.autoScaleAnim(anim)
+        animationcache.bakeAnimation(anim, self.human.getBaseSkeleton(), filepath)
         _, _, _, license = self.getMetadata(filepath)
         anim.license = license
 
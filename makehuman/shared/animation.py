@@ -40,6 +40,7 @@ Data handlers for skeletal animation.
 
 import math
 import numpy as np
+import numpy.linalg as la
 import log
 import makehuman
 
@@ -50,6 +51,8 @@ INTERPOLATION = {
     'LOG':    2
 }
 
+BAKE_CHUNK_SIZE = 256   # Number of frames baked at once by AnimationTrack.bake
+
 # TODO allow saving AnimationTrack to binary file
 # TODO allow saving VertexBoneWeights to binary file
 
@@ -123,6 +126,11 @@ class AnimationTrack(object):
         Results in significant performance gain when skinning.
         We do skinning with 3x4 matrixes, as suggested in http://graphics.ucsd.edu/courses/cse169_w05/2-Skeleton.htm
         Section 2.3 (We assume the 4th row contains [0 0 0 1])
+
+        The frames are baked BAKE_CHUNK_SIZE at a time with stacked matrix
+        products, the same way Skeleton.setPose poses the bones for one frame
+        (see Skeleton.getLocalPoseMatrices and getGlobalPoseMatrices). The
+        pose of the skeleton is not changed.
         """
         if self.disableBaking:
             return
@@ -130,24 +138,24 @@ class AnimationTrack(object):
         from progress import Progress
 
         log.debug('Updating baked animation %s (%s frames)', self.name, self.nFrames)
-        progress = Progress(self.nFrames)
 
         bones = skel.getBones()
         if len(bones) != self.nBones:
             raise RuntimeError("Error baking animation %s: number of bones in animation data differs from bone count of skeleton %s" % (self.name, skel.name))
 
-        old_pose = skel.getPose()
+        invRest = skel.getInverseRestMatrices()
+
         self._data_baked = np.zeros((self.dataLen, 3, 4))
 
-        for f_idx in xrange(self.nFrames):
-            i = f_idx * self.nBones
-            skel.setPose(self._data[i:i+self.nBones])
-            for b_idx in xrange(self.nBones):
-                idx = i + b_idx
-                self._data_baked[idx,:,:] = bones[b_idx].matPoseVerts[:3,:4]
-            progress.step("Baking animation frame %s", f_idx+1)
+        progress = Progress(int(math.ceil(float(self.nFrames) / BAKE_CHUNK_SIZE)))
+        for f_start in xrange(0, self.nFrames, BAKE_CHUNK_SIZE):
+            f_end = min(f_start + BAKE_CHUNK_SIZE, self.nFrames)
+            frames = self._data[f_start*self.nBones:f_end*self.nBones].reshape(f_end-f_start, self.nBones, 3, 4)
 
-        skel.setPose(old_pose)
+            matPoseGlobal = skel.getGlobalPoseMatrices(skel.getLocalPoseMatrices(frames))
+            matPoseVerts = np.matmul(matPoseGlobal, invRest)
+            self._data_baked[f_start*self.nBones:f_end*self.nBones] = matPoseVerts[:,:,:3,:4].reshape(-1, 3, 4)
+            progress.step("Baking animation frames %s-%s", f_start+1, f_end)
 
     def scale(self, scale):
         """
@@ -491,6 +499,51 @@ def joinAnimations(anim1, anim2):
 
     return AnimationTrack(name, poseData, nFrames, framerate)
 
+class CompiledVertexWeights(object):
+    """
+    Vertex weights compiled to a fixed number of weights per vertex, as a
+    (nverts, nWeights) matrix of bone indices and one of their weights, sorted
+    per vertex by decreasing weight. Unused weights are 0 (with bone index 0).
+    Indexing returns the compiled weights of the indexed vertices.
+    """
+    def __init__(self, boneIdxs, weights):
+        self.boneIdxs = boneIdxs
+        self.weights = weights
+        self._blocks = {}
+        self._maxBoneIdx = None
+
+    @property
+    def nWeights(self):
+        return self.weights.shape[1]
+
+    def __len__(self):
+        return len(self.weights)
+
+    def __getitem__(self, key):
+        return CompiledVertexWeights(self.boneIdxs[key], self.weights[key])
+
+    def getMaxBoneIdx(self):
+        if self._maxBoneIdx is None:
+            self._maxBoneIdx = int(self.boneIdxs.max()) if self.boneIdxs.size else 0
+        return self._maxBoneIdx
+
+    def getBlocks(self, blockSize):
+        """
+        Split the vertices in blocks of blockSize vertices, returns a list of
+        (start, end, nCols) tuples, with nCols the number of weight columns
+        that are not zero for all vertices of the block (at least 1).
+        """
+        blocks = self._blocks.get(blockSize)
+        if blocks is None:
+            cols = np.arange(1, self.nWeights+1)
+            used = np.max(np.where(self.weights != 0, cols, 1), axis=1)
+            blocks = []
+            for start in xrange(0, len(self), blockSize):
+                end = min(start + blockSize, len(self))
+                blocks.append( (start, end, int(used[start:end].max())) )
+            self._blocks[blockSize] = blocks
+        return blocks
+
 class VertexBoneWeights(object):
     """
     Weighted vertex to bone assignments.
@@ -620,12 +673,13 @@ class VertexBoneWeights(object):
         self._compiled = {}
 
     def _calculate_num_weights(self):
-        self._wCounts = np.zeros(self._vertexCount, dtype=np.uint32)
-        for bname, wghts in self._data.items():
-            vs, _ = wghts
-            self._wCounts[vs] += 1
-        self._nWeights = max(self._wCounts)
-            
+        if len(self._data) > 0:
+            vs = np.concatenate([vs for vs, _ in self._data.values()])
+        else:
+            vs = np.zeros(0, dtype=np.uint32)
+        self._wCounts = np.bincount(vs, minlength=self._vertexCount).astype(np.uint32)
+        self._nWeights = self._wCounts.max()
+
     def _build_vertex_weights_data(self, vertexWeightsDict, vertexCount=None, rootBone="root"):
         """
         Build a consistent set of per-bone vertex weights from a dictionary loaded
@@ -660,55 +714,50 @@ class VertexBoneWeights(object):
             vcount = max([vn for vg in vertexWeightsDict.values() for vn,_ in vg])+1
         self._vertexCount = vcount
 
-        # Normalize weights and put them in np format
+        # Concatenate the (bone, vertex, weight) triples of all bones
+        from collections import OrderedDict
+        bnames = [bname for bname, vgroup in vertexWeightsDict.items() if len(vgroup) > 0]
+        lengths = [len(vertexWeightsDict[bname]) for bname in bnames]
+        items = np.asarray([item for bname in bnames for item in vertexWeightsDict[bname]], dtype=np.float64).reshape(-1, 2)
+        b_idxs = np.repeat(np.arange(len(bnames)), lengths)
+        v_idxs = items[:,0].astype(np.int64)
+        wghts = items[:,1]
+
+        # Calculate total weight per vertex (accumulated in the same order and
+        # precision as a per-item loop)
         wtot = np.zeros(vcount, np.float32)
-        for vgroup in vertexWeightsDict.values():
-            for item in vgroup:
-                vn,w = item
-                # Calculate total weight per vertex
-                wtot[vn] += w
+        np.add.at(wtot, v_idxs, wghts)
+
+        # Normalize weights, and merge doubles per bone. Sorting by bone and
+        # vertex index at once leaves the vertices of every bone sorted.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wghts = wghts / wtot[v_idxs]
+        keys, inverse = np.unique(b_idxs * vcount + v_idxs, return_inverse=True)
+        merged = np.zeros(len(keys), dtype=np.float64)
+        np.add.at(merged, inverse, wghts)
+        merged = merged.astype(np.float32)
+        b_idxs = keys // vcount
+        verts = (keys % vcount).astype(np.uint32)
+
+        # Filter out weights under the threshold
+        i_s = merged > WEIGHT_THRESHOLD
+        bounds = np.searchsorted(b_idxs[i_s], np.arange(len(bnames)+1))
+        verts = verts[i_s]
+        merged = merged[i_s]
 
-        from collections import OrderedDict
         boneWeights = OrderedDict()
-        for bname,vgroup in vertexWeightsDict.items():
-            if len(vgroup) == 0:
-                continue
-            weights = []
-            verts = []
-            v_lookup = {}
-            n = 0
-            for vn,w in vgroup:
-                if vn in v_lookup:
-                    # Merge doubles
-                    v_idx = v_lookup[vn]
-                    weights[v_idx] += w/wtot[vn]
-                else:
-                    v_lookup[vn] = len(verts)
-                    verts.append(vn)
-                    weights.append(w/wtot[vn])
-            verts = np.asarray(verts, dtype=np.uint32)
-            weights = np.asarray(weights, np.float32)
-            # Sort by vertex index
-            i_s = np.argsort(verts)
-            verts = verts[i_s]
-            weights = weights[i_s]
-            # Filter out weights under the threshold
-            i_s = np.argwhere(weights > WEIGHT_THRESHOLD)[:,0]
-            verts = verts[i_s]
-            weights = weights[i_s]
-            boneWeights[bname] = (verts, weights)
+        for b_idx, bname in enumerate(bnames):
+            boneWeights[bname] = (verts[bounds[b_idx]:bounds[b_idx+1]], merged[bounds[b_idx]:bounds[b_idx+1]])
 
         # Assign unweighted vertices to root bone with weight 1
-        if rootBone not in boneWeights.keys():
-            vs = []
-            ws = []
+        if rootBone not in boneWeights:
+            vs = np.zeros(0, dtype=np.uint32)
+            ws = np.zeros(0, dtype=np.float32)
         else:
             vs,ws = boneWeights[rootBone]
-            vs = list(vs)
-            ws = list(ws)
         rw_i = np.argwhere(wtot == 0)[:,0]
-        vs.extend(rw_i)
-        ws.extend(np.ones(len(rw_i), dtype=np.float32))
+        vs = np.concatenate([vs, rw_i.astype(np.uint32)])
+        ws = np.concatenate([ws, np.ones(len(rw_i), dtype=np.float32)])
         if len(rw_i) > 0:
             if len(rw_i) < 100:
                 # To avoid spamming the log, only print vertex indices if there's less than 100
@@ -716,7 +765,7 @@ class VertexBoneWeights(object):
             else:
                 log.debug("Adding trivial bone weights to root bone %s for %s unweighted vertices.", rootBone, len(rw_i))
         if len(vs) > 0:
-            boneWeights[rootBone] = (np.asarray(vs, dtype=np.uint32), np.asarray(ws, dtype=np.float32))
+            boneWeights[rootBone] = (vs, ws)
 
         return boneWeights
 
@@ -732,87 +781,56 @@ class VertexBoneWeights(object):
             if vertexCount:
                 vertexCount += 1
 
-        # TODO use simple array columns instead of structured arrays (they are array of structs, not struct of arrays)
-        if nWeights == 3:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), ('b_idx3', np.uint32), 
-                     ('wght1', np.float32), ('wght2', np.float32), ('wght3', np.float32)]
-        elif nWeights == 4:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), ('b_idx3', np.uint32), ('b_idx4', np.uint32),
-                     ('wght1', np.float32), ('wght2', np.float32), ('wght3', np.float32), ('wght4', np.float32)]
-        elif nWeights == 6:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), ('b_idx3', np.uint32), 
-                     ('b_idx4', np.uint32), ('b_idx5', np.uint32), ('b_idx6', np.uint32), 
-                     ('wght1', np.float32), ('wght2', np.float32), ('wght3', np.float32), 
-                     ('wght4', np.float32), ('wght5', np.float32), ('wght6', np.float32)]
-        elif nWeights == 5:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), ('b_idx3', np.uint32),
-                     ('b_idx4', np.uint32), ('b_idx5', np.uint32),
-                     ('wght1', np.float32), ('wght2', np.float32), ('wght3', np.float32),
-                     ('wght4', np.float32), ('wght5', np.float32)]
-        elif nWeights == 13:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), ('b_idx3', np.uint32), 
-                     ('b_idx4', np.uint32), ('b_idx5', np.uint32), ('b_idx6', np.uint32), 
-                     ('b_idx7', np.uint32), ('b_idx8', np.uint32), ('b_idx9', np.uint32), 
-                     ('b_idx10', np.uint32), ('b_idx11', np.uint32), ('b_idx12', np.uint32), 
-                     ('b_idx13', np.uint32),
-                     ('wght1', np.float32), ('wght2', np.float32), ('wght3', np.float32), 
-                     ('wght4', np.float32), ('wght5', np.float32), ('wght6', np.float32), 
-                     ('wght7', np.float32), ('wght8', np.float32), ('wght9', np.float32), 
-                     ('wght10', np.float32), ('wght11', np.float32), ('wght12', np.float32), 
-                     ('wght13', np.float32)]
-        elif nWeights == 2:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), 
-                     ('wght1', np.float32), ('wght2', np.float32)]
-        else:
-            dtype = [('b_idx1', np.uint32), ('wght1', np.float32)]
-        compiled_vertweights = np.zeros(vertexCount, dtype=dtype)
-
         # Convert weights from indexed by bone to indexed by vertex index
-        _ws = dict()
         b_lookup = dict([(b.name,b_idx) for b_idx,b in enumerate(skel.getBones())])
+        v_idxs = []
+        b_idxs = []
+        wghts = []
         for bname, mapping in vertBoneMapping.items():
             try:
                 b_idx = b_lookup[bname]
-                verts,weights = mapping
-                for v_idx, wght in zip(verts, weights):
-                    if v_idx not in _ws:
-                        _ws[v_idx] = []
-
-                    # TODO not needed for now (no remapping yet), and perhaps doubles should be removed upon merge, not when compiling
-                    # also in case of proxy remapping doubles need to be prevented
-                    '''
-                    b_idxs = [bidx for (_,bidx) in _ws[v_idx]]
-                    if b_idx in b_idxs:
-                        # Merge doubles (this needs to happen even if the _build_vertex_weights_data()
-                        # step already performs double removal, in the case where
-                        # weights were remapped to another rig and bones merged)
-                        _i = b_idxs.index(b_idx)
-                        _ws[v_idx][_i] = (_ws[v_idx][_i][0] + wght, b_idx)
-                    else:
-                        _ws[v_idx].append( (wght, b_idx) )
-                    '''
-                    _ws[v_idx].append( (wght, b_idx) )  # For now, assume there are no doubles
             except KeyError as e:
                 log.warning("Bone %s not found in skeleton: %s" % (bname, e))
-        for v_idx in _ws:
-            # Sort by weight and keep only nWeights most significant weights
-            if len(_ws[v_idx]) > nWeights:
-                #log.debug("Vertex %s has too many weights (%s): %s" % (v_idx, len(_ws[v_idx]), str(sorted(_ws[v_idx], reverse=True))))
-                _ws[v_idx] = sorted(_ws[v_idx], reverse=True)[:nWeights]
-                # Re-normalize weights
-                weightvals = np.asarray( [e[0] for e in _ws[v_idx]], dtype=np.float32)
-                weightvals /= np.sum(weightvals)
-                for i in xrange(nWeights):
-                    _ws[v_idx][i] = (weightvals[i], _ws[v_idx][i][1])
-            else:
-                _ws[v_idx] = sorted(_ws[v_idx], reverse=True)
-
-        for v_idx, wghts in _ws.items():
-            for i, (w, bidx) in enumerate(wghts):
-                compiled_vertweights[v_idx]['wght%s' % (i+1)] = w
-                compiled_vertweights[v_idx]['b_idx%s' % (i+1)] = bidx
-
-        return compiled_vertweights
+                continue
+            verts,weights = mapping
+            v_idxs.append(np.asarray(verts, dtype=np.int64))
+            b_idxs.append(np.repeat(np.int64(b_idx), len(verts)))
+            wghts.append(np.asarray(weights))
+        # TODO doubles are not merged (no remapping yet), in case of proxy remapping doubles need to be prevented
+        if v_idxs:
+            v_idxs = np.concatenate(v_idxs)
+            b_idxs = np.concatenate(b_idxs)
+            wghts = np.concatenate(wghts)
+        else:
+            v_idxs = b_idxs = np.zeros(0, dtype=np.int64)
+            wghts = np.zeros(0, dtype=np.float32)
+
+        # Sort by vertex, and per vertex by weight (and bone index) in
+        # descending order
+        order = np.lexsort((-b_idxs, -wghts, v_idxs))
+        v_idxs = v_idxs[order]
+        b_idxs = b_idxs[order]
+        wghts = wghts[order]
+
+        # Keep only nWeights most significant weights per vertex
+        counts = np.bincount(v_idxs, minlength=vertexCount)
+        starts = np.cumsum(counts) - counts
+        rank = np.arange(len(v_idxs)) - starts[v_idxs]
+        i_s = rank < nWeights
+
+        compiled = CompiledVertexWeights(np.zeros((vertexCount, nWeights), dtype=np.uint32),
+                                         np.zeros((vertexCount, nWeights), dtype=np.float32))
+        compiled.boneIdxs[v_idxs[i_s], rank[i_s]] = b_idxs[i_s]
+        compiled.weights[v_idxs[i_s], rank[i_s]] = wghts[i_s]
+
+        # Re-normalize weights of vertices that had too many weights
+        truncated = np.argwhere(counts > nWeights)[:,0]
+        if len(truncated) > 0:
+            weightvals = compiled.weights[truncated]
+            weightvals /= np.sum(weightvals, axis=1)[:,None]
+            compiled.weights[truncated] = weightvals
+
+        return compiled
 
 class AnimatedMesh(object):
     """
@@ -1067,13 +1085,17 @@ class AnimatedMesh(object):
                             log.debug("Compiling vertex bone weights for %s", mesh.name)
                             self.__vertexToBoneMaps[idx].compileData(self.getBaseSkeleton(), 6)
 
-                        # New fast skinnig approach
-                        posedCoords = skinMesh(self.__originalMeshCoords[idx], self.__vertexToBoneMaps[idx].compiled(6), poseState)
+                        # New fast skinnig approach, writes the posed coordinates
+                        # directly to the mesh
+                        skinMesh(self.__originalMeshCoords[idx], self.__vertexToBoneMaps[idx].compiled(6), poseState, out=mesh.coord)
+                        posedCoords = None
                 except Exception as e:
                     log.error("Error skinning mesh %s", mesh.name, exc_info=True)
                     raise e
-                # TODO you could avoid an array copy by passing the mesh.coord list directly and modifying it in place
-                self._updateMeshVerts(mesh, posedCoords[:,:3])
+                if posedCoords is None:
+                    self._updateMeshVerts(mesh)
+                else:
+                    self._updateMeshVerts(mesh, posedCoords[:,:3])
 
             # Adapt the bones of the skeleton to match current skinned pose (slower, should only be used for static poses)
             if syncSkeleton and self.__currentAnim.isBaked():
@@ -1084,13 +1106,20 @@ class AnimatedMesh(object):
             for idx,mesh in enumerate(self.__meshes):
                 self._updateMeshVerts(mesh, self.__originalMeshCoords[idx])
 
-    def _updateMeshVerts(self, mesh, verts):
+    def _updateMeshVerts(self, mesh, verts=None):
+        """
+        Set the coordinates of the mesh to verts, or if verts is None, update
+        the mesh after its coordinates were modified in place.
+        """
         # TODO this is way too slow for realtime animation, but good for posing. For animation, update the r_ verts directly, as well as the r_vnorm members
         # TODO use this mapping to directly update the opengl data for animation
         # Remap vertex weights to the unwelded vertices of the object (mesh.coord to mesh.r_coord)
         #originalToUnweldedMap = mesh.inverse_vmap
 
-        mesh.changeCoords(verts[:,:3])
+        if verts is None:
+            mesh.markCoords(coor=True)
+        else:
+            mesh.changeCoords(verts[:,:3])
         mesh.calcNormals()  # TODO this is too slow for animation
         mesh.update()
 
@@ -1119,7 +1148,23 @@ class AnimatedMesh(object):
             # pose state is restored to rest
             self.getBaseSkeleton().setToRestPose()
 
-def skinMesh(coords, compiledVertWeights, poseData):
+SKIN_BLOCK_SIZE = 4096   # Number of vertices skinned at once by skinMesh
+
+_skinBuffers = {}
+
+def _getSkinBuffer(name, rowShape, dtype):
+    """
+    Scratch buffer of skinMesh with the specified name, with SKIN_BLOCK_SIZE
+    rows of shape rowShape. It is allocated once for every name, row shape and
+    dtype, and sliced for smaller blocks and meshes.
+    """
+    key = (name, rowShape, np.dtype(dtype))
+    buf = _skinBuffers.get(key)
+    if buf is None or len(buf) != SKIN_BLOCK_SIZE:
+        buf = _skinBuffers[key] = np.empty((SKIN_BLOCK_SIZE,) + rowShape, dtype=dtype)
+    return buf
+
+def skinMesh(coords, compiledVertWeights, poseData, out=None):
     """
     More efficient way of linear blend skinning or smooth skinning.
     As proposed in http://graphics.ucsd.edu/courses/cse169_w05/3-Skin.htm we use
@@ -1134,6 +1179,13 @@ def skinMesh(coords, compiledVertWeights, poseData):
     rotations only (for directions such as normals, tangents and targets).
     If coords is nx3 size, this method will perform faster as only 3x3 matrix
     multiplies are performed, otherwise 3x4 matrices are multiplied.
+
+    Vertices are skinned in blocks of SKIN_BLOCK_SIZE, accumulating the
+    matrices in reused buffers, and skipping the weights that are zero for all
+    vertices of a block. If out is specified (a [nverts, 3] array, for example
+    the coordinates of the skinned mesh), the result is written to it, and the
+    skinning is done in the precision of out, otherwise a new array is
+    returned.
     """
     # TODO allow skinning only the visible (not statically hidden) vertices, for performance reasons (eg if an alt. topology is set, do we animate both basemesh and topology?)
 
@@ -1146,64 +1198,57 @@ def skinMesh(coords, compiledVertWeights, poseData):
         c = 3
 
     W = compiledVertWeights
-    P = poseData
-    if len(compiledVertWeights.dtype) == 4*2:
-        # nWeights = 4
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c] + \
-                W['wght3'][:,None,None] * P[W['b_idx3']][:,:3,:c] + \
-                W['wght4'][:,None,None] * P[W['b_idx4']][:,:3,:c]
-    elif len(compiledVertWeights.dtype) == 2:
-        # nWeights = 1
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c]
-    elif len(compiledVertWeights.dtype) == 6*2:
-        # nWeights = 13
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c] + \
-                W['wght3'][:,None,None] * P[W['b_idx3']][:,:3,:c] + \
-                W['wght4'][:,None,None] * P[W['b_idx4']][:,:3,:c] + \
-                W['wght5'][:,None,None] * P[W['b_idx5']][:,:3,:c] + \
-                W['wght6'][:,None,None] * P[W['b_idx6']][:,:3,:c]
-    elif len(compiledVertWeights.dtype) == 5*2:
-        # nWeights = 5
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c] + \
-                W['wght3'][:,None,None] * P[W['b_idx3']][:,:3,:c] + \
-                W['wght4'][:,None,None] * P[W['b_idx4']][:,:3,:c] + \
-                W['wght5'][:,None,None] * P[W['b_idx5']][:,:3,:c]
-    elif len(compiledVertWeights.dtype) == 13*2:
-        # nWeights = 13
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c] + \
-                W['wght3'][:,None,None] * P[W['b_idx3']][:,:3,:c] + \
-                W['wght4'][:,None,None] * P[W['b_idx4']][:,:3,:c] + \
-                W['wght5'][:,None,None] * P[W['b_idx5']][:,:3,:c] + \
-                W['wght6'][:,None,None] * P[W['b_idx6']][:,:3,:c] + \
-                W['wght7'][:,None,None] * P[W['b_idx7']][:,:3,:c] + \
-                W['wght8'][:,None,None] * P[W['b_idx8']][:,:3,:c] + \
-                W['wght9'][:,None,None] * P[W['b_idx9']][:,:3,:c] + \
-                W['wght10'][:,None,None] * P[W['b_idx10']][:,:3,:c] + \
-                W['wght11'][:,None,None] * P[W['b_idx11']][:,:3,:c] + \
-                W['wght12'][:,None,None] * P[W['b_idx12']][:,:3,:c] + \
-                W['wght13'][:,None,None] * P[W['b_idx13']][:,:3,:c]
-    elif len(compiledVertWeights.dtype) == 2*2:
-        # nWeights = 2
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c]
+    if out is not None:
+        # Skin in the precision of out (eg. float32 mesh coordinates, while
+        # baked pose matrices are float64), so the products are written
+        # straight into it
+        dtype = out.dtype
     else:
-        # nWeights = 3
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c] + \
-                W['wght3'][:,None,None] * P[W['b_idx3']][:,:3,:c]
-
-    # Note: np.sum(M * vs, axis=-1) is a matrix multiplication of mat M with
-    # a series of vertices vs
-    # Good resource: http://jameshensman.wordpress.com/2010/06/14/multiple-matrix-multiplication-in-numpy
-    #return np.sum(accum[:,:3,:4] * coords[:,None,:], axis=-1)
-
-    # Using einstein summation for matrix * vertex multiply, appears to be
-    # slightly faster
-    return np.einsum('ijk,ikl -> ij', accum[:,:3,:c], coords[:,:c,None])
+        dtype = np.result_type(W.weights, poseData)
+    P = np.ascontiguousarray(poseData[:,:3,:c], dtype=dtype)
+    if out is None:
+        out = np.empty((len(W), 3), dtype=np.result_type(dtype, coords))
+
+    if len(W) > 0 and W.getMaxBoneIdx() >= len(P):
+        raise IndexError("Bone index %s of vertex weights out of range for %s pose matrices" % (W.getMaxBoneIdx(), len(P)))
+
+    accum = _getSkinBuffer('accum', (3,c), dtype)
+    tmp = _getSkinBuffer('tmp', (3,c), dtype)
+    rdtype = np.result_type(dtype, coords)
+    # Write the products straight into out if it has the result type
+    direct = out.dtype == rdtype
+    if not direct:
+        result = _getSkinBuffer('result', (3,), rdtype)
+    rtmp = _getSkinBuffer('rtmp', (3,), rdtype)
+    for start, end, nCols in W.getBlocks(SKIN_BLOCK_SIZE):
+        a = accum[:end-start]
+        t = tmp[:end-start]
+        b_idxs = W.boneIdxs[start:end]
+        wghts = W.weights[start:end]
+        np.take(P, b_idxs[:,0], axis=0, out=a, mode='clip')
+        a *= wghts[:,0,None,None]
+        for i in xrange(1, nCols):
+            np.take(P, b_idxs[:,i], axis=0, out=t, mode='clip')
+            t *= wghts[:,i,None,None]
+            a += t
+
+        # Multiply the accumulated matrices with the vertices, summing the
+        # products in the same (reverse) order as
+        # np.einsum('ijk,ikl -> ij', accum, coords[:,:,None]) does, which is
+        # considerably slower
+        if direct:
+            r = out[start:end]
+        else:
+            r = result[:end-start]
+        rt = rtmp[:end-start]
+        crds = coords[start:end]
+        np.multiply(a[:,:,c-1], crds[:,c-1,None], out=r)
+        for k in xrange(c-2, -1, -1):
+            np.multiply(a[:,:,k], crds[:,k,None], out=rt)
+            r += rt
+        if not direct:
+            out[start:end] = r
+    return out
 
 def emptyTrack(nFrames, nBones=1):
     """
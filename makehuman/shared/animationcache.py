@@ -0,0 +1,246 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Compiled cache of animations and poses.
+
+**Project Name:**      MakeHuman
+
+**Product Home Page:** http://www.makehuman.org/
+
+**Code Home Page:**    https://bitbucket.org/MakeHuman/makehuman/
+
+**Authors:**           Jonas Hauquier
+
+**Copyright(c):**      MakeHuman Team 2001-2017
+
+**Licensing:**         AGPL3
+
+    This file is part of MakeHuman (www.makehuman.org).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Abstract
+--------
+
+Loading a BVH or MHP file parses its text and retargets the motion to the
+skeleton, and the animation is baked for the skeleton again when it is shown.
+This module keeps the results in the cache/animations folder of the user data
+path, so that selecting the same animation or pose again only memory maps
+them.
+
+A compiled animation file (.mhanim) belongs to one source file, its loading
+options and the skeleton structure (see getSkeletonHash). It is an
+uncompressed numpy .npz archive (see binarymesh.mapArrays) with these arrays:
+
+    version         format version (ANIMATION_CACHE_VERSION)
+    source          modification time and size of the source file
+    skeleton        hash of the skeleton the animation is retargeted to
+    animdata        (nFrames*nBones, 3, 4) float32 retargeted pose matrices
+
+and, for BVH files, the parsed joint hierarchy and motion (see BVH.toArrays).
+
+The baked skinning matrices of an animation are stored in a .mhbake file next
+to it, together with hashes of the skeleton rest pose and of the pose data
+they were baked from (see bakeAnimation, only for animations of at least
+BAKE_CACHE_MIN_FRAMES frames):
+
+    version         format version (ANIMATION_CACHE_VERSION)
+    resthash        hash of the rest matrices of the skeleton
+    datahash        hash of the pose data of the animation
+    baked           (nFrames*nBones, 3, 4) float64 skinning matrices
+
+Compiled files are written again when the modification time or size of their
+source file changes. They are memory mapped copy-on-write, so changes made to
+the loaded animations (like scaling their root translation) are not written
+back to the cache.
+"""
+
+import os
+import hashlib
+import numpy as np
+
+import animation
+import bvh
+import binarymesh
+import getpath
+import log
+
+ANIMATION_CACHE_VERSION = 1
+
+# Animations with fewer frames are baked faster than their baked file is checked
+BAKE_CACHE_MIN_FRAMES = 16
+
+
+def getCachePath(filepath, key, ext):
+    """
+    Path of the compiled file with extension ext for source file filepath,
+    loaded with the options and skeleton identified by key.
+    """
+    folder = getpath.getPath(os.path.join('cache', 'animations'))
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    source = getpath.pathToUnicode(os.path.abspath(filepath))
+    digest = hashlib.sha1((u'%s|%s' % (source, key)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(folder, '%s-%s%s' % (name, digest, ext))
+
+def getSkeletonHash(skel):
+    """
+    Hash of the bone structure of a skeleton, that determines how animations
+    are retargeted to it.
+    """
+    h = hashlib.sha1()
+    for bone in skel.getBones():
+        h.update('%s|%s|%s\n' % (bone.name, bone.parent.name if bone.parent else '', ','.join(bone.reference_bones)))
+    return h.hexdigest()
+
+def getRestHash(skel):
+    """
+    Hash of the rest pose of a skeleton, that determines how animations are
+    baked for it.
+    """
+    return hashlib.md5(np.ascontiguousarray(skel.getRestMatrices())).hexdigest()
+
+def _sourceStat(filepath):
+    st = os.stat(filepath)
+    return np.array([st.st_mtime, st.st_size], dtype=np.float64)
+
+def _hashArray(hexdigest):
+    return np.fromstring(hexdigest, dtype='S1')
+
+
+def _loadCompiled(path, filepath=None, skelHash=None):
+    if not os.path.isfile(path):
+        raise RuntimeError('compiled file missing: %s' % path)
+    arrays = binarymesh.mapArrays(path, mode='c')
+    if int(arrays['version'][0]) != ANIMATION_CACHE_VERSION:
+        raise RuntimeError('compiled file has another version: %s' % path)
+    if filepath is not None and not np.array_equal(arrays['source'], _sourceStat(filepath)):
+        raise RuntimeError('compiled file out of date: %s' % path)
+    if skelHash is not None and arrays['skeleton'].tostring() != skelHash:
+        raise RuntimeError('compiled file for another skeleton: %s' % path)
+    return arrays
+
+def _saveCompiled(path, arrays):
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    arrays['version'] = np.array([ANIMATION_CACHE_VERSION], dtype=np.int32)
+    # Written to a temporary file first, the old file can still be mapped
+    tmppath = path + '.tmp'
+    with open(tmppath, 'wb') as f:
+        np.savez(f, **arrays)
+    try:
+        os.rename(tmppath, path)
+    except OSError:
+        # Windows does not replace existing files
+        os.remove(path)
+        os.rename(tmppath, path)
+
+def _logProblem(e):
+    if isinstance(e, RuntimeError):
+        log.message('%s', e)
+    else:
+        log.warning('Problem loading compiled animation: %s', e, exc_info=True)
+
+
+def loadBvh(filepath, skel, convertFromZUp="auto", allowTranslation="onlyroot", name=None):
+    """
+    Load a BVH file and retarget its motion to skeleton skel, from its
+    compiled animation file if that is up to date. Returns the BVH and the
+    animation track, the same as
+        bvh_file = bvh.load(filepath, convertFromZUp, allowTranslation)
+        anim = bvh_file.createAnimationTrack(skel, name)
+    """
+    skelHash = getSkeletonHash(skel)
+    path = getCachePath(filepath, 'bvh|%s|%s|%s' % (convertFromZUp, allowTranslation, skelHash), '.mhanim')
+    try:
+        arrays = _loadCompiled(path, filepath, skelHash)
+        bvh_file = bvh.BVH(os.path.splitext(os.path.basename(filepath))[0])
+        bvh_file.fromArrays(arrays)
+        anim = animation.AnimationTrack(name or bvh_file.name, arrays['animdata'], bvh_file.frameCount, 1.0/bvh_file.frameTime)
+        log.debug('Loaded compiled animation %s', path)
+        return bvh_file, anim
+    except Exception as e:
+        _logProblem(e)
+
+    bvh_file = bvh.load(filepath, convertFromZUp, allowTranslation)
+    anim = bvh_file.createAnimationTrack(skel, name)
+    try:
+        arrays = bvh_file.toArrays()
+        arrays.update(source = _sourceStat(filepath),
+                      skeleton = _hashArray(skelHash),
+                      animdata = anim._data)
+        _saveCompiled(path, arrays)
+    except StandardError:
+        log.notice('unable to save compiled animation: %s', path, exc_info=True)
+    return bvh_file, anim
+
+def loadMhp(filepath, skel):
+    """
+    Load a MHP pose file for skeleton skel, from its compiled animation file if
+    that is up to date (see animation.loadPoseFromMhpFile).
+    """
+    skelHash = getSkeletonHash(skel)
+    path = getCachePath(filepath, 'mhp|%s' % skelHash, '.mhanim')
+    try:
+        arrays = _loadCompiled(path, filepath, skelHash)
+        log.debug('Loaded compiled pose %s', path)
+        return animation.Pose(os.path.splitext(os.path.basename(filepath))[0], arrays['animdata'])
+    except Exception as e:
+        _logProblem(e)
+
+    pose = animation.loadPoseFromMhpFile(filepath, skel)
+    try:
+        _saveCompiled(path, dict(source = _sourceStat(filepath),
+                                 skeleton = _hashArray(skelHash),
+                                 animdata = pose._data))
+    except StandardError:
+        log.notice('unable to save compiled pose: %s', path, exc_info=True)
+    return pose
+
+def bakeAnimation(anim, skel, filepath):
+    """
+    Bake animation anim, loaded from filepath, for skeleton skel (see
+    AnimationTrack.bake). The skinning matrices are loaded from the compiled
+    file of the animation if they were baked for the same rest pose and pose
+    data, otherwise they are baked and the compiled file is replaced.
+    Poses and animations shorter than BAKE_CACHE_MIN_FRAMES are always baked.
+    """
+    if anim.disableBaking:
+        return
+    if anim.nFrames < BAKE_CACHE_MIN_FRAMES:
+        anim.bake(skel)
+        return
+
+    restHash = getRestHash(skel)
+    dataHash = hashlib.md5(np.ascontiguousarray(anim._data)).hexdigest()
+    path = getCachePath(filepath, 'bake|%s' % getSkeletonHash(skel), '.mhbake')
+    try:
+        arrays = _loadCompiled(path)
+        if arrays['resthash'].tostring() != restHash or arrays['datahash'].tostring() != dataHash:
+            raise RuntimeError('compiled file baked for another rest pose or animation: %s' % path)
+        anim._data_baked = arrays['baked']
+        log.debug('Loaded compiled baked animation %s', path)
+        return
+    except Exception as e:
+        _logProblem(e)
+
+    anim.bake(skel)
+    try:
+        _saveCompiled(path, dict(resthash = _hashArray(restHash),
+                                 datahash = _hashArray(dataHash),
+                                 baked = anim._data_baked))
+    except StandardError:
+        log.notice('unable to save compiled baked animation: %s', path, exc_info=True)
@@ -0,0 +1,250 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Binary export of meshes, for tools that process many exported bodies.
+
+**Project Name:**      MakeHuman
+
+**Product Home Page:** http://www.makehuman.org/
+
+**Code Home Page:**    https://bitbucket.org/MakeHuman/makehuman/
+
+**Authors:**           Jonas Hauquier
+
+**Copyright(c):**      MakeHuman Team 2001-2017
+
+**Licensing:**         AGPL3
+
+    This file is part of MakeHuman (www.makehuman.org).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Abstract
+--------
+
+A binary mesh file (.mhbin) contains the same geometry as the OBJ file
+written by wavefront.writeObjFile, together with the body sections, joints and
+landmarks that are written to the BodyInfo file, without any text formatting.
+It is an uncompressed numpy .npz archive, so that all arrays can be memory
+mapped when loading it (see loadBinaryMesh), with these arrays:
+
+    version         format version (BINARY_MESH_VERSION)
+    coord           (nverts, 3) float32 vertex coordinates
+    vnorm           (nverts, 3) float32 vertex normals
+    texco           (nuvs, 2) float32 UV coordinates
+    fvert           (nfaces, 4) int32 vertex indices of the faces
+    fuvs            (nfaces, 4) int32 UV indices of the faces (-1 without UVs)
+    group           (nfaces,) int32 face group index of the faces
+    fgstr, fgidx    packed face group names
+    meshstr, meshidx packed names of the exported meshes
+    meshverts       (nmeshes + 1,) offset of the first vertex of each mesh
+    meshfaces       (nmeshes + 1,) offset of the first face of each mesh
+    meshuvs         (nmeshes + 1,) offset of the first UV of each mesh
+    sectstr, sectidx packed body section names (wavefront.SECTION_NAMES)
+    sectverts       vertex indices of all sections, concatenated
+    sectoffset      (nsections + 1,) offset of each section in sectverts
+    jointstr, jointidx packed joint names
+    joints          (njoints, 3) float64 joint positions, in mesh coordinates
+    landmarkstr, landmarkidx packed landmark names
+    landmarks       (nlandmarks,) float64 landmark values, as in BodyInfo
+    crotch          crotch level, in mesh coordinates
+
+All indices are 0-based and relative to the whole file (not to the mesh they
+belong to). Only the unmasked faces are stored.
+"""
+
+import zipfile
+import numpy as np
+
+from files3d import packStringList, unpackStringList
+import wavefront
+import log
+
+BINARY_MESH_VERSION = 1
+
+
+def writeBinaryMesh(path, meshes, joints, landmarks=None, config=None, filterMaskedFaces=True):
+    """
+    Write meshes (a list of Object3D) to a binary mesh file, together with
+    their body sections, joints and landmarks (a dict of name: value).
+    Scale and offset are applied as for the OBJ export.
+    """
+    if not isinstance(meshes, list):
+        meshes = [meshes]
+
+    if config and config.feetOnGround:
+        offset = config.offset
+    else:
+        offset = [0, 0, 0]
+
+    scale = config.scale if config is not None else 1.0
+
+    meshes = [m.clone(scale=scale, filterMaskedVerts=filterMaskedFaces) for m in meshes]
+
+    # Same coordinates as the OBJ export, so the sections are shared with
+    # wavefront.splitSections
+    exported = np.concatenate([mesh.coord for mesh in meshes]) + offset
+    coord = exported.astype(np.float32)
+    vnorm = np.concatenate([mesh.vnorm for mesh in meshes]).astype(np.float32)
+    texco = np.concatenate([mesh.texco for mesh in meshes if mesh.has_uv] or
+                           [np.zeros((0, 2), dtype=np.float32)]).astype(np.float32)
+
+    meshverts = np.zeros(len(meshes)+1, dtype=np.int32)
+    meshfaces = np.zeros(len(meshes)+1, dtype=np.int32)
+    meshuvs = np.zeros(len(meshes)+1, dtype=np.int32)
+    fverts = []
+    fuvs = []
+    groups = []
+    fgNames = []
+    for mIdx, mesh in enumerate(meshes):
+        fverts.append(mesh.fvert[mesh.face_mask] + meshverts[mIdx])
+        if mesh.has_uv:
+            fuvs.append(mesh.fuvs[mesh.face_mask] + meshuvs[mIdx])
+        else:
+            fuvs.append(-np.ones((len(fverts[-1]), 4), dtype=np.int32))
+        groups.append(mesh.group[mesh.face_mask] + len(fgNames))
+        fgNames.extend(fg.name for fg in mesh.faceGroups)
+
+        meshverts[mIdx+1] = meshverts[mIdx] + len(mesh.coord)
+        meshfaces[mIdx+1] = meshfaces[mIdx] + len(fverts[-1])
+        meshuvs[mIdx+1] = meshuvs[mIdx] + (len(mesh.texco) if mesh.has_uv else 0)
+
+    crotch, sections = wavefront.getSections(exported, joints)
+    sectverts = [sections[name] for name in wavefront.SECTION_NAMES]
+    sectoffset = np.zeros(len(sectverts)+1, dtype=np.int32)
+    sectoffset[1:] = np.cumsum([len(s) for s in sectverts])
+
+    if landmarks is None:
+        landmarks = {}
+    jointNames = sorted(joints.keys())
+    landmarkNames = sorted(landmarks.keys())
+
+    fgstr, fgidx = packStringList(fgNames)
+    meshstr, meshidx = packStringList(mesh.name for mesh in meshes)
+    sectstr, sectidx = packStringList(wavefront.SECTION_NAMES)
+    jointstr, jointidx = packStringList(jointNames)
+    landmarkstr, landmarkidx = packStringList(landmarkNames)
+
+    vars_ = dict(
+        version = np.array([BINARY_MESH_VERSION], dtype=np.int32),
+        coord = coord,
+        vnorm = vnorm,
+        texco = texco,
+        fvert = np.concatenate(fverts).astype(np.int32),
+        fuvs = np.concatenate(fuvs).astype(np.int32),
+        group = np.concatenate(groups).astype(np.int32),
+        fgstr = fgstr,
+        fgidx = fgidx,
+        meshstr = meshstr,
+        meshidx = meshidx,
+        meshverts = meshverts,
+        meshfaces = meshfaces,
+        meshuvs = meshuvs,
+        sectstr = sectstr,
+        sectidx = sectidx,
+        sectverts = np.concatenate(sectverts).astype(np.int32),
+        sectoffset = sectoffset,
+        jointstr = jointstr,
+        jointidx = jointidx,
+        joints = np.asarray([joints[name] for name in jointNames], dtype=np.float64).reshape(-1, 3),
+        landmarkstr = landmarkstr,
+        landmarkidx = landmarkidx,
+        landmarks = np.asarray([landmarks[name] for name in landmarkNames], dtype=np.float64),
+        crotch = np.array([crotch], dtype=np.float64))
+
+    # Uncompressed, so that the arrays can be memory mapped. Written to a
+    # file object so that numpy does not append the .npz extension.
+    with open(path, 'wb') as f:
+        np.savez(f, **vars_)
+
+
+class BinaryMesh(object):
+    """
+    Contents of a binary mesh file. All arrays of the file are available as
+    attributes with the same name, the names and indices stored in the file
+    are unpacked to the attributes faceGroups, meshNames, sections (a dict of
+    name: vertex indices), joints (a dict of name: position) and landmarks
+    (a dict of name: value).
+    """
+
+    def __init__(self, arrays):
+        version = int(arrays['version'][0])
+        if version > BINARY_MESH_VERSION:
+            raise RuntimeError('Unsupported binary mesh version %s (expected %s or lower)' % (version, BINARY_MESH_VERSION))
+        self.version = version
+
+        for name, array in arrays.items():
+            if name not in ['version', 'joints', 'landmarks', 'crotch']:
+                setattr(self, name, array)
+
+        self.crotch = float(arrays['crotch'][0])
+        self.faceGroups = unpackStringList(arrays['fgstr'], arrays['fgidx'])
+        self.meshNames = unpackStringList(arrays['meshstr'], arrays['meshidx'])
+
+        sectionNames = unpackStringList(arrays['sectstr'], arrays['sectidx'])
+        offsets = arrays['sectoffset']
+        self.sections = dict((name, arrays['sectverts'][offsets[i]:offsets[i+1]])
+                             for i, name in enumerate(sectionNames))
+
+        jointNames = unpackStringList(arrays['jointstr'], arrays['jointidx'])
+        self.joints = dict(zip(jointNames, arrays['joints']))
+        landmarkNames = unpackStringList(arrays['landmarkstr'], arrays['landmarkidx'])
+        self.landmarks = dict(zip(landmarkNames, arrays['landmarks'].tolist()))
+
+
+def mapArrays(path, mode='r'):
+    """
+    Memory map all arrays of an uncompressed .npz archive, read-only or with
+    the specified numpy.memmap mode (for example 'c' for copy-on-write).
+    """
+    arrays = {}
+    with open(path, 'rb') as f:
+        archive = zipfile.ZipFile(f)
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise RuntimeError('Cannot memory map compressed array %s' % info.filename)
+            # Skip the local file header to the start of the .npy data
+            f.seek(info.header_offset + 26)
+            nameLength, extraLength = np.fromfile(f, dtype='<u2', count=2)
+            f.seek(info.header_offset + 30 + nameLength + extraLength)
+            npyversion = np.lib.format.read_magic(f)
+            if npyversion == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if dtype.hasobject or 0 in shape:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode=mode, offset=f.tell(),
+                                         shape=shape, order='F' if fortran else 'C')
+        archive.close()
+    return arrays
+
+
+def loadBinaryMesh(path, mmap=True):
+    """
+    Load a binary mesh file. With mmap, the arrays are memory mapped
+    (read-only) instead of read into memory.
+    """
+    log.debug("Loading binary mesh %s.", path)
+    if mmap:
+        arrays = mapArrays(path)
+    else:
+        npzfile = np.load(path)
+        arrays = dict((name, npzfile[name]) for name in npzfile.files)
+        npzfile.close()
+    return BinaryMesh(arrays)
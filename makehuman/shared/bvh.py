@@ -44,6 +44,7 @@ import log
 
 import numpy as np
 import transformations as tm
+from files3d import packStringList, unpackStringList
 
 import os.path
 
@@ -319,12 +320,31 @@ class BVH():
         words = self.__expectKeyword('Frame', fp) # Time:
         self.frameTime = float(words[2])
 
-        for i in range(self.frameCount):
-            line = fp.readline()
-            words = line.split()
-            data = [float(word) for word in words]
-            for joint in self.getJointsBVHOrder():
-                data = self.__processChannelData(joint, data)
+        # Parse the data of all frames at once, and distribute its columns
+        # among the joints
+        lines = [fp.readline() for i in xrange(self.frameCount)]
+        joints = self.getJointsBVHOrder()
+        nChannels = sum([len(joint.channels) for joint in joints])
+        # Only take the bulk path if every frame has exactly one value per
+        # channel, a short frame followed by a long one would otherwise
+        # shift the channels of both
+        if all([len(line.split()) == nChannels for line in lines]):
+            data = np.fromstring(''.join(lines), dtype=np.float64, sep=' ')
+        else:
+            data = None
+        if data is not None and len(data) == self.frameCount * nChannels:
+            data = data.reshape(self.frameCount, nChannels).astype(np.float32)
+            chanIdx = 0
+            for joint in joints:
+                joint.frames = data[:, chanIdx:chanIdx+len(joint.channels)].ravel()
+                chanIdx += len(joint.channels)
+        else:
+            # Frames with missing or extra channel data, parse frame by frame
+            for line in lines:
+                words = line.split()
+                data = [float(word) for word in words]
+                for joint in joints:
+                    data = self.__processChannelData(joint, data)
 
         self.__cacheGetJoints()
 
@@ -332,6 +352,77 @@ class BVH():
         for joint in self.getJoints():
             joint.calculateFrames()     # TODO we don't need to calculate pose matrices for end effectors
 
+    def toArrays(self):
+        """
+        The joint hierarchy and motion of this BVH as a dict of arrays, from
+        which fromArrays restores it without parsing the file and calculating
+        the pose matrices again (see animationcache).
+        Joints are stored in BVH order, with their offsets already converted
+        to Y-up.
+        """
+        joints = self.getJointsBVHOrder()
+        jointIdx = dict((id(joint), idx) for idx, joint in enumerate(joints))
+        jointstr, jointidx = packStringList(joint.name for joint in joints)
+        chanstr, chanidx = packStringList(channel for joint in joints for channel in joint.channels)
+        rotstr, rotidx = packStringList(joint.rotOrder for joint in joints)
+        frameidx = np.zeros(len(joints)+1, dtype=np.int32)
+        frameidx[1:] = np.cumsum([len(joint.frames) for joint in joints])
+
+        return dict(
+            jointstr = jointstr,
+            jointidx = jointidx,
+            parents = np.array([jointIdx[id(joint.parent)] if joint.parent else -1 for joint in joints], dtype=np.int32),
+            offsets = np.array([joint.offset for joint in joints], dtype=np.float32).reshape(-1, 3),
+            nchannels = np.array([len(joint.channels) for joint in joints], dtype=np.int32),
+            chanstr = chanstr,
+            chanidx = chanidx,
+            rotstr = rotstr,
+            rotidx = rotidx,
+            frames = np.concatenate([np.asarray(joint.frames, dtype=np.float32) for joint in joints]),
+            frameidx = frameidx,
+            poses = np.array([joint.matrixPoses for joint in joints], dtype=np.float32).reshape(len(joints), self.frameCount, 3, 4),
+            framecount = np.array([self.frameCount], dtype=np.int32),
+            frametime = np.array([self.frameTime], dtype=np.float64),
+            zup = np.array([self.convertFromZUp], dtype=np.bool_),
+            translation = np.fromstring(self.allowTranslation, dtype='S1'))
+
+    def fromArrays(self, arrays):
+        """
+        Restore the joint hierarchy and motion stored by toArrays. The frames
+        and pose matrices of the joints are views of the stored arrays.
+        """
+        # Plain array views, indexing (memory mapped) subclasses is slow
+        arrays = dict((name, np.asarray(array)) for name, array in arrays.items())
+        names = unpackStringList(arrays['jointstr'], arrays['jointidx'])
+        channels = unpackStringList(arrays['chanstr'], arrays['chanidx'])
+        rotOrders = unpackStringList(arrays['rotstr'], arrays['rotidx'])
+        chanOffsets = np.zeros(len(names)+1, dtype=np.int32)
+        chanOffsets[1:] = np.cumsum(arrays['nchannels'])
+        frameOffsets = arrays['frameidx']
+        parents = arrays['parents'].tolist()
+
+        self.frameCount = int(arrays['framecount'][0])
+        self.frameTime = float(arrays['frametime'][0])
+        self.allowTranslation = arrays['translation'].tostring()
+
+        # Offsets are stored converted already
+        self.convertFromZUp = False
+        for idx, name in enumerate(names):
+            joint = self.__addJoint(name)
+            parentIdx = parents[idx]
+            if parentIdx < 0:
+                self.rootJoint = joint
+            else:
+                self.bvhJoints[parentIdx].addChild(joint)
+            self.__calcPosition(joint, arrays['offsets'][idx])
+            joint.channels = channels[chanOffsets[idx]:chanOffsets[idx+1]]
+            joint.frames = arrays['frames'][frameOffsets[idx]:frameOffsets[idx+1]]
+            joint.rotOrder = rotOrders[idx]
+            joint.matrixPoses = arrays['poses'][idx]
+        self.convertFromZUp = bool(arrays['zup'][0])
+
+        self.__cacheGetJoints()
+
     def _autoGuessCoordinateSystem(self):
         """
         Guesses whether this BVH rig uses a Y-up or Z-up axis system, using the
@@ -952,15 +1043,7 @@ class BVHJoint():
             # TODO allow partial rotation channels too?
             pass
         elif len(rotAngles) >= 3:
-            for frameIdx in range(nFrames):
-                self.matrixPoses[frameIdx,:3,:3] = tm.euler_matrix(rotAngles[2][frameIdx], rotAngles[1][frameIdx], rotAngles[0][frameIdx], axes=rotOrder)[:3,:3]
-
-            # TODO eliminate loop with numpy?
-            '''
-            for rotAngle in rotAngles:  
-                self.matrixPoses[:] = tm.euler_matrix(rotAngle[2], rotAngle[1], rotAngle[0], axes=rotOrder))
-            # unfortunately tm.euler_matrix is not a np ufunc
-            '''
+            self.matrixPoses[:,:3,:3] = eulerMatrices(rotAngles[2], rotAngles[1], rotAngles[0], axes=rotOrder)
 
         # Add translations to pose matrices
         # Allow partial transformation channels too
@@ -1001,6 +1084,57 @@ class BVHJoint():
         return not self.hasChildren()
 
 
+def eulerMatrices(ai, aj, ak, axes='sxyz'):
+    """
+    Rotation matrices for arrays of Euler angles, as (n, 3, 3) array.
+    Vectorized version of transformations.euler_matrix, giving the same
+    results for each set of angles.
+    """
+    try:
+        firstaxis, parity, repetition, frame = tm._AXES2TUPLE[axes]
+    except (AttributeError, KeyError):
+        tm._TUPLE2AXES[axes]  # validation
+        firstaxis, parity, repetition, frame = axes
+
+    i = firstaxis
+    j = tm._NEXT_AXIS[i+parity]
+    k = tm._NEXT_AXIS[i-parity+1]
+
+    if frame:
+        ai, ak = ak, ai
+    if parity:
+        ai, aj, ak = -ai, -aj, -ak
+
+    ai, aj, ak = [np.asarray(a, dtype=np.float64) for a in (ai, aj, ak)]
+    si, sj, sk = np.sin(ai), np.sin(aj), np.sin(ak)
+    ci, cj, ck = np.cos(ai), np.cos(aj), np.cos(ak)
+    cc, cs = ci*ck, ci*sk
+    sc, ss = si*ck, si*sk
+
+    M = np.zeros((len(ai), 3, 3), dtype=np.float64)
+    if repetition:
+        M[:, i, i] = cj
+        M[:, i, j] = sj*si
+        M[:, i, k] = sj*ci
+        M[:, j, i] = sj*sk
+        M[:, j, j] = -cj*ss+cc
+        M[:, j, k] = -cj*cs-sc
+        M[:, k, i] = -sj*ck
+        M[:, k, j] = cj*sc+cs
+        M[:, k, k] = cj*cc-ss
+    else:
+        M[:, i, i] = cj*ck
+        M[:, i, j] = sj*sc-cs
+        M[:, i, k] = sj*cc+ss
+        M[:, j, i] = cj*sk
+        M[:, j, j] = sj*ss+cc
+        M[:, j, k] = sj*cs-sc
+        M[:, k, i] = -sj
+        M[:, k, j] = cj*si
+        M[:, k, k] = cj*ci
+    return M
+
+
 def load(filename, convertFromZUp="auto", allowTranslation="onlyroot"):
     """
     convertFromZUp      determine whether to convert the joint structure from
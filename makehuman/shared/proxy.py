@@ -114,6 +114,12 @@ class Proxy:
 
         self.deleteVerts = np.zeros(human.meshData.getVertexCount(), bool)
 
+        self.fitted_to_rest = False  # Last fitted to the rest pose of the human, without the fast approximation
+
+        self._fitBuffers = {}       # Scratch buffers for fitting, by name (see _getFitBuffer)
+        self._fitIndices = None     # ref_vIdxs, and its layout for gathering human vertices (see _getFitIndices)
+        self._fitOffsets = None     # TMatrix, and the offsets transformed with it (see getCoords)
+
 
     @property
     def material_file(self):
@@ -212,44 +218,70 @@ class Proxy:
                 _addProxyVertWeight(self.vertWeights, self.ref_vIdxs[pxy_vIdx, 1], pxy_vIdx, self.weights[pxy_vIdx, 1])
                 _addProxyVertWeight(self.vertWeights, self.ref_vIdxs[pxy_vIdx, 2], pxy_vIdx, self.weights[pxy_vIdx, 2])
 
-    def getCoords(self, fit_to_posed=False):
+    def _getFitBuffer(self, name, shape, dtype):
+        """
+        Scratch buffer for fitting with the specified name, allocated on
+        first use and reused by every later fit of this proxy.
+        """
+        buf = self._fitBuffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self._fitBuffers[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def _getFitIndices(self):
+        """
+        The reference vertex indices, laid out for gathering the human
+        vertices (see _take): one contiguous index array per column for the
+        old fitting technique, one contiguous array for the new one.
+        """
+        if self._fitIndices is None or self._fitIndices[0] is not self.ref_vIdxs:
+            if self.new_fitting:
+                layout = np.ascontiguousarray(self.ref_vIdxs, dtype=np.intp)
+            else:
+                layout = [np.ascontiguousarray(self.ref_vIdxs[:,c], dtype=np.intp) for c in xrange(3)]
+            self._fitIndices = (self.ref_vIdxs, layout)
+        return self._fitIndices[1]
+
+    def getCoords(self, fit_to_posed=False, out=None):
+        """
+        Old (v1.0) proxy fitting technique. If out is given, the coordinates
+        are written to it (for example the coord array of the proxy mesh).
+        """
         if fit_to_posed:
             hcoord = self.human.meshData.coord
         else:
             hcoord = self.human.getRestposeCoordinates()
+
+        # Transformed offsets are only recalculated when the matrix changed
         matrix = self.tmatrix.getMatrix(hcoord)
+        if self._fitOffsets is None or self._fitOffsets[0] is not matrix:
+            self._fitOffsets = (matrix, np.dot(matrix, self.offsets.transpose()).transpose())
+        offsets = self._fitOffsets[1]
 
-        ref_vIdxs = self.ref_vIdxs
+        ref_vIdxs = self._getFitIndices()
         weights = self.weights
+        nverts = len(weights)
 
-        coord = (
-            hcoord[ref_vIdxs[:,0]] * weights[:,0,None] +
-            hcoord[ref_vIdxs[:,1]] * weights[:,1,None] +
-            hcoord[ref_vIdxs[:,2]] * weights[:,2,None] +
-            np.dot(matrix, self.offsets.transpose()).transpose()
-            )
+        coord = self._getFitBuffer('coord', (nverts, 3), hcoord.dtype)
+        tmp = self._getFitBuffer('gather', (nverts, 3), hcoord.dtype)
+        _take(hcoord, ref_vIdxs[0], coord)
+        coord *= weights[:,0,None]
+        for c in [1, 2]:
+            _take(hcoord, ref_vIdxs[c], tmp)
+            tmp *= weights[:,c,None]
+            coord += tmp
 
-        return coord
+        return np.add(coord, offsets, out=out)
 
-    def getCoordsNew(self, fit_to_posed=False, fast=False):
+    def getCoordsNew(self, fit_to_posed=False, fast=False, out=None):
         """New proxy fitting technique, using offset vector in polygon-local
         base, based on an algorithm originally found in ManuelBastioniLab 1.0.0.
         This fitting technique works a lot better on posed meshes, and allows for more stable proxies,
         but most importantly, it's a lot easier to create proxies using this
         fitting technique.
+        If out is given, the coordinates are written to it (for example the
+        coord array of the proxy mesh).
         """
-        def average_basis_matrices(vec0, vec1, vec2, normalize=True):
-            if normalize:
-                vec0 /= np.sqrt(np.sum(vec0 ** 2, axis=-1))[:,None]
-                vec1 /= np.sqrt(np.sum(vec1 ** 2, axis=-1))[:,None]
-                vec2 /= np.sqrt(np.sum(vec2 ** 2, axis=-1))[:,None]
-
-            M = np.zeros((len(vec0), 3,3), dtype=np.float32)
-            M[:,:,0] = vec0
-            M[:,:,1] = vec1
-            M[:,:,2] = vec2
-            return M
-
         hmesh = self.human.meshData
         if fit_to_posed:
             hcoord = self.human.meshData.coord
@@ -259,37 +291,58 @@ class Proxy:
         # Inputs:
         # ref_vIdxs: basemesh vertex indices (a quad), format: [[vidx1,vidx2,vidx3,vidx4], ...] every inner list a face
         # deltas: delta vectors in face-local space, format: [[d1,d2,d3], ...]
-        verts = hcoord[self.ref_vIdxs]
+        # All intermediate results are written to the scratch buffers of this proxy
+        ref_vIdxs = self._getFitIndices()
+        nverts = len(ref_vIdxs)
+        dtype = hcoord.dtype
+        verts = self._getFitBuffer('verts', ref_vIdxs.shape + (3,), dtype)
+        _take(hcoord, ref_vIdxs, verts)
 
         # Calculate polygon centers (naive way: take the average, same as Blender)
-        centers = np.sum(verts, axis=1) / hmesh.vertsPerPrimitive
+        centers = self._getFitBuffer('centers', (nverts, 3), dtype)
+        np.sum(verts, axis=1, out=centers)
+        centers /= hmesh.vertsPerPrimitive
 
         # Calculate normals
         v1 = verts[:,0,:]
         v2 = verts[:,1,:]
         v3 = verts[:,2,:]
-        va = v1 - v2
-        vb = v1 - v3
-        normals = np.cross(va, vb)
+        va = self._getFitBuffer('va', (nverts, 3), dtype)
+        vb = self._getFitBuffer('vb', (nverts, 3), dtype)
+        tmp = self._getFitBuffer('tmp', (nverts,), dtype)
+        np.subtract(v1, v2, out=va)
+        np.subtract(v1, v3, out=vb)
+
+        # Local base matrix, with the base vectors written directly to its columns
+        M = self._getFitBuffer('M', (nverts, 3, 3), np.float32)
+        vec0 = M[:,:,0]
+        vec1 = M[:,:,1]
+        vec2 = M[:,:,2]
+        normals = _cross(va, vb, self._getFitBuffer('normals', (nverts, 3), dtype), tmp)
         if not fast and hmesh.vertsPerPrimitive == 4:
             # In case of quads
             # TODO we can speed up if we assume planar quads, so triangle normal should be enough
             v4 = verts[:,3,:]
-            vc = v3 - v4
-            normals2 = np.cross(vb, vc)
-            normals = np.sqrt(normals **2 + normals2 **2)  # average normals
-
-        # Calculate local base matrix
-        vec0 = normals
-        vec1 = centers - v1
-        vec2 = np.cross(centers, vec1)
-        M = average_basis_matrices(vec0, vec1, vec2)
+            vc = np.subtract(v3, v4, out=va)
+            normals2 = _cross(vb, vc, self._getFitBuffer('normals2', (nverts, 3), dtype), tmp)
+            # Average normals
+            np.square(normals, out=normals)
+            np.square(normals2, out=normals2)
+            normals += normals2
+            np.sqrt(normals, out=normals)
+        vec0[...] = normals
+        np.subtract(centers, v1, out=va)
+        vec1[...] = va
+        vec2[...] = _cross(centers, va, vb, tmp)
+
+        length = self._getFitBuffer('length', (nverts,), np.float32)
+        for vec in [vec0, vec1, vec2]:
+            _normalize(vec, va, length)
 
         # Calculate proxy mesh coordinates (delta_vectors = M * deltas)
-        #delta_vectors = np.sum(M * deltas[:,None,:], axis=-1)
-        # Might be slightly faster:
-        delta_vectors = np.einsum('ijk,ikl -> ij', M, self.deltas[:,:,None])
-        return centers + delta_vectors
+        delta_vectors = self._getFitBuffer('delta', (nverts, 3), np.float32)
+        np.einsum('ijk,ikl -> ij', M, self.deltas[:,:,None], out=delta_vectors)
+        return np.add(centers, delta_vectors, out=out)
 
     @property
     def new_fitting(self):
@@ -297,14 +350,27 @@ class Proxy:
 
     def update(self, mesh, fit_to_posed=False, fast=False):
         #log.debug("Updating proxy %s.", self.name)
+        # Fitted directly into the coordinates of the mesh
         if self.new_fitting:
-            proxy_coords = self.getCoordsNew(fit_to_posed, fast)
+            self.getCoordsNew(fit_to_posed, fast, out=mesh.coord)
         else:
             # Old v1.0 fitting algorithm
-            proxy_coords = self.getCoords(fit_to_posed)
+            self.getCoords(fit_to_posed, out=mesh.coord)
 
-        mesh.changeCoords(proxy_coords)
+        mesh.markCoords(coor=True)
         mesh.calcNormals()
+        self.fitted_to_rest = not (fit_to_posed or fast)
+
+    def dependsOnVertices(self, vertexMask):
+        """
+        Whether the fitted coordinates of this proxy (see update()) depend on
+        any of the human vertices selected by vertexMask.
+        """
+        if vertexMask[self.ref_vIdxs].any():
+            return True
+        if not self.new_fitting:
+            return bool(vertexMask[self.tmatrix.getReferenceVertices()].any())
+        return False
 
     def getUuid(self):
         if self.uuid:
@@ -834,6 +900,7 @@ class TMatrix:
         self.shearData = None
         self.lShearData = None
         self.rShearData = None
+        self._cache = None  # Last matrix returned by getMatrix, with the coordinates of its reference vertices
 
 
     def toNumpyStruct(self, npzfile, prefix=""):
@@ -965,6 +1032,19 @@ class TMatrix:
 
 
     def getMatrix(self, hcoord):
+        """
+        The transformation matrix for the specified human coordinates. The
+        same matrix object is returned as long as the coordinates of its
+        reference vertices do not change.
+        """
+        refCoords = hcoord[self.getReferenceVertices()]
+        if self._cache is not None and np.array_equal(self._cache[0], refCoords):
+            return self._cache[1]
+        matrix = self._calcMatrix(hcoord)
+        self._cache = (refCoords, matrix)
+        return matrix
+
+    def _calcMatrix(self, hcoord):
         if self.scaleData:
             matrix = np.identity(3, float)
             for n in range(3):
@@ -985,6 +1065,16 @@ class TMatrix:
             return Unit3
 
 
+    def getReferenceVertices(self):
+        """
+        Indices of the human vertices that getMatrix() is calculated from.
+        """
+        for data in [self.scaleData, self.shearData, self.lShearData, self.rShearData]:
+            if data:
+                return [entry[i] for entry in data if entry is not None for i in (0, 1)]
+        return []
+
+
     def matrixFromShear(self, shear, hcoord):
         from transformations import affine_matrix_from_points
 
@@ -1016,6 +1106,45 @@ def vertsToNumpy(verts):
 
 
 
+def _take(a, indices, out):
+    """
+    Gather the rows of array a with the specified indices into out. The rest
+    coordinates of an animated mesh are a view on its (n, 4) coordinates, for
+    which np.take would copy the whole array first, so those are gathered
+    with fancy indexing.
+    """
+    if a.flags.c_contiguous:
+        return np.take(a, indices, axis=0, out=out)
+    out[...] = a[indices]
+    return out
+
+def _cross(a, b, out, tmp):
+    """
+    Cross product of the (n, 3) vector arrays a and b, like np.cross, but
+    written to out using the scratch array tmp.
+    """
+    np.multiply(a[:,1], b[:,2], out=out[:,0])
+    np.multiply(a[:,2], b[:,1], out=tmp)
+    out[:,0] -= tmp
+    np.multiply(a[:,2], b[:,0], out=out[:,1])
+    np.multiply(a[:,0], b[:,2], out=tmp)
+    out[:,1] -= tmp
+    np.multiply(a[:,0], b[:,1], out=out[:,2])
+    np.multiply(a[:,1], b[:,0], out=tmp)
+    out[:,2] -= tmp
+    return out
+
+def _normalize(vec, tmp, length):
+    """
+    Normalize the (n, 3) vector array vec in place, using the scratch arrays
+    tmp (n, 3) and length (n,).
+    """
+    np.square(vec, out=tmp)
+    np.sum(tmp, axis=-1, out=length)
+    np.sqrt(length, out=length)
+    vec /= length[:,None]
+
+
 def _getFileName(folder, file, suffix):
     (name, ext) = os.path.split(file)
     if ext:
@@ -77,6 +77,16 @@ class Skeleton(object):
         self.boneslist = None  # Breadth-first ordered list of all bones
         self.roots = []     # Root bones of this skeleton, a skeleton can have multiple root bones.
 
+        # Matrices of all bones (see Bone), as (nBones, 4, 4) arrays in
+        # breadth-first order, allocated together with the bone list
+        self._matRestGlobal = None
+        self._matRestRelative = None
+        self._matPose = None
+        self._matPoseGlobal = None
+        self._matPoseVerts = None
+        self._invRestCache = None   # (rest matrices, their inverse)
+        self._levels = None         # Bone and parent indices per hierarchy level
+
         self.joint_pos_idxs = {}  # Lookup by joint name referencing vertex indices on the human, to determine joint position
         self.planes = {}    # Named planes defined between joints, used for calculating bone roll angle
         self.plane_map_strategy = 3  # The remapping strategy used by addReferencePlanes() for remapping orientation planes from a reference skeleton
@@ -437,6 +447,21 @@ class Skeleton(object):
         else:
             return _getHumanJointPosition(human, joint_name, rest_coord)
 
+    def getJointVertices(self, human):
+        """
+        Indices of the human vertices that the joint positions of this
+        skeleton are calculated from (see getJointPosition): the vertices
+        mapped to its joints, and those of all joint helpers of the basemesh,
+        which are used for joints without vertex mapping.
+        """
+        v_idxs = [np.asarray(v, dtype=np.uint32) for v in self.joint_pos_idxs.values()]
+        helpers = [fg.name for fg in human.meshData.faceGroups if fg.name.startswith('joint-')]
+        if helpers:
+            v_idxs.append(human.meshData.getVerticesForGroups(helpers).astype(np.uint32))
+        if not v_idxs:
+            return np.zeros(0, dtype=np.uint32)
+        return np.unique(np.concatenate(v_idxs))
+
     def __repr__(self):
         return ("  <Skeleton %s>" % self.name)
 
@@ -528,8 +553,86 @@ class Skeleton(object):
         """
         Update skeleton pose matrices after setting a new pose.
         """
-        for bone in self.getBones():
-            bone.update()
+        try:
+            invRest = self.getInverseRestMatrices()
+        except la.LinAlgError:
+            # Update bone by bone, skipping the bones with a singular rest matrix
+            for bone in self.getBones():
+                bone.update()
+            return
+        self.getGlobalPoseMatrices(self._matPose, out=self._matPoseGlobal)
+        np.matmul(self._matPoseGlobal, invRest, out=self._matPoseVerts)
+
+    def getBoneLevels(self):
+        """
+        The bones grouped per level in the hierarchy, as a list of (bone
+        indices, parent bone indices) per level, with parent indices None for
+        the root bones.
+        """
+        self.getBones()
+        return self._levels
+
+    def getRestMatrices(self):
+        """
+        Global rest matrices of all bones, as (nBones, 4, 4) array.
+        """
+        self.getBones()
+        return self._matRestGlobal
+
+    def getInverseRestMatrices(self):
+        """
+        Inverse of the global rest matrices of all bones, cached as long as the
+        rest matrices do not change.
+        """
+        rest = self.getRestMatrices()
+        if self._invRestCache is None or not np.array_equal(self._invRestCache[0], rest):
+            self._invRestCache = (rest.copy(), la.inv(rest))
+        return self._invRestCache[1]
+
+    def getLocalPoseMatrices(self, poseMats):
+        """
+        Convert poses (an array of nBones pose matrices, or of several frames
+        of nBones pose matrices) from global coordinates to pose matrices
+        relative to the local bone rest axes, as setPose does.
+        """
+        rest = self.getRestMatrices()
+        invRest = self.getInverseRestMatrices()
+        nBones = len(rest)
+        poseMats = poseMats[...,:nBones,:,:]
+
+        matPose = np.zeros(poseMats.shape[:-2] + (4,4), dtype=np.float32)
+
+        # Calculate rotations
+        matPose[...,:3,:3] = poseMats[...,:3,:3]
+        matPose[...,3,3] = 1
+        matPose = np.matmul(np.matmul(invRest, matPose), rest)
+
+        # Add translations from original
+        if poseMats.shape[-1] == 4:
+            # Note: we generally only have translations on the root bone
+            # Describe translation in bone-local axis directions
+            matPose[...,:3,3] = np.matmul(invRest[:,:3,:3], poseMats[...,:3,3,None])[...,0]
+        else:
+            # No translation
+            matPose[...,:3,3] = 0
+        return matPose
+
+    def getGlobalPoseMatrices(self, matPose, out=None):
+        """
+        Global pose matrices of all bones for the specified local pose
+        matrices (of one or several frames), calculated one hierarchy level at
+        a time.
+        """
+        levels = self.getBoneLevels()
+        matLocal = np.matmul(self._matRestRelative, matPose)
+        if out is None:
+            out = np.empty_like(matLocal)
+        for b_idxs, p_idxs in levels:
+            if p_idxs is None:
+                out[...,b_idxs,:,:] = matLocal[...,b_idxs,:,:]
+            else:
+                out[...,b_idxs,:,:] = np.matmul(out[...,p_idxs,:,:], matLocal[...,b_idxs,:,:])
+        return out
 
     def updateJoints(self, humanMesh, ref_skel=None):
         """
@@ -557,13 +660,8 @@ class Skeleton(object):
 
         returns     np.array((nBones, 4, 4), dtype=float32)
         """
-        nBones = self.getBoneCount()
-        poseMats = np.zeros((nBones,4,4),dtype=np.float32)
-
-        for bIdx, bone in enumerate(self.getBones()):    # TODO eliminate loop?
-            poseMats[bIdx] = bone.matPose
-
-        return poseMats
+        self.getBones()
+        return self._matPose.copy()
 
     def setPose(self, poseMats):
         """
@@ -574,24 +672,8 @@ class Skeleton(object):
 
         poseMats    np.array((nBones, 4, 4), dtype=float32)
         """
-        for bIdx, bone in enumerate(self.getBones()):
-            bone.matPose = np.identity(4, dtype=np.float32)
-
-            # Calculate rotations
-            bone.matPose[:3,:3] = poseMats[bIdx,:3,:3]
-            invRest = la.inv(bone.matRestGlobal)
-            bone.matPose = np.dot(np.dot(invRest, bone.matPose), bone.matRestGlobal)
-
-            # Add translations from original
-            if poseMats.shape[2] == 4:
-                # Note: we generally only have translations on the root bone
-                trans = poseMats[bIdx,:3,3]
-                trans = np.dot(invRest[:3,:3], trans.T)  # Describe translation in bone-local axis directions
-                bone.matPose[:3,3] = trans.T
-            else:
-                # No translation
-                bone.matPose[:3,3] = [0, 0, 0]
-        # TODO avoid this loop, eg by storing a pre-allocated poseMats np array in skeleton and keeping a reference to a sub-array in each bone. It would allow batch processing of all pose matrices in one np call
+        self.getBones()
+        self._matPose[:] = self.getLocalPoseMatrices(poseMats)
         self.update()
 
     def isInRestPose(self):
@@ -601,8 +683,9 @@ class Skeleton(object):
         return True
 
     def setToRestPose(self):
-        for bone in self.getBones():
-            bone.setToRestPose()
+        self.getBones()
+        self._matPose[:] = np.identity(4, dtype=np.float32)
+        self.update()
 
     def skinMesh(self, meshCoords, vertBoneMapping):
         """
@@ -647,6 +730,32 @@ class Skeleton(object):
             result.append(bone)
             queue.extend(bone.children)
         self.boneslist = result
+        self.__buildMatrixArrays()
+
+    def __buildMatrixArrays(self):
+        """
+        Store the matrices of all bones in one array per matrix type, and make
+        the bone matrices views into these arrays.
+        """
+        bones = self.boneslist
+        for name in Bone.MATRICES:
+            mats = np.empty((len(bones),4,4), dtype=np.float32)
+            for bone in bones:
+                mat = getattr(bone, name)
+                mats[bone.index] = mat if mat is not None else np.identity(4, dtype=np.float32)
+            setattr(self, '_' + name, mats)
+            for bone in bones:
+                bone._bindMatrix(name, mats[bone.index])
+        self._invRestCache = None
+
+        self._levels = []
+        for level in xrange(max([bone.level for bone in bones]) + 1 if bones else 0):
+            levelBones = [bone for bone in bones if bone.level == level]
+            b_idxs = np.asarray([bone.index for bone in levelBones], dtype=np.intp)
+            if level == 0:
+                self._levels.append( (b_idxs, None) )
+            else:
+                self._levels.append( (b_idxs, np.asarray([bone.parent.index for bone in levelBones], dtype=np.intp)) )
 
     def getJointNames(self):
         """
@@ -697,8 +806,38 @@ class Skeleton(object):
         # TODO compare two skeletons (structure only)
 
 
+class _BoneMatrix(object):
+    """
+    Matrix attribute of a bone. Once the skeleton has built its list of bones,
+    the matrix is a view into the matrix array of the skeleton, and setting
+    the attribute copies the new matrix into that array.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, bone, owner):
+        if bone is None:
+            return self
+        return bone._matrices[self.name]
+
+    def __set__(self, bone, value):
+        if value is None:
+            bone._views.discard(self.name)
+        if self.name in bone._views:
+            bone._matrices[self.name][...] = value
+        else:
+            bone._matrices[self.name] = value
+
 class Bone(object):
 
+    MATRICES = ['matRestGlobal', 'matRestRelative', 'matPose', 'matPoseGlobal', 'matPoseVerts']
+
+    matRestGlobal = _BoneMatrix('matRestGlobal')
+    matRestRelative = _BoneMatrix('matRestRelative')
+    matPose = _BoneMatrix('matPose')
+    matPoseGlobal = _BoneMatrix('matPoseGlobal')
+    matPoseVerts = _BoneMatrix('matPoseVerts')
+
     def __init__(self, skel, name, parentName, headJoint, tailJoint, roll=0, reference_bones=None, weight_reference_bones=None):
         """
         Construct a new bone for specified skeleton.
@@ -754,13 +893,25 @@ class Bone(object):
         #  matPose:           4x4 pose matrix, relative parent and own rest pose
         #  matPoseGlobal:     4x4 matrix, relative world
         #  matPoseVerts:      4x4 matrix, relative world and own rest pose
+        # These are views into the matrix arrays of the skeleton, once it has
+        # built its list of bones.
 
+        self._matrices = {}
+        self._views = set()
         self.matRestGlobal = None
         self.matRestRelative = None
         self.matPose = np.identity(4, np.float32)  # Set pose matrix to rest pose
         self.matPoseGlobal = None
         self.matPoseVerts = None
 
+    def _bindMatrix(self, name, view):
+        """
+        Store the matrix with specified name in view (a row of the matrix array
+        of the skeleton).
+        """
+        self._matrices[name] = view
+        self._views.add(name)
+
     @property
     def planes(self):
         return self.skeleton.planes
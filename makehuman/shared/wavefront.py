@@ -41,6 +41,7 @@ import os
 import module3d
 import codecs
 import math
+import zlib
 import numpy as np
 from codecs import open  # TODO should Wavefront OBJ files contain unicode characters, or would it be better to strip them?
 
@@ -153,9 +154,132 @@ def loadObjFile(path, obj = None):
     return obj
 
 
-def splitSections(filepath, filename, meshes, joints, config=None, filterMaskedFaces=True):
-    vertices = []
+# Body sections written to the Indices file, in file order
+SECTION_NAMES = ["Torso", "Skirt", "Right Leg", "Left Leg", "Right Arm", "Left Arm",
+                 "Right Hand", "Left Hand", "Right Foot", "Left Foot", "Head", "Neck"]
 
+# Sections of the last exported body, reused when the same body is exported again
+_sectionCache = {}
+
+
+def _parsedFloats(values):
+    """
+    Float values as they are read back from their printed representation.
+    """
+    return np.asarray([float(repr(v)) for v in values], dtype=np.float64)
+
+
+def getCrotchLevel(coords):
+    """
+    Lowest Y coordinate of the vertices on the center line (X = 0) of the
+    body. coords is a (nverts, 3) array of exported vertex coordinates.
+    """
+    # Only vertices near the center line need the (slower) exact test on their
+    # printed coordinates
+    candidates = coords[np.abs(coords[:,0].astype(np.float64)) < 1e-5]
+    x = _parsedFloats(candidates[:,0])
+    y = _parsedFloats(candidates[:,1])
+    return float(np.min(y[np.abs(x) < 0.000001]))
+
+
+def classifySections(coords, joints):
+    """
+    Divide the vertices into body sections, using the joint and landmark
+    positions of the body. coords is a (nverts, 3) array of exported vertex
+    coordinates.
+    Returns the crotch level and a dict with the sorted vertex indices of each
+    section in SECTION_NAMES.
+    Every vertex is assigned to the first matching section of head, neck,
+    arms, hands, legs and feet. Leg vertices also belong to the skirt, and
+    to the torso when above the crotch. Remaining vertices between the
+    crotch and the side neck level belong to the torso.
+    """
+    crotch = getCrotchLevel(coords)
+
+    co = coords.astype(np.float64)
+    x = co[:,0]
+    y = co[:,1]
+
+    def joint(name):
+        return np.asarray(joints[name], dtype=np.float64)
+
+    def side(normal, point):
+        """Signed (unnormalized) distance of all vertices to a plane."""
+        d = co - point
+        return normal[0] * d[:,0] + normal[1] * d[:,1] + normal[2] * d[:,2]
+
+    l_normal = joint("Left Wrist") - joint("Left Shoulder")
+    r_normal = joint("Right Wrist") - joint("Right Shoulder")
+
+    # Diagonal planes through the shoulders and the point halfway between
+    # wrist and pelvis, separating arms and hands from the torso
+    r_mid = (joint("Right Wrist") + joint("Right Pelvis")) / 2
+    r_diag_normal = np.cross(r_mid - [0, 0, 1] - joint("Right Shoulder"), r_mid + [0, 0, 1] - joint("Right Shoulder"))
+    l_mid = (joint("Left Wrist") + joint("Left Pelvis")) / 2
+    l_diag_normal = np.cross(l_mid + [0, 0, 1] - joint("Left Shoulder"), l_mid - [0, 0, 1] - joint("Left Shoulder"))
+
+    r_diag = side(r_diag_normal, r_mid) > 0
+    l_diag = side(l_diag_normal, l_mid) > 0
+    r_beyondWrist = side(r_normal, joint("Right Wrist")) > 0
+    l_beyondWrist = side(l_normal, joint("Left Wrist")) > 0
+
+    headY = joints["Head Center"][1] - 0.5
+    pelvisX = joints["Pelvis Center"][0]
+
+    unassigned = np.ones(len(co), dtype=bool)
+    def assign(mask):
+        mask &= unassigned
+        unassigned[mask] = False
+        return mask
+
+    head = assign((y >= headY) & (x < joints["Left Shoulder"][0]) & (x > joints["Right Shoulder"][0]))
+    neck = assign((y < headY) & (y >= joints["Neck Center"][1]))
+    r_arm = assign((x < joints["Right Shoulder"][0]) & (side(r_normal, joint("Right Shoulder")) > 0) & ~r_beyondWrist & r_diag)
+    l_arm = assign((x > joints["Left Shoulder"][0]) & (side(l_normal, joint("Left Shoulder")) > 0) & ~l_beyondWrist & l_diag)
+    r_hand = assign(r_diag & r_beyondWrist)
+    l_hand = assign(l_diag & l_beyondWrist)
+    r_leg = assign((y <= joints["Waist level"][1]) & (y > joints["Right Ankle"][1]) & (x <= pelvisX))
+    l_leg = assign((y <= joints["Waist level"][1]) & (y > joints["Left Ankle"][1]) & (x >= pelvisX))
+    r_foot = assign((x < pelvisX) & (y <= joints["Right Ankle"][1]))
+    l_foot = assign((x > pelvisX) & (y <= joints["Left Ankle"][1]))
+    torso = assign((y < joints["Side Neck level"][1]) & (y > crotch))
+
+    skirt = r_leg | l_leg
+    torso |= skirt & (y > crotch)
+
+    masks = [torso, skirt, r_leg, l_leg, r_arm, l_arm, r_hand, l_hand, r_foot, l_foot, head, neck]
+    sections = dict((name, np.nonzero(mask)[0]) for name, mask in zip(SECTION_NAMES, masks))
+    return crotch, sections
+
+
+def getSections(coords, joints, useCache=True):
+    """
+    Crotch level and body sections of the exported vertex coordinates, as
+    returned by classifySections.
+    When useCache is True, the sections are only recomputed when the
+    coordinates or the joints differ from the previous call.
+    """
+    key = None
+    if useCache:
+        key = (coords.shape, coords.dtype.str, zlib.crc32(coords.tobytes()),
+               tuple(sorted((name, tuple(pos)) for name, pos in joints.items())))
+        if _sectionCache.get('key') == key:
+            return _sectionCache['sections']
+
+    result = classifySections(coords, joints)
+    _sectionCache.clear()
+    if key is not None:
+        _sectionCache['key'] = key
+        _sectionCache['sections'] = result
+    return result
+
+
+def splitSections(filepath, filename, meshes, joints, config=None, filterMaskedFaces=True, useCache=True):
+    """
+    Write the vertex indices of each body section to the Indices file (named
+    filename + "Indices"), and return the crotch level.
+    See getSections for useCache.
+    """
     if config and config.feetOnGround:
         offset = config.offset
     else:
@@ -169,271 +293,33 @@ def splitSections(filepath, filename, meshes, joints, config=None, filterMaskedF
         # Unfiltered
         meshes = [m.clone(scale=scale, filterMaskedVerts=False) for m in meshes]
 
+    coords = np.concatenate([mesh.coord for mesh in meshes]) + offset
+    crotch, sections = getSections(coords, joints, useCache)
 
-    flag = []
-    for i in range(12):
-        flag.append(False)
-
-    h = []
-    n = []
-    t = []
-    la = []
-    lh = []
-    ll = []
-    lf = []
-    ra = []
-    rh = []
-    rl = []
-    rf = []
-    s = []
-
-    idx = 0
-    h_c = 0
-    n_c = 0
-    t_c = 0
-    la_c = 0
-    lh_c = 0
-    ll_c = 0
-    lf_c = 0
-    ra_c = 0
-    rh_c = 0
-    rl_c = 0
-    rf_c = 0
-    s_c = 0
-
-    l_normal = np.subtract(np.array(joints["Left Wrist"]), np.array(joints["Left Shoulder"]))
-    r_normal = np.subtract(np.array(joints["Right Wrist"]), np.array(joints["Right Shoulder"]))
-
-    r_mid = [(joints["Right Wrist"][0] + joints["Right Pelvis"][0])/2, (joints["Right Wrist"][1] + joints["Right Pelvis"][1])/2, (joints["Right Wrist"][2] + joints["Right Pelvis"][2])/2]
-    r_mid1 = [r_mid[0], r_mid[1], r_mid[2]-1]
-    r_mid2 = [r_mid[0], r_mid[1], r_mid[2]+1]
-
-    p1 = np.array(joints["Right Shoulder"])
-    p2 = np.array(r_mid1)
-    p3 = np.array(r_mid2)
-    v2 = p2 - p1
-    v3 = p3 - p1
-    r_diag_normal =  np.cross(v2, v3)
-
-    l_mid = [(joints["Left Wrist"][0] + joints["Left Pelvis"][0])/2, (joints["Left Wrist"][1] + joints["Left Pelvis"][1])/2, (joints["Left Wrist"][2] + joints["Left Pelvis"][2])/2]
-    l_mid1 = [l_mid[0], l_mid[1], l_mid[2]+1]
-    l_mid2 = [l_mid[0], l_mid[1], l_mid[2]-1]
-
-    p1 = np.array(joints["Left Shoulder"])
-    p2 = np.array(l_mid1)
-    p3 = np.array(l_mid2)
-    v2 = p2 - p1
-    v3 = p3 - p1
-    l_diag_normal =  np.cross(v2, v3)
-
-    pel_1 = [joints["Pelvis Center"][0], joints["Pelvis Center"][1], joints["Pelvis Center"][2] - 1]
-    pel_2 = [joints["Pelvis Center"][0], joints["Pelvis Center"][1], joints["Pelvis Center"][2] + 1]
-    p1 = np.array(joints["Pelvis Center"])
-    p2 = np.array(pel_1)
-    p3 = np.array(pel_2)
-    v2 = p2 - p1
-    v3 = p3 - p1
-
-    flatten = []
-    crotch = -1.0
-    for mesh in meshes:
-        # Get max Y val
-        for co in mesh.coord:
-            l = str(tuple(co + offset))
-            l = l.replace('(', '')
-            l = l.replace(')', '')
-            sx, sy, sz = l.split(', ')
-            x = float(sx)
-            y = float(sy)
-            z = float(sz)
-
-            #if x >= -0.0001 and x <= 0.0001:
-            if abs(x) < 0.000001:
-                flatten.append(y)
-
-    flatten.sort()
-    crotch = flatten[0]
-
-    for mesh in meshes:
-        for co in mesh.coord:
-            tt = tuple(co + offset)
-            x = float(tt[0])
-            y = float(tt[1])
-            z = float(tt[2])
-
-            vert = np.array([x, y, z])
-
-
-            # Head
-            if y >= joints["Head Center"][1]-0.5 and x < joints["Left Shoulder"][0] and x > joints["Right Shoulder"][0]:
-                if not flag[10]: # First access
-                    h.append("Name=Head\n")
-                    h.append("") # Node=??\n
-                    flag[10] = True
-                h.append(str(idx) + "\n")
-                #h_c += 1
-
-            # Neck
-            elif y < joints["Head Center"][1]-0.5 and y >= joints["Neck Center"][1]:
-                if not flag[11]:
-                    n.append("Name=Neck\n")
-                    n.append("")
-                    flag[11] = True
-                n.append(str(idx) + "\n")
-                #n_c += 1
-
-            # Right Arm
-            elif x < joints["Right Shoulder"][0] and np.dot(r_normal, vert - np.array(joints["Right Shoulder"])) > 0 and np.dot(r_normal, vert - np.array(joints["Right Wrist"])) <= 0 and np.dot(r_diag_normal, vert - r_mid) > 0:
-                if not flag[4]:
-                    ra.append("Name=Right Arm\n")
-                    ra.append("")
-                    flag[4] = True
-                ra.append(str(idx) + "\n")
-                #ra_c += 1
-
-            # Left Arm
-            elif x > joints["Left Shoulder"][0] and np.dot(l_normal, vert - np.array(joints["Left Shoulder"])) > 0 and np.dot(l_normal, vert - np.array(joints["Left Wrist"])) <= 0 and np.dot(l_diag_normal, vert - l_mid) > 0:
-                if not flag[5]:
-                    la.append("Name=Left Arm\n")
-                    la.append("")
-                    flag[5] = True
-                la.append(str(idx) + "\n")
-                #la_c += 1
-
-            # Right Hand
-            elif np.dot(r_diag_normal, vert - r_mid) > 0 and np.dot(r_normal, vert - np.array(joints["Right Wrist"])) > 0:
-                if not flag[6]:
-                    rh.append("Name=Right Hand\n")
-                    rh.append("")
-                    flag[6] = True
-                rh.append(str(idx) + "\n")
-                #rh_c += 1
-
-            # Left Hand
-            elif np.dot(l_diag_normal, vert-l_mid) > 0 and np.dot(l_normal, vert - np.array(joints["Left Wrist"])) > 0:
-                if not flag[7]:
-                    lh.append("Name=Left Hand\n")
-                    lh.append("")
-                    flag[7] = True
-                lh.append(str(idx) + "\n")
-                #lh_c += 1
-
-
-            # Right Leg
-            elif y <= joints["Waist level"][1] and y > joints["Right Ankle"][1] and x <= joints["Pelvis Center"][0]:
-                if not flag[2]:
-                    rl.append("Name=Right Leg\n")
-                    rl.append("")
-                    flag[2] = True
-                rl.append(str(idx) + "\n")
-                #rl_c += 1
-
-                if not flag[1]:
-                    s.append("Name=Skirt\n")
-                    s.append("")
-                    flag[1] = True
-                s.append(str(idx) + "\n")
-                #s_c += 1
-
-                if y > crotch: 
-                    if not flag[0]:
-                        t.append("Name=Torso\n")
-                        t.append("")
-                        flag[0] = True
-                    t.append(str(idx) + "\n")
-
-            # Left Leg
-            elif y <= joints["Waist level"][1] and y > joints["Left Ankle"][1] and x >= joints["Pelvis Center"][0]:
-                if not flag[3]:
-                    ll.append("Name=Left Leg\n")
-                    ll.append("")
-                    flag[3] = True
-                ll.append(str(idx) + "\n")
-                #ll_c += 1
-
-                if not flag[1]:
-                    s.append("Name=Skirt\n")
-                    s.append("")
-                    flag[1] = True
-                s.append(str(idx) + "\n")
-                #s_c += 1
-
-                if y > crotch: 
-                    if not flag[0]:
-                        t.append("Name=Torso\n")
-                        t.append("")
-                        flag[0] = True
-                    t.append(str(idx) + "\n")
-
-            # Right Foot
-            elif x < joints["Pelvis Center"][0] and y <= joints["Right Ankle"][1]:
-                if not flag[9]:
-                    rf.append("Name=Right Foot\n")
-                    rf.append("")
-                    flag[9] = True
-                rf.append(str(idx) + "\n")
-                #rf_c += 1
-
-            # Left Foot
-            elif x > joints["Pelvis Center"][0] and y <= joints["Left Ankle"][1]:
-                if not flag[8]:
-                    lf.append("Name=Left Foot\n")
-                    lf.append("")
-                    flag[8] = True
-                lf.append(str(idx) + "\n")
-                #lf_c += 1
-
-
-            # Torso ... 나머지 node 모두 배정 + (0, 0, 0) 과 crotch 사이의 점
-            elif y < joints["Side Neck level"][1] and y > crotch:
-                if not flag[0]:
-                    t.append("Name=Torso\n")
-                    t.append("")
-                    flag[0] = True
-                t.append(str(idx) + "\n")
-                #t_c += 1
-
-            idx += 1
-
-
-
-    h_c = len(h) - 2
-    n_c = len(n) - 2
-    t_c = len(t) - 2
-    la_c = len(la) - 2
-    lh_c = len(lh) - 2
-    ll_c = len(ll) - 2
-    lf_c = len(lf) - 2
-    ra_c = len(ra) - 2
-    rh_c = len(rh) - 2
-    rl_c = len(rl) - 2
-    rf_c = len(rf) - 2
-    s_c = len(s) - 2
-
-    h[1] = "Node=" + str(h_c) + "\n"
-    n[1] = "Node=" + str(n_c) + "\n"
-    t[1] = "Node=" + str(t_c) + "\n"
-    la[1] = "Node=" + str(la_c) + "\n"
-    lh[1] = "Node=" + str(lh_c) + "\n"
-    ll[1] = "Node=" + str(ll_c) + "\n"
-    lf[1] = "Node=" + str(lf_c) + "\n"
-    ra[1] = "Node=" + str(ra_c) + "\n"
-    rh[1] = "Node=" + str(rh_c) + "\n"
-    rl[1] = "Node=" + str(rl_c) + "\n"
-    rf[1] = "Node=" + str(rf_c) + "\n"
-    s[1] = "Node=" + str(s_c) + "\n"
-
-    total = t + s + rl + ll + ra + la + rh + lh + rf + lf + h + n
+    lines = ["Part=%d\n" % len(SECTION_NAMES)]
+    for name in SECTION_NAMES:
+        indices = sections[name]
+        lines.append("Name=%s\n" % name)
+        lines.append("Node=%d\n" % len(indices))
+        lines.append("".join("%d\n" % idx for idx in indices))
 
     c = open(filename+"Indices", "w")
-    c.write("Part=12\n")
-    for l in total:
-        c.write(l)
-
+    c.write("".join(lines))
     c.close()
     return crotch
 
 
+def _writeBlock(fp, lineFormat, data, chunkSize=4096):
+    """
+    Write one line per row of data, formatted with lineFormat, in chunks of
+    chunkSize lines.
+    """
+    data = np.asarray(data)
+    for start in xrange(0, len(data), chunkSize):
+        rows = data[start:start+chunkSize]
+        fp.write((lineFormat * len(rows)) % tuple(rows.ravel().tolist()))
+
+
 #def writeObjFile(path, meshes, writeMTL=True, config=None, filterMaskedFaces=True):
 def writeObjFile(path, meshes, filepath, writeMTL=True, config=None, filterMaskedFaces=True):
     if not isinstance(meshes, list):
@@ -444,9 +330,6 @@ def writeObjFile(path, meshes, filepath, writeMTL=True, config=None, filterMaske
     else:
         fp = open(path, 'w', encoding="utf-8")
 
-    min_y = 0
-    max_y = 0
-
     fp.write(
         "# MakeHuman exported OBJ\n" +
         "# www.makehuman.org\n\n")
@@ -469,43 +352,26 @@ def writeObjFile(path, meshes, filepath, writeMTL=True, config=None, filterMaske
         meshes = [m.clone(scale=scale, filterMaskedVerts=False) for m in meshes]
 
     # Vertices
-    for mesh in meshes:
-        fp.write("".join( ["v %.4f %.4f %.4f\n" % tuple(co + offset) for co in mesh.coord] ))
-
-    flatten = []
-    for mesh in meshes:
-        # Get max Y val
-        for co in mesh.coord:
-            l = str(tuple(co + offset))
-            l = l.replace('(', '')
-            l = l.replace(')', '')
-            sx, sy, sz = l.split(', ')
-            x = float(sx)
-            y = float(sy)
-            z = float(sz)
-
-            #if x >= -0.0001 and x <= 0.0001:
-            if abs(x) < 0.000001:
-                flatten.append(y)
-
-            if y < min_y:
-                min_y = y
-            if y > max_y:
-                max_y = y
-
-    flatten.sort()
-    crotch_y = flatten[0]
+    coords = [mesh.coord + offset for mesh in meshes]
+    for co in coords:
+        _writeBlock(fp, "v %.4f %.4f %.4f\n", co)
+
+    # Vertical bounds (including the origin) of the exported vertices, as
+    # they are read back from their printed coordinates
+    allY = np.concatenate([co[:,1] for co in coords])
+    min_y = min(0, _parsedFloats([allY.min()])[0])
+    max_y = max(0, _parsedFloats([allY.max()])[0])
     centering = (min_y + max_y)/2
 
     # Vertex normals
     if config is None or config.useNormals:
         for mesh in meshes:
-            fp.write("".join( ["vn %.4f %.4f %.4f\n" % tuple(no) for no in mesh.vnorm] ))
+            _writeBlock(fp, "vn %.4f %.4f %.4f\n", mesh.vnorm)
 
     # UV vertices
     for mesh in meshes:
         if mesh.has_uv:
-            fp.write("".join( ["vt %.6f %.6f\n" % tuple(uv) for uv in mesh.texco] ))
+            _writeBlock(fp, "vt %.6f %.6f\n", mesh.texco)
 
     # Faces
     nVerts = 1
@@ -514,34 +380,20 @@ def writeObjFile(path, meshes, filepath, writeMTL=True, config=None, filterMaske
         fp.write("usemtl %s\n" % mesh.material.name)
         fp.write("g %s\n" % mesh.name)
 
+        fverts = mesh.fvert[mesh.face_mask].astype(np.int64) + nVerts
+        if mesh.has_uv:
+            fuvs = mesh.fuvs[mesh.face_mask].astype(np.int64) + nTexVerts
+
         if config is None or config.useNormals:
             if mesh.has_uv:
-                for fn,fv in enumerate(mesh.fvert):
-                    if not mesh.face_mask[fn]:
-                        continue
-                    fuv = mesh.fuvs[fn]
-                    line = [" %d/%d/%d" % (fv[n]+nVerts, fuv[n]+nTexVerts, fv[n]+nVerts) for n in range(4)]
-                    fp.write("f" + "".join(line) + "\n")
+                _writeBlock(fp, "f" + " %d/%d/%d"*4 + "\n", np.dstack([fverts, fuvs, fverts]))
             else:
-                for fn,fv in enumerate(mesh.fvert):
-                    if not mesh.face_mask[fn]:
-                        continue
-                    line = [" %d//%d" % (fv[n]+nVerts, fv[n]+nVerts) for n in range(4)]
-                    fp.write("f" + "".join(line) + "\n")
+                _writeBlock(fp, "f" + " %d//%d"*4 + "\n", np.dstack([fverts, fverts]))
         else:
             if mesh.has_uv:
-                for fn,fv in enumerate(mesh.fvert):
-                    if not mesh.face_mask[fn]:
-                        continue
-                    fuv = mesh.fuvs[fn]
-                    line = [" %d/%d" % (fv[n]+nVerts, fuv[n]+nTexVerts) for n in range(4)]
-                    fp.write("f" + "".join(line) + "\n")
+                _writeBlock(fp, "f" + " %d/%d"*4 + "\n", np.dstack([fverts, fuvs]))
             else:
-                for fn,fv in enumerate(mesh.fvert):
-                    if not mesh.face_mask[fn]:
-                        continue
-                    line = [" %d" % (fv[n]+nVerts) for n in range(4)]
-                    fp.write("f" + "".join(line) + "\n")
+                _writeBlock(fp, "f" + " %d"*4 + "\n", fverts)
 
         nVerts += len(mesh.coord)
         nTexVerts += len(mesh.texco)
@@ -0,0 +1,191 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+
+"""
+OBJ export benchmark
+
+**Project Name:**      MakeHuman
+
+**Product Home Page:** http://www.makehuman.org/
+
+**Code Home Page:**    https://bitbucket.org/MakeHuman/makehuman/
+
+**Authors:**           Jonas Hauquier
+
+**Copyright(c):**      MakeHuman Team 2001-2017
+
+**Licensing:**         AGPL3
+
+    This file is part of MakeHuman (www.makehuman.org).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Abstract
+--------
+
+Compares wavefront.writeObjFile with the reference per-line OBJ writer it
+replaced: verifies that both write byte-identical files and reports their
+timings. Run from the makehuman folder:
+
+    python testsuite/benchmark_objexport.py [repeats]
+"""
+
+import sys
+sys.path = [".", "./lib", "./apps", "./shared", "./core"] + sys.path
+
+import os
+import time
+import tempfile
+import numpy as np
+from codecs import open
+
+
+def referenceWriteObjFile(path, meshes, writeMTL=True, config=None, filterMaskedFaces=True):
+    """
+    The per-vertex and per-face OBJ writer as it was before writeObjFile
+    formatted whole blocks at once (without writing the MTL file).
+    """
+    if not isinstance(meshes, list):
+        meshes = [meshes]
+
+    fp = open(path, 'w', encoding="utf-8")
+
+    min_y = 0
+    max_y = 0
+
+    fp.write(
+        "# MakeHuman exported OBJ\n" +
+        "# www.makehuman.org\n\n")
+
+    if writeMTL:
+        mtlfile = path.replace(".obj",".mtl")
+        fp.write("mtllib %s\n" % os.path.basename(mtlfile))
+
+    scale = config.scale if config is not None else 1.0
+
+    if config and config.feetOnGround:
+        offset = config.offset
+    else:
+        offset = [0,0,0]
+
+    meshes = [m.clone(scale=scale, filterMaskedVerts=filterMaskedFaces) for m in meshes]
+
+    for mesh in meshes:
+        fp.write("".join( ["v %.4f %.4f %.4f\n" % tuple(co + offset) for co in mesh.coord] ))
+
+    for mesh in meshes:
+        for co in mesh.coord:
+            l = str(tuple(co + offset))
+            l = l.replace('(', '')
+            l = l.replace(')', '')
+            sx, sy, sz = l.split(', ')
+            y = float(sy)
+            if y < min_y:
+                min_y = y
+            if y > max_y:
+                max_y = y
+
+    centering = (min_y + max_y)/2
+
+    if config is None or config.useNormals:
+        for mesh in meshes:
+            fp.write("".join( ["vn %.4f %.4f %.4f\n" % tuple(no) for no in mesh.vnorm] ))
+
+    for mesh in meshes:
+        if mesh.has_uv:
+            fp.write("".join( ["vt %.6f %.6f\n" % tuple(uv) for uv in mesh.texco] ))
+
+    nVerts = 1
+    nTexVerts = 1
+    for mesh in meshes:
+        fp.write("usemtl %s\n" % mesh.material.name)
+        fp.write("g %s\n" % mesh.name)
+
+        for fn,fv in enumerate(mesh.fvert):
+            if not mesh.face_mask[fn]:
+                continue
+            if config is None or config.useNormals:
+                if mesh.has_uv:
+                    fuv = mesh.fuvs[fn]
+                    line = [" %d/%d/%d" % (fv[n]+nVerts, fuv[n]+nTexVerts, fv[n]+nVerts) for n in range(4)]
+                else:
+                    line = [" %d//%d" % (fv[n]+nVerts, fv[n]+nVerts) for n in range(4)]
+            else:
+                if mesh.has_uv:
+                    fuv = mesh.fuvs[fn]
+                    line = [" %d/%d" % (fv[n]+nVerts, fuv[n]+nTexVerts) for n in range(4)]
+                else:
+                    line = [" %d" % (fv[n]+nVerts) for n in range(4)]
+            fp.write("f" + "".join(line) + "\n")
+
+        nVerts += len(mesh.coord)
+        nTexVerts += len(mesh.texco)
+
+    fp.close()
+    return centering
+
+
+class BenchmarkConfig(object):
+    def __init__(self, useNormals, scale, yOffset=None):
+        self.useNormals = useNormals
+        self.scale = scale
+        self.feetOnGround = yOffset is not None
+        if self.feetOnGround:
+            self.offset = np.asarray([0.0, yOffset, 0.0], dtype=np.float32)
+
+
+def readFile(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def runBenchmark(repeats=3):
+    import files3d
+    import getpath
+    import guicommon
+    import wavefront
+
+    mesh = files3d.loadMesh(getpath.getSysDataPath("3dobjs/base.obj"), maxFaces = 5)
+    obj = guicommon.Object(mesh)
+    tmpdir = tempfile.mkdtemp()
+    refPath = os.path.join(tmpdir, 'reference.obj')
+    newPath = os.path.join(tmpdir, 'new.obj')
+
+    allIdentical = True
+    for config in [None, BenchmarkConfig(True, 10.0), BenchmarkConfig(False, 1.0), BenchmarkConfig(True, 1.0, 8.3)]:
+        refTime = newTime = 0.0
+        for _ in xrange(repeats):
+            t = time.time()
+            refCentering = referenceWriteObjFile(refPath, [mesh], False, config)
+            refTime += time.time() - t
+
+            t = time.time()
+            newCentering = wavefront.writeObjFile(newPath, [mesh], None, False, config)
+            newTime += time.time() - t
+
+        identical = readFile(refPath) == readFile(newPath) and refCentering == newCentering
+        allIdentical = allIdentical and identical
+        name = "default" if config is None else "normals=%s scale=%s ground=%s" % (config.useNormals, config.scale, config.feetOnGround)
+        print "%-40s reference %.3fs  new %.3fs  identical: %s" % (name, refTime/repeats, newTime/repeats, identical)
+
+    os.remove(refPath)
+    os.remove(newPath)
+    os.rmdir(tmpdir)
+    return allIdentical
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    sys.exit(0 if runBenchmark(repeats) else 1)